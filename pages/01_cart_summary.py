@@ -1,14 +1,11 @@
 import streamlit as st
 import json
-from src.core.solver import solve_cart_split
+from src.core.solve_cache import get_solve_cache
+from src.utils import app_data
 
-# 載入產品資料
-with open("data/raw/products.json", encoding="utf-8") as f:
-    product_list = json.load(f)
-    product_name_map = {p["id"]: p["name"] for p in product_list}
-
-with open("assets/style.css", encoding="utf-8") as f:
-    st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+# 產品資料與樣式每個 process 只載入一次，檔案更新時自動重載
+product_name_map = app_data.catalog().name_map
+app_data.inject_style()
 
 st.title("📑 拆帳明細")
 st.markdown("請上傳購物車 JSON 檔案，查看折扣拆帳與發票結果")
@@ -35,8 +32,8 @@ def render_invoice_card(title, items, discounts, final_price, product_name_map):
 if uploaded_file:
     cart_data = json.load(uploaded_file)
     base_items = cart_data["items"]
-    discounts = json.load(open("data/raw/discounts.json", encoding="utf-8"))
-    result = solve_cart_split(base_items, discounts)
+    # 重新整理頁面時同一台購物車直接取快取；discounts.json 更新時自動失效
+    result = get_solve_cache()(base_items)
 
     st.subheader("🧾 發票明細")
     total_original, total_final, total_discount = 0, 0, 0
@@ -1,8 +1,8 @@
 import streamlit as st
 import json
 import matplotlib.pyplot as plt
-from src.core.solver import solve_cart_split
-from src.ai.predict_addon import recommend_addon
+from src.core.solve_cache import get_solve_cache
+from src.utils import app_data
 
 def draw_discount_comparison(before_discount, after_discount):
     plt.rcParams['font.family'] = 'Microsoft JhengHei'
@@ -39,13 +39,10 @@ def render_invoice_card(title, items, discounts, final_price, product_name_map):
 
 st.title("🛍️ 推薦加購商品")
 
-with open("data/raw/products.json", encoding="utf-8") as f:
-    product_list = json.load(f)
-    product_name_map = {p["id"]: p["name"] for p in product_list}
-    product_dict = {p["id"]: p for p in product_list}
-
-with open("assets/style.css", encoding="utf-8") as f:
-    st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+catalog = app_data.catalog()
+product_name_map = catalog.name_map
+product_dict = catalog.by_id
+app_data.inject_style()
 
 uploaded_file = st.file_uploader("📤 上傳購物車 JSON 檔案", type="json")
 
@@ -53,10 +50,10 @@ if uploaded_file:
     cart_data = json.load(uploaded_file)
     base_items = cart_data["items"]
     base_ids = set(i["id"] for i in base_items)
-    discounts = json.load(open("data/raw/discounts.json", encoding="utf-8"))
-    original_result = solve_cart_split(base_items, discounts)
+    solve_cache = get_solve_cache()
+    original_result = solve_cache(base_items)
 
-    recommended_id = recommend_addon(cart_data)
+    recommended_id = app_data.recommender().recommend(cart_data)
 
     if not recommended_id:
         st.info("目前無加購推薦")
@@ -65,7 +62,7 @@ if uploaded_file:
     else:
         addon_item = product_dict[recommended_id]
         new_items = base_items + [addon_item]
-        new_result = solve_cart_split(new_items, discounts)
+        new_result = solve_cache(new_items)
         before_price = sum(r["result"]["final_price"] for r in original_result)
         after_price = sum(r["result"]["final_price"] for r in new_result)
         saved = before_price - after_price
@@ -1,36 +1,26 @@
 import streamlit as st
 import json
 import os
-import pandas as pd
-import numpy as np
-from lightgbm import Booster
-from src.core.solver import solve_cart_split
-from src.ai.train_addon_model import extract_features
+from src.core.cart import Cart
+from src.core.solve_cache import get_solve_cache
+from src.ai.price_surrogate import get_price_surrogate
+from src.utils import app_data
 
 st.set_page_config(page_title="🛒 購物模擬", layout="centered")
 st.title("🛒 自由選購商品並模擬加購推薦")
 
-# 載入 Booster 模型與標籤對照
-model = Booster(model_file="data/training/addon_model.txt")
-with open("data/training/label2id.json", encoding="utf-8") as f:
-    label2id = json.load(f)
-id2label = {v: k for k, v in label2id.items()}
+# 共用的推薦器（模型與標籤對照只載入一次，模型檔更新時自動重載）
+recommender = app_data.recommender()
 
-with open("data/raw/products.json", encoding="utf-8") as f:
-    product_list = json.load(f)
-    product_name_map = {p["id"]: p["name"] for p in product_list}
-    product_dict = {p["id"]: p for p in product_list}
+# 商品、規則與「商品 → 適用折扣類型」索引每個 process 只建一次，檔案更新時自動重建
+catalog = app_data.catalog()
+product_list = catalog.products
+product_name_map = catalog.name_map
+product_dict = catalog.by_id
+discount_list = app_data.discounts()
+discount_types = app_data.discount_index()
 
-with open("data/raw/discounts.json", encoding="utf-8") as f:
-    discount_list = json.load(f)
-
-product_discount_map = {}
-for p in product_list:
-    applicable = [d["type"] for d in discount_list if "items" in d and p["id"] in d["items"]]
-    product_discount_map[p["id"]] = ", ".join(set(applicable)) if applicable else "—"
-
-all_categories = sorted(set(p["category"] for p in product_list))
-selected_categories = st.multiselect("篩選分類", all_categories, default=all_categories)
+selected_categories = st.multiselect("篩選分類", catalog.categories, default=catalog.categories)
 all_discount_types = sorted(set(d["type"] for d in discount_list if "type" in d))
 selected_discount_types = st.multiselect("只顯示含有折扣的商品類型", all_discount_types, default=[])
 
@@ -38,12 +28,8 @@ filtered_products = []
 for p in product_list:
     if p["category"] not in selected_categories:
         continue
-    if selected_discount_types:
-        types_for_product = [
-            d["type"] for d in discount_list if "items" in d and p["id"] in d["items"]
-        ]
-        if not any(t in selected_discount_types for t in types_for_product):
-            continue
+    if selected_discount_types and not any(t in selected_discount_types for t in discount_types[p["id"]]):
+        continue
     filtered_products.append(p)
 
 product_table = [
@@ -53,58 +39,68 @@ product_table = [
         "價格": p["price"],
         "分類": p["category"],
         "數量": 0,
-        "折扣類型": product_discount_map[p["id"]]
+        "折扣類型": ", ".join(discount_types[p["id"]]) or "—"
     }
     for p in filtered_products
 ]
 
 df = st.data_editor(
     product_table,
-    column_config={"數量": st.column_config.NumberColumn(min_value=0, step=1)},
+    column_config={
+        "價格": st.column_config.NumberColumn(min_value=0),
+        "數量": st.column_config.NumberColumn(min_value=0, step=1),
+    },
     use_container_width=True,
     num_rows="dynamic",
     key="product_selector"
 )
 
-selected_items = []
+# 數量直接記在品項上，不再為每一件複製一個 dict
+cart = Cart()
 for row in df:
-    if row["數量"] > 0:
-        for _ in range(row["數量"]):
-            selected_items.append({
-                "id": row["商品ID"],
-                "price": row["價格"],
-                "category": row["分類"]
-            })
-
-if selected_items:
+    if (row["數量"] or 0) > 0:
+        # 價格可在表格中編輯（可為小數），空白或負數的列略過
+        try:
+            cart.add(row["商品ID"], row["價格"], row["分類"], row["數量"])
+        except (TypeError, ValueError) as e:
+            st.warning(f"略過 {row['商品ID']}：{e}")
+
+if cart:
     st.markdown("✅ **已選商品清單與模擬結果**")
-    cart_data = {"cart_id": "ui_simulated", "items": selected_items}
-    result = solve_cart_split(selected_items, discount_list)
-
-    base_ids = set(i["id"] for i in selected_items)
-    candidates = [p for p in product_list if p["id"] not in base_ids]
-    features = [extract_features({"items": selected_items, "addon": p}) for p in candidates]
-    df_pred = pd.DataFrame(features)
-    probas = model.predict(df_pred)
-    if probas.ndim == 1:
-        probas = [[1 - p, p] for p in probas]
-
-    top_indices = pd.Series([max(p) for p in probas]).sort_values(ascending=False).index[:3]
-    top_results = [(candidates[i]["id"], max(probas[i])) for i in top_indices]
-    top_label_idx = [int(np.argmax(p)) for p in probas]
-    predicted_labels = [id2label[i] for i in top_label_idx]
-    recommended_id, confidence = top_results[0]
-
-    st.caption(f"🧠 模型推薦完成：{recommended_id} ({confidence*100:.1f}%)")
-    for rank, (pid, prob) in enumerate(top_results, start=1):
-        name = product_dict.get(pid, {}).get("name", pid)
-        st.markdown(f"{rank}. **{name}** ({prob*100:.1f}%)")
-
-    for i, order in enumerate(result, start=1):
+    # 模型特徵與存檔仍使用一件一個 dict 的格式
+    selected_items = cart.to_items()
+
+    # 即時金額預覽：代理模型有把握時直接顯示預估，否則（或尚未訓練代理模型時）精確拆帳
+    surrogate = get_price_surrogate()
+    preview = surrogate.preview(cart) if surrogate else None
+    result = preview["orders"] if preview and preview["exact"] else None
+    if preview:
+        label = "精確計算" if preview["exact"] else "模型預估"
+        st.markdown(f"💰 **結帳金額（{label}）：${preview['final_price']}**（折扣 -${preview['total_discount']}）")
+    if result is None and (preview is None or st.checkbox("顯示發票拆帳明細（精確計算）")):
+        result = get_solve_cache()(cart)
+
+    # 依模型分數排序取前 3 名，附上實際可省金額；multiclass / binary 的分數是機率，
+    # lambdarank 的分數沒有範圍、不能當百分比，只顯示名次與可省金額
+    top_results = recommender.recommend_topk({"items": selected_items}, k=3)
+    recommended_id = top_results[0]["id"] if top_results else None
+    is_probability = recommender.objective in ("multiclass", "binary")
+
+    def describe(rank, r):
+        saved = f"可省 ${r['saved_by_addon']:g}" if r["saved_by_addon"] > 0 else "不會更省"
+        head = f"{r['score']*100:.1f}%" if is_probability else f"第 {rank} 名"
+        return f"{head}，{saved}"
+
+    if top_results:
+        st.caption(f"🧠 模型推薦完成：{recommended_id} ({describe(1, top_results[0])})")
+    for rank, r in enumerate(top_results, start=1):
+        st.markdown(f"{rank}. **{r['name'] or r['id']}** ({describe(rank, r)})")
+
+    for i, order in enumerate(result or [], start=1):
         st.subheader(f"🧾 發票 {chr(64 + i)}")
-        for item in order["items"]:
-            name = product_name_map.get(item["id"], item["id"])
-            st.markdown(f"- {name}：${item['price']}")
+        for pid, price, _, qty in order["items"].lines():
+            name = product_name_map.get(pid, pid)
+            st.markdown(f"- {name}：${price}" + (f" × {qty}" if qty > 1 else ""))
         st.markdown("**折扣內容：**")
         for d in order["result"]["used_discounts"]:
             st.markdown(f"- {d['type']} [{d['id']}]: -${d['amount']}")
@@ -0,0 +1,93 @@
+import numpy as np
+
+# 加購推薦特徵的批次版：購物車層級特徵只算一次，廣播到整個商品目錄的候選列
+
+CATEGORY_LIST = ['衣服', '食品', '日用品', '3C']
+
+# 欄位順序與 train_addon_model.extract_features 產生的 DataFrame 相同
+FEATURE_COLUMNS = [
+    "item_count",
+    "total_price",
+    "avg_price",
+    "max_price",
+    "min_price",
+    "addon_price",
+    "saved_by_addon",
+    "triggered_discounts",
+] + [f"cat_{cat}" for cat in CATEGORY_LIST] + [
+    "distance_to_full_discount",
+]
+COLUMN_INDEX = {name: i for i, name in enumerate(FEATURE_COLUMNS)}
+CART_COLUMNS = ["item_count", "total_price", "avg_price", "max_price", "min_price"] + \
+    [f"cat_{cat}" for cat in CATEGORY_LIST] + ["distance_to_full_discount"]
+
+
+def threshold_array(discount_rules):
+    return np.array([d["threshold"] for d in discount_rules if d["type"] == "滿額折扣"], dtype=np.float64)
+
+
+class CandidateCatalog:
+    # 商品目錄的陣列化版本：ID 順序、ID → 列索引、價格
+    def __init__(self, products):
+        self.products = list(products)
+        self.ids = [p["id"] for p in self.products]
+        self.index = {pid: i for i, pid in enumerate(self.ids)}
+        self.prices = np.array([p["price"] for p in self.products], dtype=np.float64)
+
+    def __len__(self):
+        return len(self.products)
+
+    def candidate_mask(self, items):
+        # 已在購物車中的商品不列入候選
+        mask = np.ones(len(self.products), dtype=bool)
+        for item in items:
+            i = self.index.get(item["id"])
+            if i is not None:
+                mask[i] = False
+        return mask
+
+
+def cart_features(items, thresholds):
+    prices = np.array([i["price"] for i in items], dtype=np.float64)
+    total = float(prices.sum())
+    categories = [i["category"] for i in items]
+
+    feature = {
+        "item_count": len(items),
+        "total_price": total,
+        "avg_price": total / len(items) if items else 0,
+        "max_price": float(prices.max()) if items else 0,
+        "min_price": float(prices.min()) if items else 0,
+    }
+    for cat in CATEGORY_LIST:
+        feature[f"cat_{cat}"] = categories.count(cat)
+    feature["distance_to_full_discount"] = float(np.maximum(thresholds - total, 0).min()) if len(thresholds) else 0
+    return feature
+
+
+def build_feature_rows(items, catalog, thresholds, rows, saved=None, triggered=None):
+    # rows：候選商品在目錄中的索引（任意順序）；saved / triggered 與 rows 對齊
+    X = np.zeros((len(rows), len(FEATURE_COLUMNS)), dtype=np.float64)
+    feature = cart_features(items, thresholds)
+    for name in CART_COLUMNS:
+        X[:, COLUMN_INDEX[name]] = feature[name]
+
+    X[:, COLUMN_INDEX["addon_price"]] = catalog.prices[rows]
+    if saved is not None:
+        X[:, COLUMN_INDEX["saved_by_addon"]] = saved
+    if triggered is not None:
+        X[:, COLUMN_INDEX["triggered_discounts"]] = triggered
+    return X
+
+
+def build_candidate_matrix(items, catalog, thresholds, saved=None, triggered=None, mask=None):
+    # 回傳 (特徵矩陣, 候選商品在目錄中的索引)；saved / triggered 為長度等於目錄的陣列，可省略
+    if mask is None:
+        mask = catalog.candidate_mask(items)
+    rows = np.flatnonzero(mask)
+    X = build_feature_rows(
+        items, catalog, thresholds, rows,
+        saved=None if saved is None else np.asarray(saved, dtype=np.float64)[rows],
+        triggered=None if triggered is None else np.asarray(triggered, dtype=np.float64)[rows],
+    )
+    return X, rows
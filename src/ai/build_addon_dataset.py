@@ -1,19 +1,34 @@
 import os
 import json
+import shutil
+import hashlib
+import argparse
 from glob import glob
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
 from tqdm import tqdm
 
-from src.core.solver import solve_cart_split
-from src.core.discount import apply_discount
+from src.core.ruleset import CompiledRuleSet
+from src.core.rule_loader import load_rules
+from src.core.incremental import SplitState
+from src.utils.cart_corpus import CartCorpus, is_corpus
+from src.ai.addon_features import FEATURE_COLUMNS, CandidateCatalog, build_feature_rows, threshold_array
 
 
 CART_DIR = "data/carts/"
 TARGETED_DIR = "data/carts/targeted/"
 SIM_DIR = "data/user_simulated/"
+CART_CORPUS_DIR = "data/carts/corpus/"
+TARGETED_CORPUS_DIR = "data/carts/targeted/corpus/"
 DISCOUNT_PATH = "data/raw/discounts.json"
 PRODUCT_PATH = "data/raw/products.json"
 X_PATH = "data/training/X_addon.jsonl"
 Y_PATH = "data/training/Y_addon.jsonl"
+JSONL_META_PATH = "data/training/X_addon.meta.json"
+COLUMNAR_DIR = "data/training/addon_columnar/"
+PARTS_DIR = "data/training/addon_parts/"
+# 每個分片平均的工作單位數（分片邊界由路徑雜湊決定，見 split_units）
+SHARD_UNITS = 64
 
 def load_json(path):
     with open(path, "r", encoding="utf-8") as f:
@@ -25,92 +40,325 @@ def save_jsonl(path, data_list):
         for item in data_list:
             f.write(json.dumps(item, ensure_ascii=False) + "\n")
 
-def calc_extra_features(original_items, addon_item, discount_rules):
-    before = solve_cart_split(original_items, discount_rules)
-    after = solve_cart_split(original_items + [addon_item], discount_rules)
+def calc_extra_features(original_items, addon_item, discount_rules, state=None):
+    # state：同一台購物車的 SplitState，可重複使用，避免每個候選商品都重解基礎購物車
+    if state is None:
+        state = SplitState(original_items, discount_rules)
+    return state.saved_by(addon_item)
 
-    before_price = sum(r["result"]["final_price"] for r in before)
-    after_price = sum(r["result"]["final_price"] for r in after)
-    saved = before_price - after_price
-
-    before_discounts = set(d["id"] for r in before for d in r["result"]["used_discounts"])
-    after_discounts = set(d["id"] for r in after for d in r["result"]["used_discounts"])
-    triggered = len(after_discounts - before_discounts)
-
-    return saved, triggered
-
-def build_dataset():
-    discount_rules = load_json(DISCOUNT_PATH)
-    products = load_json(PRODUCT_PATH)
-    product_dict = {p["id"]: p for p in products}
-
-    cart_files = sorted(glob(os.path.join(CART_DIR, "*.json")))
-    targeted_files = sorted(glob(os.path.join(TARGETED_DIR, "*.json")))
-    sim_files = sorted(glob(os.path.join(SIM_DIR, "*.json")))
+def cart_records(cart, products, discount_rules):
+    cart_id = cart["cart_id"]
+    base_items = cart["items"]
+    base_ids = set(i["id"] for i in base_items)
+    state = SplitState(base_items, discount_rules)
 
     X_data = []
     Y_data = []
-
-    all_cart_sources = [
-        (cart_files, "🛒 原始購物車資料"),
-        (targeted_files, "🎯 Targeted 加購樣本"),
-    ]
-
-    for file_list, label in all_cart_sources:
-        for path in tqdm(file_list, desc=label):
-            cart = load_json(path)
-            cart_id = cart["cart_id"]
-            base_items = cart["items"]
-            base_ids = set(i["id"] for i in base_items)
-
-            base_result = solve_cart_split(base_items, discount_rules)
-
-            for candidate in products:
-                pid = candidate["id"]
-                if pid in base_ids:
-                    continue
-                saved, triggered = calc_extra_features(base_items, candidate, discount_rules)
-                X_data.append({
-                    "cart_id": cart_id,
-                    "items": base_items,
-                    "addon": candidate,
-                    "saved_by_addon": saved,
-                    "triggered_discounts": triggered
-                })
-                is_better = saved > 0
-                Y_data.append({
-                    "cart_id": cart_id,
-                    "recommended_addon": pid if is_better else None
-                })
-
-    for path in tqdm(sim_files, desc="📥 整合使用者模擬資料中"):
-        sim = load_json(path)
-        base_items = sim["base_items"]
-        recommended_id = sim["recommended"]
-        accepted = sim["accepted"]
-        cart_id = sim.get("cart_id", os.path.basename(path).replace(".json", ""))
-
-        if recommended_id not in product_dict:
+    for candidate in products:
+        pid = candidate["id"]
+        if pid in base_ids:
             continue
-
-        addon = product_dict[recommended_id]
-        saved, triggered = calc_extra_features(base_items, addon, discount_rules)
-
+        saved, triggered = calc_extra_features(base_items, candidate, discount_rules, state=state)
         X_data.append({
             "cart_id": cart_id,
             "items": base_items,
-            "addon": addon,
+            "addon": candidate,
             "saved_by_addon": saved,
             "triggered_discounts": triggered
         })
+        is_better = saved > 0
         Y_data.append({
             "cart_id": cart_id,
-            "recommended_addon": recommended_id if accepted else None
+            "recommended_addon": pid if is_better else None
         })
+    return X_data, Y_data
+
+def sim_records(path, sim, product_dict, discount_rules):
+    base_items = sim["base_items"]
+    recommended_id = sim["recommended"]
+    accepted = sim["accepted"]
+    cart_id = sim.get("cart_id", os.path.basename(path).replace(".json", ""))
+
+    if recommended_id not in product_dict:
+        return [], []
+
+    addon = product_dict[recommended_id]
+    saved, triggered = calc_extra_features(base_items, addon, discount_rules)
+    X_data = [{
+        "cart_id": cart_id,
+        "items": base_items,
+        "addon": addon,
+        "saved_by_addon": saved,
+        "triggered_discounts": triggered
+    }]
+    Y_data = [{
+        "cart_id": cart_id,
+        "recommended_addon": recommended_id if accepted else None
+    }]
+    return X_data, Y_data
+
+def list_units():
+    # 依固定順序列出所有工作單位：(種類, 檔案路徑)
+    cart_files = sorted(glob(os.path.join(CART_DIR, "*.json")))
+    targeted_files = sorted(glob(os.path.join(TARGETED_DIR, "*.json")))
+    sim_files = sorted(glob(os.path.join(SIM_DIR, "*.json")))
+    # 語料庫中的購物車以「語料庫路徑/cart_id」表示
+    corpus_units = [
+        ("corpus", os.path.join(root, cart_id))
+        for root in (CART_CORPUS_DIR, TARGETED_CORPUS_DIR) if is_corpus(root)
+        for cart_id in CartCorpus(root).ids()
+    ]
+    return [("cart", p) for p in cart_files + targeted_files] + corpus_units + [("sim", p) for p in sim_files]
+
+# ===== worker：每個 process 只載入一次規則與商品 =====
+
+_context = None
+
+def _load_context():
+    global _context
+    if _context is None:
+        products = load_json(PRODUCT_PATH)
+        _context = {
+            "discount_rules": CompiledRuleSet.from_json(DISCOUNT_PATH),
+            "products": products,
+            "product_dict": {p["id"]: p for p in products},
+            "corpora": {},
+        }
+    return _context
+
+def unit_records(kind, path):
+    ctx = _load_context()
+    if kind == "corpus":
+        root, cart_id = os.path.split(path)
+        if root not in ctx["corpora"]:
+            ctx["corpora"][root] = CartCorpus(root)
+        return cart_records(ctx["corpora"][root].get(cart_id), ctx["products"], ctx["discount_rules"])
+    data = load_json(path)
+    if kind == "sim":
+        return sim_records(path, data, ctx["product_dict"], ctx["discount_rules"])
+    return cart_records(data, ctx["products"], ctx["discount_rules"])
+
+def compact_record(X_data, Y_data):
+    # columnar 格式的中間檔：一台購物車一行，基礎商品只存一次
+    if not X_data:
+        return None
+    return {
+        "cart_id": X_data[0]["cart_id"],
+        "items": X_data[0]["items"],
+        "addons": [x["addon"]["id"] for x in X_data],
+        "saved": [x["saved_by_addon"] for x in X_data],
+        "triggered": [x["triggered_discounts"] for x in X_data],
+        "labels": [y["recommended_addon"] for y in Y_data],
+    }
+
+def unit_lines(kind, path, fmt):
+    # 回傳每個分片檔案要追加的行
+    X_data, Y_data = unit_records(kind, path)
+    if fmt == "columnar":
+        record = compact_record(X_data, Y_data)
+        return [[record] if record else []]
+    return [X_data, Y_data]
+
+def _shard_paths(parts_dir, key, fmt):
+    base = os.path.join(parts_dir, f"shard_{key}")
+    parts = [base + ".C.jsonl"] if fmt == "columnar" else [base + ".X.jsonl", base + ".Y.jsonl"]
+    return parts, base + ".done.jsonl"
+
+def _resume_point(part_paths, done_path):
+    # 讀 checkpoint：已完成的單位數與當時的檔案大小，截掉寫到一半的尾巴
+    # （done.jsonl 本身也截到最後一行完整紀錄，之後的 checkpoint 才不會接在殘行後面）
+    done, ends = 0, [0] * len(part_paths)
+    if os.path.exists(done_path):
+        good = 0
+        with open(done_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    entry = json.loads(line)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    break
+                done, ends = entry["done"], entry["ends"]
+                good += len(line)
+        if os.path.getsize(done_path) != good:
+            with open(done_path, "r+b") as f:
+                f.truncate(good)
+    for path, end in zip(part_paths, ends):
+        if not os.path.exists(path) or os.path.getsize(path) != end:
+            with open(path, "a+b") as f:
+                f.truncate(end)
+    return done
+
+def build_shard(key, units, parts_dir=PARTS_DIR, fmt="jsonl"):
+    part_paths, done_path = _shard_paths(parts_dir, key, fmt)
+    start = _resume_point(part_paths, done_path)
+    if start == len(units):
+        return key, 0
+
+    files = [open(path, "a", encoding="utf-8") for path in part_paths]
+    try:
+        with open(done_path, "a", encoding="utf-8") as fd:
+            for n, (kind, path) in enumerate(units[start:], start=start + 1):
+                for f, lines in zip(files, unit_lines(kind, path, fmt)):
+                    for line in lines:
+                        f.write(json.dumps(line, ensure_ascii=False) + "\n")
+                    f.flush()
+                fd.write(json.dumps({"done": n, "path": path, "ends": [f.tell() for f in files]}) + "\n")
+                fd.flush()
+    finally:
+        for f in files:
+            f.close()
+    return key, len(units) - start
+
+def _file_stamp(path):
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+def data_version(fmt):
+    # 影響標籤的輸入：輸出格式、折扣規則版本與商品檔內容；任一改變，所有分片都要重建
+    with open(PRODUCT_PATH, "rb") as f:
+        products = hashlib.sha1(f.read()).hexdigest()
+    return json.dumps([fmt, CompiledRuleSet.from_json(DISCOUNT_PATH).version, products])
+
+def split_units(units, shard_units=SHARD_UNITS):
+    # 依路徑雜湊決定分片邊界：新增或刪除一台購物車只會改到它所在的分片，其他分片的內容不變
+    shards, current = [], []
+    for unit in units:
+        current.append(unit)
+        if int(hashlib.sha1(unit[1].encode("utf-8")).hexdigest()[:8], 16) % shard_units == 0:
+            shards.append(current)
+            current = []
+    if current:
+        shards.append(current)
+    return shards
+
+def shard_key(units, version):
+    # 分片 key：資料版本 + 工作單位；單檔的購物車 / 模擬紀錄再帶檔案的 mtime 與大小，
+    # 檔案被改寫也會重建（語料庫只追加，cart_id 不會改內容）
+    h = hashlib.sha1(version.encode("utf-8"))
+    for kind, path in units:
+        stamp = None if kind == "corpus" else _file_stamp(path)
+        h.update(json.dumps([kind, path, stamp], ensure_ascii=False).encode("utf-8"))
+    return h.hexdigest()[:16]
+
+def plan_shards(units, parts_dir=PARTS_DIR, fresh=False, fmt="jsonl"):
+    # 回傳 [(key, units)]，依序合併即與單執行緒輸出順序相同
+    # key 沒變的分片沿用已完成（或接續未完成）的 checkpoint；不在計畫中的舊分片檔刪除
+    if fresh:
+        shutil.rmtree(parts_dir, ignore_errors=True)
+    os.makedirs(parts_dir, exist_ok=True)
+    version = data_version(fmt)
+    shards = [(shard_key(shard, version), shard) for shard in split_units(units)]
+
+    keep = set()
+    for key, _ in shards:
+        part_paths, done_path = _shard_paths(parts_dir, key, fmt)
+        keep.update(part_paths + [done_path])
+    for path in glob(os.path.join(parts_dir, "shard_*")):
+        if path not in keep:
+            os.remove(path)
+    with open(os.path.join(parts_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump({"format": fmt, "version": version, "shards": [{"key": key, "units": shard} for key, shard in shards]},
+                  f, ensure_ascii=False)
+    return shards
+
+def merge_parts(keys, parts_dir=PARTS_DIR):
+    for out_path, col in ((X_PATH, 0), (Y_PATH, 1)):
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        with open(out_path, "wb") as out:
+            for key in keys:
+                with open(_shard_paths(parts_dir, key, "jsonl")[0][col], "rb") as f:
+                    shutil.copyfileobj(f, out)
+    with open(X_PATH, "rb") as f:
+        total = sum(1 for _ in f)
+    return total
+
+def _compact_records(keys, parts_dir):
+    for key in keys:
+        with open(_shard_paths(parts_dir, key, "columnar")[0][0], "r", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+def write_columnar(keys, parts_dir=PARTS_DIR, out_dir=COLUMNAR_DIR, feedback=None):
+    # 輸出正規化的欄式資料：
+    #   carts.jsonl       每台購物車一行（cart_row, cart_id, items）
+    #   features.npy      (候選列數, 特徵數) float64（與 build_feature_rows 及推論時相同），欄位順序同 FEATURE_COLUMNS
+    #   cart_row.npy      每個候選列對應的購物車列
+    #   addon_index.npy   候選商品在商品目錄中的索引
+    #   label.npy         推薦商品的目錄索引，-1 代表 None
+    #   meta.json         欄位名稱、商品目錄 ID 順序與用到的回饋檔 mtime
+    catalog = CandidateCatalog(load_json(PRODUCT_PATH))
+    thresholds = threshold_array(load_rules(DISCOUNT_PATH))
+
+    total = sum(len(r["addons"]) for r in _compact_records(keys, parts_dir))
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.makedirs(out_dir, exist_ok=True)
+    open_memmap = np.lib.format.open_memmap
+    features = open_memmap(os.path.join(out_dir, "features.npy"), mode="w+",
+                           dtype=np.float64, shape=(total, len(FEATURE_COLUMNS)))
+    cart_row = open_memmap(os.path.join(out_dir, "cart_row.npy"), mode="w+", dtype=np.int32, shape=(total,))
+    addon_index = open_memmap(os.path.join(out_dir, "addon_index.npy"), mode="w+", dtype=np.int32, shape=(total,))
+    label = open_memmap(os.path.join(out_dir, "label.npy"), mode="w+", dtype=np.int32, shape=(total,))
+
+    start = 0
+    carts = 0
+    with open(os.path.join(out_dir, "carts.jsonl"), "w", encoding="utf-8") as fc:
+        for record in _compact_records(keys, parts_dir):
+            rows = np.array([catalog.index[pid] for pid in record["addons"]], dtype=np.int64)
+            end = start + len(rows)
+            features[start:end] = build_feature_rows(
+                record["items"], catalog, thresholds, rows,
+                saved=record["saved"], triggered=record["triggered"],
+            )
+            cart_row[start:end] = carts
+            addon_index[start:end] = rows
+            label[start:end] = [catalog.index[l] if l is not None else -1 for l in record["labels"]]
+            fc.write(json.dumps({"cart_row": carts, "cart_id": record["cart_id"], "items": record["items"]},
+                                ensure_ascii=False) + "\n")
+            start = end
+            carts += 1
+
+    for array in (features, cart_row, addon_index, label):
+        array.flush()
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"columns": FEATURE_COLUMNS, "product_ids": catalog.ids, "rows": total, "carts": carts,
+                   "feedback": feedback or {}}, f, ensure_ascii=False, indent=2)
+    return total
+
+def build_dataset(workers=1, fresh=False, fmt="jsonl"):
+    units = list_units()
+    shards = plan_shards(units, fresh=fresh, fmt=fmt)
+    keys = [key for key, _ in shards]
+    # 回饋檔（檔名 → 建資料時的 mtime），train_addon_model 完整訓練後據此標記已使用
+    feedback = {os.path.basename(path): os.stat(path).st_mtime for kind, path in units if kind == "sim"}
+
+    progress = tqdm(total=len(shards), desc="🧩 建構加購資料分片")
+    if workers > 1:
+        with ProcessPoolExecutor(workers) as pool:
+            futures = [pool.submit(build_shard, key, shard, PARTS_DIR, fmt) for key, shard in shards]
+            for future in as_completed(futures):
+                future.result()
+                progress.update()
+    else:
+        for key, shard in shards:
+            build_shard(key, shard, PARTS_DIR, fmt)
+            progress.update()
+    progress.close()
 
-    save_jsonl(X_PATH, X_data)
-    save_jsonl(Y_PATH, Y_data)
-    print(f"✅ 輸出完成：共 {len(X_data)} 筆 → X: {X_PATH}，Y: {Y_PATH}")
+    if fmt == "columnar":
+        total = write_columnar(keys, feedback=feedback)
+        print(f"✅ 輸出完成：共 {total} 筆 → {COLUMNAR_DIR}")
+    else:
+        total = merge_parts(keys)
+        with open(JSONL_META_PATH, "w", encoding="utf-8") as f:
+            json.dump({"rows": total, "feedback": feedback}, f, ensure_ascii=False, indent=2)
+        print(f"✅ 輸出完成：共 {total} 筆 → X: {X_PATH}，Y: {Y_PATH}")
 
 if __name__ == "__main__":
-    build_dataset()
+    parser = argparse.ArgumentParser(description="建構加購推薦訓練資料")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="平行 process 數")
+    parser.add_argument("--fresh", action="store_true", help="忽略 checkpoint，從頭重建")
+    parser.add_argument("--format", choices=["jsonl", "columnar"], default="jsonl",
+                        help="columnar：購物車 / 候選列 / 特徵矩陣分開存放；jsonl：舊版 X_addon / Y_addon")
+    args = parser.parse_args()
+    build_dataset(workers=args.workers, fresh=args.fresh, fmt=args.format)
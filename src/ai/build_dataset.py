@@ -1,15 +1,23 @@
 import os
 import json
-from glob import glob
+import argparse
+from array import array
+from collections import deque
+import numpy as np
 from tqdm import tqdm
-from collections import Counter
-from core.solver import solve_cart_split
+from core.solve_cache import SolveCache
+from utils.cart_corpus import iter_carts
+from ai.cart_features import FEATURE_COLUMNS, RaggedCarts, cart_feature_matrix, min_threshold
 
 CART_DIR = "data/carts/"
+CART_CORPUS_DIR = "data/carts/corpus/"
 DISCOUNT_PATH = "data/raw/discounts.json"
 X_PATH = "data/training/X.jsonl"
 Y_PATH = "data/training/Y.jsonl"
-CATEGORY_LIST = ['衣服', '食品', '日用品', '3C']
+# 欄式輸出：攤平的商品陣列 + 特徵矩陣 + 標籤，train_model.py 直接 mmap
+COLUMNAR_DIR = "data/training/price_columnar/"
+# 拆帳結果的磁碟快取：重跑時相同購物車與規則版本不用再解
+SOLVE_CACHE_PATH = "data/training/solve_cache.sqlite"
 
 def load_json(path):
     with open(path, "r", encoding="utf-8") as f:
@@ -21,66 +29,105 @@ def save_jsonl(path, data_list):
         for item in data_list:
             f.write(json.dumps(item, ensure_ascii=False) + "\n")
 
-def distance_to_nearest_threshold(total_price, discounts):
-    diffs = []
-    for d in discounts:
-        if d['type'] == '滿額折扣':
-            diff = max(0, d['threshold'] - total_price)
-            diffs.append(diff)
-    return min(diffs) if diffs else 0
+def _number(value):
+    # 矩陣中的整數金額 / 件數寫回 JSON 時保持整數
+    return int(value) if value == int(value) else value
 
-def build_dataset():
-    discount_rules = load_json(DISCOUNT_PATH)
-    cart_files = sorted(glob(os.path.join(CART_DIR, "auto_*.json")))
+def _solved_carts(carts, solve_cache, labels, kept=None, workers=1):
+    # 批次解出 Y（沒命中快取的購物車分塊平行計算），並把購物車依原順序交給 RaggedCarts 攤平
+    queued = deque()
 
-    X_data = []
-    Y_data = []
+    def feed():
+        for cart in carts:
+            queued.append(cart)
+            yield cart["items"]
 
-    for path in tqdm(cart_files, desc="🔄 建構資料集中"):
-        cart = load_json(path)
-        cart_id = cart["cart_id"]
-        items = cart["items"]
-
-        prices = [i["price"] for i in items]
-        categories = [i["category"] for i in items]
-        total_price = sum(prices)
-
-        # 加入特徵欄位
-        x = {
-            "cart_id": cart_id,
-            "items": items,
-            "item_count": len(items),
-            "total_price": total_price,
-            "avg_price": total_price / len(items) if items else 0,
-            "max_price": max(prices),
-            "min_price": min(prices),
-            "distance_to_full_discount": distance_to_nearest_threshold(total_price, discount_rules)
-        }
-
-        cat_count = Counter(categories)
-        for cat in CATEGORY_LIST:
-            x[f"cat_{cat}"] = cat_count.get(cat, 0)
+    for result_set in solve_cache.solve_many(feed(), workers=workers):
+        cart = queued.popleft()
+        labels["final_price"].append(sum(r["result"]["final_price"] for r in result_set))
+        labels["total_discount"].append(sum(r["result"]["total_discount"] for r in result_set))
+        labels["used_discounts"].append(sorted(set(d["id"] for r in result_set for d in r["result"]["used_discounts"])))
+        if kept is not None:
+            kept.append(cart)
+        yield cart
 
-        X_data.append(x)
+def write_columnar(ragged, X, labels, discount_rules, out_dir=COLUMNAR_DIR):
+    # 輸出：
+    #   item_price.npy / item_category.npy / offsets.npy   攤平的商品陣列（特徵可不解析 JSON 重算）
+    #   features.npy         (購物車數, 特徵數) float64，欄位順序同 FEATURE_COLUMNS
+    #   final_price.npy / total_discount.npy
+    #   used_discounts.npy   (購物車數, 規則數) uint8 多標籤，欄位順序同 meta.json 的 rule_ids
+    #   cart_ids.txt / meta.json
+    os.makedirs(out_dir, exist_ok=True)
+    ragged.save(out_dir)
+    np.save(os.path.join(out_dir, "features.npy"), X)
+    for name in ("final_price", "total_discount"):
+        np.save(os.path.join(out_dir, f"{name}.npy"), np.frombuffer(labels[name], dtype=np.float64))
 
-        # Y：拆帳結果
-        result_set = solve_cart_split(items, discount_rules)
-        total_final = sum(r["result"]["final_price"] for r in result_set)
-        total_discount = sum(r["result"]["total_discount"] for r in result_set)
-        used_discounts = []
-        for r in result_set:
-            used_discounts += [d["id"] for d in r["result"]["used_discounts"]]
+    rule_ids = [d["id"] for d in discount_rules.rules]
+    rule_col = {rid: i for i, rid in enumerate(rule_ids)}
+    used = np.zeros((len(ragged), len(rule_ids)), dtype=np.uint8)
+    rows = np.repeat(np.arange(len(ragged)), [len(u) for u in labels["used_discounts"]])
+    cols = np.fromiter((rule_col[rid] for u in labels["used_discounts"] for rid in u), dtype=np.int64, count=len(rows))
+    used[rows, cols] = 1
+    np.save(os.path.join(out_dir, "used_discounts.npy"), used)
 
+    with open(os.path.join(out_dir, "cart_ids.txt"), "w", encoding="utf-8") as f:
+        f.writelines(f"{cid}\n" for cid in ragged.cart_ids)
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        # rules_version / min_threshold：用這份資料訓練的模型只適用於同一版規則
+        json.dump({"columns": FEATURE_COLUMNS, "rule_ids": rule_ids, "carts": len(ragged),
+                   "items": len(ragged.item_price), "rules_version": discount_rules.version,
+                   "min_threshold": min_threshold(discount_rules)}, f, ensure_ascii=False, indent=2)
+
+def write_jsonl(carts, X, labels):
+    # 舊版輸出：X 內含 items 與特徵欄位，Y 為拆帳結果
+    X_data = []
+    Y_data = []
+    for cart, row, final_price, total_discount, used in zip(
+            carts, X.tolist(), labels["final_price"], labels["total_discount"], labels["used_discounts"]):
+        x = {"cart_id": cart["cart_id"], "items": cart["items"]}
+        for name, value in zip(FEATURE_COLUMNS, row):
+            x[name] = value if name == "avg_price" else _number(value)
+        X_data.append(x)
         Y_data.append({
-            "cart_id": cart_id,
-            "final_price": total_final,
-            "total_discount": total_discount,
-            "used_discounts": sorted(set(used_discounts))
+            "cart_id": cart["cart_id"],
+            "final_price": _number(final_price),
+            "total_discount": _number(total_discount),
+            "used_discounts": used
         })
-
     save_jsonl(X_PATH, X_data)
     save_jsonl(Y_PATH, Y_data)
-    print(f"✅ 輸出完成：共 {len(X_data)} 筆 → X: {X_PATH}，Y: {Y_PATH}")
+
+def build_dataset(fmt="columnar", workers=1):
+    solve_cache = SolveCache(DISCOUNT_PATH, disk_path=SOLVE_CACHE_PATH)
+    discount_rules = solve_cache.ruleset
+    carts = (
+        cart for cart in iter_carts(CART_DIR, "auto_*.json", CART_CORPUS_DIR)
+        if cart["cart_id"].startswith("auto_")
+    )
+
+    labels = {"final_price": array("d"), "total_discount": array("d"), "used_discounts": []}
+    kept = [] if fmt == "jsonl" else None
+    ragged = RaggedCarts.from_carts(_solved_carts(tqdm(carts, desc="🔄 建構資料集中"), solve_cache, labels, kept, workers))
+    # 購物車層級特徵一次向量化算完
+    X = cart_feature_matrix(ragged, min_threshold(discount_rules), dtype=np.float64)
+
+    solve_cache.close()
+    print(f"🗃️ 拆帳快取：{solve_cache.stats()}")
+
+    if fmt == "jsonl":
+        write_jsonl(kept, X, labels)
+        print(f"✅ 輸出完成：共 {len(ragged)} 筆 → X: {X_PATH}，Y: {Y_PATH}")
+    else:
+        write_columnar(ragged, X, labels, discount_rules)
+        print(f"✅ 輸出完成：共 {len(ragged)} 筆 → {COLUMNAR_DIR}")
 
 if __name__ == "__main__":
-    build_dataset()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="建構拆帳回歸訓練資料")
+    parser.add_argument("--format", choices=["jsonl", "columnar"], default="columnar",
+                        help="columnar：攤平商品陣列 + 特徵矩陣；jsonl：舊版 X / Y")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="拆帳平行 process 數（1 = 單一程序）")
+    args = parser.parse_args()
+    build_dataset(fmt=args.format, workers=args.workers)
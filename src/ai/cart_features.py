@@ -0,0 +1,99 @@
+import json
+import os
+from array import array
+
+import numpy as np
+
+# 拆帳回歸（final_price）特徵的向量化版本：整個語料庫攤平成不等長陣列
+#   item_price[k]、item_category[k]：第 k 件商品的單價與分類代碼
+#   offsets[c] : offsets[c + 1]：第 c 台購物車的商品區段
+# 購物車層級特徵一次以 np.add.reduceat / np.bincount 算完，不再逐車跑 Python 迴圈
+
+CATEGORY_LIST = ['衣服', '食品', '日用品', '3C']
+CATEGORY_CODES = {cat: i for i, cat in enumerate(CATEGORY_LIST)}
+# 不在 CATEGORY_LIST 的分類使用的代碼（不計入任何 cat_* 欄位）
+OTHER_CATEGORY = len(CATEGORY_LIST)
+
+# 欄位順序與 build_dataset 的 X 欄位相同
+FEATURE_COLUMNS = ["item_count", "total_price", "avg_price", "max_price", "min_price"] + \
+    [f"cat_{cat}" for cat in CATEGORY_LIST] + ["distance_to_full_discount"]
+
+
+class RaggedCarts:
+    def __init__(self, item_price, item_category, offsets, cart_ids=None):
+        self.item_price = item_price
+        self.item_category = item_category
+        self.offsets = offsets
+        self.cart_ids = cart_ids
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @classmethod
+    def from_carts(cls, carts):
+        # carts：含 items 的 dict（購物車或 X.jsonl 的列）；只掃一次，用 array 累積避免 Python 物件
+        prices = array("d")
+        categories = array("b")
+        offsets = array("q", [0])
+        cart_ids = []
+        codes = CATEGORY_CODES
+        for cart in carts:
+            items = cart["items"]
+            prices.extend(i["price"] for i in items)
+            categories.extend(codes.get(i["category"], OTHER_CATEGORY) for i in items)
+            offsets.append(len(prices))
+            cart_ids.append(cart.get("cart_id"))
+        return cls(np.frombuffer(prices, dtype=np.float64), np.frombuffer(categories, dtype=np.int8),
+                   np.frombuffer(offsets, dtype=np.int64), cart_ids)
+
+    def save(self, out_dir):
+        np.save(os.path.join(out_dir, "item_price.npy"), self.item_price)
+        np.save(os.path.join(out_dir, "item_category.npy"), self.item_category)
+        np.save(os.path.join(out_dir, "offsets.npy"), self.offsets)
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        return cls(*(np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+                     for name in ("item_price", "item_category", "offsets")))
+
+
+def min_threshold(discount_rules):
+    # distance_to_full_discount = max(0, 最低滿額門檻 - 總金額)（與 distance_to_nearest_threshold 相同）
+    thresholds = [d["threshold"] for d in discount_rules if d["type"] == "滿額折扣"]
+    return min(thresholds) if thresholds else None
+
+
+def cart_feature_matrix(carts, threshold=None, dtype=np.float64):
+    # 回傳 (購物車數, len(FEATURE_COLUMNS)) 的特徵矩陣
+    prices, codes, offsets = carts.item_price, carts.item_category, np.asarray(carts.offsets)
+    n = len(offsets) - 1
+    counts = np.diff(offsets)
+    X = np.zeros((n, len(FEATURE_COLUMNS)), dtype=dtype)
+    X[:, 0] = counts
+
+    # reduceat 遇到空區段會回傳下一個元素，只對非空購物車的起點做區段加總；
+    # 非空起點之間夾著的空購物車長度為 0，不影響區段範圍
+    nonempty = counts > 0
+    starts = offsets[:-1][nonempty]
+    total = np.zeros(n)
+    if len(starts):
+        total[nonempty] = np.add.reduceat(prices, starts)
+        X[nonempty, 3] = np.maximum.reduceat(prices, starts)
+        X[nonempty, 4] = np.minimum.reduceat(prices, starts)
+    X[:, 1] = total
+    X[:, 2] = np.divide(total, counts, out=np.zeros(n), where=nonempty)
+
+    # 分類件數：(購物車, 分類) 攤平成一維後 bincount
+    width = OTHER_CATEGORY + 1
+    cart_of_item = np.repeat(np.arange(n), counts)
+    cat_counts = np.bincount(cart_of_item * width + codes, minlength=n * width).reshape(n, width)
+    X[:, 5:5 + len(CATEGORY_LIST)] = cat_counts[:, :len(CATEGORY_LIST)]
+
+    if threshold is not None:
+        X[:, -1] = np.maximum(threshold - total, 0)
+    return X
+
+
+def load_meta(path):
+    with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
@@ -1,47 +1,215 @@
 import json
-import pandas as pd
+import os
+import threading
+import numpy as np
 import lightgbm as lgb
-from src.ai.train_addon_model import extract_features
+from src.ai.addon_features import COLUMN_INDEX, CandidateCatalog, build_feature_rows, threshold_array
+from src.core.gap_index import GapIndex
+from src.core.incremental import SplitState
+from src.core.ruleset import CompiledRuleSet
 
 MODEL_PATH = "data/training/addon_model.txt"
 LABEL2ID_PATH = "data/training/label2id.json"
+RANKER_PATH = "data/training/addon_ranker.txt"
+RANKER_META_PATH = "data/training/addon_ranker.json"
 PRODUCTS_PATH = "data/raw/products.json"
+DISCOUNT_PATH = "data/raw/discounts.json"
+
+def load_json(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
 
 # 載入模型與類別編碼
-def load_model():
-    model = lgb.Booster(model_file=MODEL_PATH)
-    with open(LABEL2ID_PATH, encoding="utf-8") as f:
-        label2id = json.load(f)
+def load_model(model_path=MODEL_PATH, label2id_path=LABEL2ID_PATH):
+    model = lgb.Booster(model_file=model_path)
+    label2id = load_json(label2id_path)
     id2label = {v: k for k, v in label2id.items()}
     return model, id2label
 
-# 單次預測：傳入購物車資料，回傳推薦商品 ID 或 None
-def recommend_addon(cart_data):
-    model, id2label = load_model()
-    with open(PRODUCTS_PATH, encoding="utf-8") as f:
-        products = json.load(f)
-
-    base_items = cart_data["items"]
-    base_ids = set(i["id"] for i in base_items)
-
-    candidates = []
-    for p in products:
-        if p["id"] in base_ids:
-            continue
-        sample = {
-            "items": base_items,
-            "addon": p
-        }
-        feature = extract_features(sample)
-        candidates.append((p["id"], feature))
-
-    if not candidates:
+# 載入二元 / 排序模型與其設定（objective、欄位）
+def load_ranker(model_path=RANKER_PATH, meta_path=RANKER_META_PATH):
+    return lgb.Booster(model_file=model_path), load_json(meta_path)
+
+def pick_candidate(scores, candidate_ids, threshold=None):
+    # 二元 / 排序模型：取分數最高的候選；最高分低於門檻（訓練時存在 ranker meta）時回傳 None
+    if len(scores) == 0:
+        return None
+    best = int(np.argmax(scores))
+    if threshold is not None and scores[best] < threshold:
         return None
+    return candidate_ids[best]
+
+def pick_label(preds, id2label):
+    if preds.ndim == 2:
+        # 取所有候選列中機率最高的 (列, 類別)
+        _, top_label = np.unravel_index(preds.argmax(), preds.shape)
+    else:
+        top_label = preds.argmax()
+    predicted_addon = id2label.get(int(top_label))
+    # label2id.json 中的 None 類別存成 "null"
+    return predicted_addon if predicted_addon not in [None, "None", "null"] else None
+
+class Recommender:
+    # 常駐的推薦器：模型、類別表、商品目錄與滿額門檻只載入一次，模型檔更新時自動重載
+    # label2id_path=None 時為二元 / 排序模型（每個候選列一個分數），設定讀自 ranker_meta_path
+    def __init__(self, model_path=MODEL_PATH, label2id_path=LABEL2ID_PATH,
+                 products_path=PRODUCTS_PATH, discount_path=DISCOUNT_PATH, prune=False,
+                 ranker_meta_path=RANKER_META_PATH):
+        self.model_path = model_path
+        self.label2id_path = label2id_path
+        self.ranker_meta_path = ranker_meta_path
+        self.catalog = CandidateCatalog(load_json(products_path))
+        self.ruleset = CompiledRuleSet.from_json(discount_path)
+        self.thresholds = threshold_array(self.ruleset.rules)
+        # prune=True：只對「加一件就能讓某條規則成立」的商品打分，沒有這種商品時才看整個目錄；
+        # 會改變推薦結果（不在候選內的商品不會被推薦），預設關閉，由呼叫端明確開啟
+        self.prune = prune
+        self.gap_index = GapIndex(self.ruleset, self.catalog.products)
+        self._lock = threading.Lock()
+        self._mtime = None
+        # (模型, 類別表, 各商品的類別欄位, objective, 推薦門檻)：重載時整組建好再一次換上，
+        # 預測中的請求只讀取同一組，不會拿到新模型配舊類別表
+        self.loaded = None
+        self.reload_if_changed()
+
+    def reload_if_changed(self):
+        mtime = os.stat(self.model_path).st_mtime
+        if mtime == self._mtime:
+            return False
+        with self._lock:
+            if mtime != self._mtime and self.label2id_path is None:
+                model, meta = load_ranker(self.model_path, self.ranker_meta_path)
+                self.loaded = (model, None, None, meta["objective"], meta.get("threshold"))
+                self._mtime = mtime
+            elif mtime != self._mtime:
+                model, id2label = load_model(self.model_path, self.label2id_path)
+                # 目錄中每個商品對應的類別欄位，不在類別表中的商品為 -1
+                label2id = {label: i for i, label in id2label.items()}
+                label_columns = np.array([label2id.get(pid, -1) for pid in self.catalog.ids], dtype=np.int64)
+                self.loaded = (model, id2label, label_columns, "multiclass", None)
+                self._mtime = mtime
+        return True
+
+    @property
+    def objective(self):
+        return self.loaded[3]
+
+    def candidate_mask(self, items):
+        mask = self.catalog.candidate_mask(items)
+        if not self.prune:
+            return mask
+        closing = np.zeros(len(self.catalog), dtype=bool)
+        for pid in self.gap_index.candidates(items):
+            closing[self.catalog.index[pid]] = True
+        closing &= mask
+        return closing if closing.any() else mask
+
+    def candidate_matrix(self, items):
+        # 回傳 (特徵矩陣, 候選商品在目錄中的索引)；saved_by_addon / triggered_discounts
+        # 與建訓練資料時相同，用 SplitState 對每個候選試算，基礎購物車只解一次
+        rows = np.flatnonzero(self.candidate_mask(items))
+        saved = np.zeros(len(rows), dtype=np.float64)
+        triggered = np.zeros(len(rows), dtype=np.float64)
+        if len(rows):
+            state = SplitState(items, self.ruleset)
+            for j, i in enumerate(rows):
+                saved[j], triggered[j] = state.saved_by(self.catalog.products[i])
+        X = build_feature_rows(items, self.catalog, self.thresholds, rows, saved=saved, triggered=triggered)
+        return X, rows
+
+    def recommend(self, cart_data):
+        return self.recommend_many([cart_data])[0]
 
-    df = pd.DataFrame([f for _, f in candidates])
-    preds = model.predict(df)
-    top_idx = preds.argmax()
-    top_label = int(preds[top_idx].argmax()) if preds.ndim == 2 else preds.argmax()
-    predicted_addon = id2label.get(top_label)
+    def recommend_many(self, carts):
+        # 多台購物車的候選列疊成一個矩陣，只呼叫一次 predict
+        self.reload_if_changed()
+        blocks = [self.candidate_matrix(c["items"]) for c in carts]
+        sizes = [len(rows) for _, rows in blocks]
+        if not sum(sizes):
+            return [None] * len(carts)
+
+        model, id2label, _, objective, threshold = self.loaded
+        preds = model.predict(np.vstack([X for X, _ in blocks]))
+        results = []
+        start = 0
+        for (_, rows), size in zip(blocks, sizes):
+            block = preds[start:start + size]
+            if not size:
+                results.append(None)
+            elif objective == "multiclass":
+                results.append(pick_label(block, id2label))
+            else:
+                results.append(pick_candidate(block, [self.catalog.ids[i] for i in rows], threshold))
+            start += size
+        return results
+
+    def recommend_topk(self, cart_data, k=3):
+        # 一次打分所有候選，argpartition 取前 K；省下金額直接取特徵矩陣中試算好的欄位
+        items = cart_data["items"]
+        self.reload_if_changed()
+        model, _, label_columns, _, _ = self.loaded
+        X, rows = self.candidate_matrix(items)
+        if len(rows) == 0 or k <= 0:
+            return []
+
+        preds = model.predict(X)
+        if preds.ndim == 2:
+            # 候選商品的分數 = 模型預測「加購的就是這個商品」的機率，不混用其他類別
+            columns = label_columns[rows]
+            known = (columns >= 0) & (columns < preds.shape[1])
+            scores = np.where(known, preds[np.arange(len(rows)), np.where(known, columns, 0)], -np.inf)
+        else:
+            scores = preds
+        valid = np.flatnonzero(np.isfinite(scores))
+        if len(valid) == 0:
+            return []
+
+        k = min(k, len(valid))
+        top = valid[np.argpartition(-scores[valid], k - 1)[:k]]
+        top = top[np.argsort(-scores[top], kind="stable")]
+
+        results = []
+        for i in top:
+            product = self.catalog.products[rows[i]]
+            results.append({
+                "id": product["id"],
+                "name": product.get("name"),
+                "price": product["price"],
+                "score": float(scores[i]),
+                "saved_by_addon": float(X[i, COLUMN_INDEX["saved_by_addon"]]),
+                "triggered_discounts": int(X[i, COLUMN_INDEX["triggered_discounts"]]),
+            })
+        return results
+
+_shared = None
+_shared_lock = threading.Lock()
+
+# 已訓練二元 / 排序模型時優先使用
+def make_recommender(prune=False):
+    if os.path.exists(RANKER_PATH) and os.path.exists(RANKER_META_PATH):
+        return Recommender(model_path=RANKER_PATH, label2id_path=None, prune=prune)
+    return Recommender(prune=prune)
+
+# 所有頁面與服務共用同一個 Recommender
+def get_recommender():
+    global _shared
+    if _shared is None:
+        with _shared_lock:
+            if _shared is None:
+                _shared = make_recommender()
+    return _shared
+
+# 商品目錄、折扣規則或模型種類（multiclass / 二元排序）變動時換上新的共用 Recommender
+def reset_recommender():
+    global _shared
+    with _shared_lock:
+        _shared = make_recommender()
+    return _shared
+
+# 單次預測：傳入購物車資料，回傳推薦商品 ID 或 None
+def recommend_addon(cart_data):
+    return get_recommender().recommend(cart_data)
 
-    return predicted_addon if predicted_addon not in [None, "None"] else None
+# Top-K：回傳 [{id, name, price, score, saved_by_addon, triggered_discounts}]，依分數由高到低
+def recommend_topk(cart_data, k=3):
+    return get_recommender().recommend_topk(cart_data, k)
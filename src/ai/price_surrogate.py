@@ -0,0 +1,261 @@
+import argparse
+import json
+import os
+import random
+import threading
+import time
+import numpy as np
+import lightgbm as lgb
+from src.ai.cart_features import RaggedCarts, cart_feature_matrix
+from src.core.cart import Cart
+from src.core.solve_cache import SolveCache, get_solve_cache
+
+# 拆帳代理模型：以 train_model.py --surrogate 訓練的模型預估折扣金額與使用的折扣，
+# 供購物車編輯中的即時金額預覽使用；信心不足時退回 solve_cart_split 精確計算
+#   python -m src.ai.price_surrogate --report          # 準確度 / 延遲報告
+# 頁面只在報告顯示目前模型有快速路徑時才使用代理模型（見 surrogate_enabled）
+
+SURROGATE_DIR = "data/training/price_surrogate/"
+REPORT_PATH = "data/training/price_surrogate_report.json"
+PRODUCT_PATH = "data/raw/products.json"
+DISCOUNT_PATH = "data/raw/discounts.json"
+# 折扣分位數區間寬度超過 MAX_INTERVAL 元、或任一規則的使用機率離 0 / 1 太近
+# （|2p - 1| < MIN_MARGIN）就改用精確計算
+MAX_INTERVAL = 100
+MIN_MARGIN = 0.6
+
+def load_json(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def _cart_dicts(carts):
+    for items in carts:
+        yield {"items": items.to_items() if isinstance(items, Cart) else items}
+
+class PriceSurrogate:
+    # 模型只載入一次，meta.json 更新時自動重載；規則版本與訓練時不同則一律精確計算
+    def __init__(self, model_dir=SURROGATE_DIR, solve_cache=None, max_interval=MAX_INTERVAL, min_margin=MIN_MARGIN):
+        self.model_dir = model_dir
+        self.meta_path = os.path.join(model_dir, "meta.json")
+        self.solve_cache = solve_cache or get_solve_cache()
+        self.max_interval = max_interval
+        self.min_margin = min_margin
+        self._lock = threading.Lock()
+        self._mtime = None
+        # (meta, 折扣模型, 分位數模型, 各規則模型)：重載時整組建好再一次換上，預測中的請求只讀取同一組
+        self.loaded = None
+        self.reload_if_changed()
+
+    def reload_if_changed(self):
+        try:
+            mtime = os.stat(self.meta_path).st_mtime_ns
+        except FileNotFoundError:
+            # 重新訓練中 meta.json 暫時不存在：沿用已載入的模型
+            if self.loaded is None:
+                raise
+            return False
+        if mtime == self._mtime:
+            return False
+        with self._lock:
+            if mtime != self._mtime:
+                meta = load_json(self.meta_path)
+                path = lambda name: os.path.join(self.model_dir, name)
+                discount_model = lgb.Booster(model_file=path("discount.txt"))
+                quantile_models = [lgb.Booster(model_file=path(f"discount_q{int(q * 100)}.txt"))
+                                   for q in meta["quantiles"]]
+                rule_models = {rid: lgb.Booster(model_file=path(f"used_{rid}.txt"))
+                               for rid in meta["rule_ids"] if rid not in meta["constant"]}
+                self.loaded = (meta, discount_model, quantile_models, rule_models)
+                self._mtime = mtime
+        return True
+
+    @property
+    def meta(self):
+        return self.loaded[0]
+
+    @property
+    def model_stamp(self):
+        # 目前模型的識別（meta.json 的 mtime），報告據此判斷是否針對同一個模型
+        return self._mtime
+
+    @property
+    def stale(self):
+        # 規則換過版本時模型不再適用
+        return self.solve_cache.ruleset.version != self.meta["rules_version"]
+
+    def predict_many(self, carts, early_exit=False):
+        # carts：多台購物車（一件一個 dict 的 list 或 Cart）；回傳每台的預估與信心判斷
+        # early_exit：某台購物車一確定要精確計算（區間過寬或某條規則不確定）就不再跑其餘規則模型，
+        # 該台的 used_discounts 只含已算過的規則
+        self.reload_if_changed()
+        meta, discount_model, quantile_models, rule_models = self.loaded
+        rule_ids, constant = meta["rule_ids"], meta["constant"]
+        ragged = RaggedCarts.from_carts(_cart_dicts(carts))
+        X = cart_feature_matrix(ragged, meta["min_threshold"], dtype=np.float64)
+        totals = X[:, 1]
+        discount = np.clip(discount_model.predict(X), 0, totals)
+        lo, hi = (m.predict(X) for m in quantile_models)
+        interval = np.abs(hi - lo)
+
+        confident = (interval <= self.max_interval) & (not self.stale)
+        probs = np.full((len(X), len(rule_ids)), np.nan)
+        margin = np.ones(len(X))
+        for j, rid in enumerate(rule_ids):
+            rows = np.flatnonzero(confident) if early_exit else np.arange(len(X))
+            if len(rows) == 0:
+                break
+            p = np.full(len(rows), constant[rid]) if rid in constant else rule_models[rid].predict(X[rows])
+            probs[rows, j] = p
+            margin[rows] = np.minimum(margin[rows], np.abs(2 * p - 1))
+            confident[rows] &= margin[rows] >= self.min_margin
+
+        results = []
+        for i in range(len(X)):
+            total_discount = int(round(discount[i]))
+            results.append({
+                "original_total": int(totals[i]),
+                "total_discount": total_discount,
+                "final_price": int(totals[i]) - total_discount,
+                "used_discounts": [rid for rid, p in zip(rule_ids, probs[i]) if p >= 0.5],
+                "interval": float(interval[i]),
+                "margin": float(margin[i]),
+                "confident": bool(confident[i]),
+            })
+        return results
+
+    def predict(self, cart_items, early_exit=False):
+        return self.predict_many([cart_items], early_exit)[0]
+
+    def exact(self, cart_items):
+        orders = self.solve_cache(cart_items)
+        return {
+            "original_total": sum(o["result"]["original_total"] for o in orders),
+            "total_discount": sum(o["result"]["total_discount"] for o in orders),
+            "final_price": sum(o["result"]["final_price"] for o in orders),
+            "used_discounts": sorted(set(d["id"] for o in orders for d in o["result"]["used_discounts"])),
+            "exact": True,
+            "orders": orders,
+        }
+
+    def preview(self, cart_items):
+        # 即時預覽：有信心時直接回傳預估（exact=False），否則以拆帳快取精確計算（exact=True，附 orders）
+        # 規則已換版本時不跑模型，直接精確計算
+        self.reload_if_changed()
+        if self.stale:
+            return self.exact(cart_items)
+        guess = self.predict(cart_items, early_exit=True)
+        if guess["confident"]:
+            return {**guess, "exact": False, "orders": None}
+        return self.exact(cart_items)
+
+def surrogate_enabled(surrogate, report_path=REPORT_PATH):
+    # 只有 --report 針對目前這個模型量到快速路徑（fast_path_rate > 0）時才啟用；
+    # 否則每次預覽都白跑一輪模型，最後仍然精確計算
+    if surrogate.stale or not os.path.exists(report_path):
+        return False
+    result = load_json(report_path)
+    thresholds = {"max_interval": surrogate.max_interval, "min_margin": surrogate.min_margin}
+    return (result.get("model") == surrogate.model_stamp and result.get("thresholds") == thresholds
+            and result.get("fast_path_rate", 0) > 0)
+
+_shared = None
+_shared_lock = threading.Lock()
+
+def get_price_surrogate():
+    # 共用的代理模型；尚未訓練、報告顯示沒有快速路徑或規則已換版本時回傳 None，呼叫端直接精確計算
+    global _shared
+    if _shared is None and os.path.exists(os.path.join(SURROGATE_DIR, "meta.json")):
+        with _shared_lock:
+            if _shared is None:
+                _shared = PriceSurrogate()
+    if _shared is None:
+        return None
+    _shared.reload_if_changed()
+    return _shared if surrogate_enabled(_shared) else None
+
+# ===== 準確度 / 延遲報告 =====
+
+def _latency(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] / 1e6
+    return {"p50_ms": round(pick(0.5), 4), "p99_ms": round(pick(0.99), 4),
+            "mean_ms": round(sum(samples) / len(samples) / 1e6, 4)}
+
+def report(surrogate, carts):
+    # 與精確拆帳比較：整體誤差、通過信心門檻的比例與其誤差、各路徑延遲
+    # surrogate 應使用不保留結果的拆帳快取（maxsize=0），延遲才是實際計算的時間
+    solver = surrogate.solve_cache
+    guess_ns, solve_ns, preview_ns = [], [], []
+    rows = []
+    for items in carts:
+        started = time.perf_counter_ns()
+        guess = surrogate.predict(items)
+        guess_ns.append(time.perf_counter_ns() - started)
+
+        started = time.perf_counter_ns()
+        orders = solver(items)
+        solve_ns.append(time.perf_counter_ns() - started)
+
+        started = time.perf_counter_ns()
+        surrogate.preview(items)
+        preview_ns.append(time.perf_counter_ns() - started)
+
+        exact_price = sum(o["result"]["final_price"] for o in orders)
+        exact_used = sorted(set(d["id"] for o in orders for d in o["result"]["used_discounts"]))
+        rows.append((guess["confident"], abs(guess["final_price"] - exact_price), guess["used_discounts"] == exact_used))
+
+    def accuracy(subset):
+        if not subset:
+            return {"carts": 0}
+        errors = np.array([e for _, e, _ in subset], dtype=np.float64)
+        return {
+            "carts": len(subset),
+            "final_price_mae": round(float(errors.mean()), 3),
+            "final_price_p95_error": round(float(np.percentile(errors, 95)), 3),
+            "used_discounts_exact_match": round(sum(m for _, _, m in subset) / len(subset), 4),
+        }
+
+    accepted = [r for r in rows if r[0]]
+    return {
+        "carts": len(rows),
+        "model": surrogate.model_stamp,
+        "stale_model": surrogate.stale,
+        "thresholds": {"max_interval": surrogate.max_interval, "min_margin": surrogate.min_margin},
+        "fast_path_rate": round(len(accepted) / len(rows), 4) if rows else 0,
+        "accuracy": {"all": accuracy(rows), "fast_path": accuracy(accepted)},
+        "latency": {"predict": _latency(guess_ns), "solve_cart_split": _latency(solve_ns),
+                    "preview": _latency(preview_ns)},
+        "trained": surrogate.meta.get("metrics"),
+    }
+
+def sample_carts(count, seed):
+    # 以 cart_gen_bulk 的 auto 購物車產生未參與訓練的新購物車
+    from src.core.rule_loader import load_rules
+    from src.simulate.cart_gen_bulk import CartPools, auto_cart
+    pools = CartPools(load_json(PRODUCT_PATH), load_rules(DISCOUNT_PATH))
+    rng = random.Random(f"surrogate-report:{seed}")
+    return [auto_cart(pools, rng, f"report_{i}")["items"] for i in range(count)]
+
+def main():
+    parser = argparse.ArgumentParser(description="拆帳代理模型：準確度 / 延遲報告")
+    parser.add_argument("--report", action="store_true")
+    parser.add_argument("--carts", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-interval", type=float, default=MAX_INTERVAL)
+    parser.add_argument("--min-margin", type=float, default=MIN_MARGIN)
+    parser.add_argument("--out", default=REPORT_PATH)
+    args = parser.parse_args()
+
+    if not args.report:
+        parser.print_help()
+        return
+    surrogate = PriceSurrogate(solve_cache=SolveCache(DISCOUNT_PATH, maxsize=0),
+                               max_interval=args.max_interval, min_margin=args.min_margin)
+    result = report(surrogate, sample_carts(args.carts, args.seed))
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    print(f"✅ 報告已儲存至 {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,33 @@
+import argparse
 import json
 import os
+from glob import glob
+import numpy as np
 import pandas as pd
 import lightgbm as lgb
 from collections import Counter
-from sklearn.metrics import accuracy_score, classification_report
+from sklearn.metrics import accuracy_score, classification_report, roc_auc_score
+from sklearn.model_selection import GroupShuffleSplit
 
 X_PATH = "data/training/X_addon.jsonl"
 Y_PATH = "data/training/Y_addon.jsonl"
 DISCOUNT_PATH = "data/raw/discounts.json"
+PRODUCT_PATH = "data/raw/products.json"
+SIM_DIR = "data/user_simulated/"
+COLUMNAR_DIR = "data/training/addon_columnar/"
+# JSONL 格式的資料集設定（欄式資料寫在 COLUMNAR_DIR/meta.json）
+JSONL_META_PATH = "data/training/X_addon.meta.json"
+MODEL_PATH = "data/training/addon_model.txt"
+LABEL2ID_PATH = "data/training/label2id.json"
+# 二元 / 排序模型：每個 (購物車, 候選商品) 一列一個分數，模型大小不隨商品目錄成長
+RANKER_PATH = "data/training/addon_ranker.txt"
+RANKER_META_PATH = "data/training/addon_ranker.json"
+OBJECTIVES = ("multiclass", "binary", "lambdarank")
+# 依 cart_id 分組切分：同一台購物車的候選列只會在訓練或測試其中一邊
+TEST_SIZE = 0.2
+SPLIT_SEED = 42
+# 增量回訓：每次接續訓練的 boosting 輪數；已用過的回饋檔清單依模型檔分開記錄（見 consumed_path）
+INCREMENTAL_ROUNDS = 20
 CATEGORY_LIST = ['衣服', '食品', '日用品', '3C']
 
 def load_jsonl(path):
@@ -18,8 +38,15 @@ def load_json(path):
     with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
 
-# 加入滿額折扣距離特徵
-discount_rules = load_json(DISCOUNT_PATH)
+# 加入滿額折扣距離特徵；折扣規則在第一次用到時才讀取，import 本模組不碰磁碟
+_discount_rules = None
+def get_discount_rules():
+    global _discount_rules
+    if _discount_rules is None:
+        from src.core.rule_loader import load_rules
+        _discount_rules = load_rules(DISCOUNT_PATH)
+    return _discount_rules
+
 def distance_to_nearest_threshold(total_price, discounts):
     diffs = []
     for d in discounts:
@@ -51,7 +78,7 @@ def extract_features(cart_item):
 
     # 距離滿額門檻
     feature["distance_to_full_discount"] = distance_to_nearest_threshold(
-        feature["total_price"], discount_rules
+        feature["total_price"], get_discount_rules()
     )
 
     return feature
@@ -64,35 +91,195 @@ def build_label_encoder(y_raw):
     id2label = {v: k for k, v in label2id.items()}
     return label2id, id2label
 
-def main():
+def load_columnar(path=COLUMNAR_DIR):
+    # 以 mmap 開啟 build_addon_dataset 輸出的欄式資料，不需逐行解析 JSON
+    meta = load_json(os.path.join(path, "meta.json"))
+    arrays = {
+        name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+        for name in ("features", "cart_row", "addon_index", "label")
+    }
+    return meta, arrays
+
+def load_dataset_jsonl():
     X_raw = load_jsonl(X_PATH)
     Y_raw = load_jsonl(Y_PATH)
 
     X = pd.DataFrame([extract_features(x) for x in X_raw])
     label2id, id2label = build_label_encoder(Y_raw)
-
-    # 🔽 儲存 label2id 對照表供推論使用
-    with open("data/training/label2id.json", "w", encoding="utf-8") as f:
-        json.dump(label2id, f, ensure_ascii=False, indent=2)
-
     y = pd.Series([label2id[y["recommended_addon"]] for y in Y_raw])
 
     # 🔁 加入 sample_weight：推薦成功為 1，拒絕為 0.2 權重
-    sample_weight = [1.0 if y["recommended_addon"] else 0.2 for y in Y_raw]
+    sample_weight = np.array([1.0 if y["recommended_addon"] else 0.2 for y in Y_raw])
+    groups = np.array([x["cart_id"] for x in X_raw])
+    return X, y, sample_weight, label2id, id2label, groups
 
-    print(f"📘 共 {len(label2id)} 類別（含 None）：")
-    for k, v in label2id.items():
-        print(f"  {v:>2} → {k or 'None'}")
+def columnar_cart_ids(path=COLUMNAR_DIR):
+    # cart_row → cart_id
+    with open(os.path.join(path, "carts.jsonl"), "r", encoding="utf-8") as f:
+        return np.array([json.loads(line)["cart_id"] for line in f])
+
+def load_dataset_columnar(path=COLUMNAR_DIR):
+    meta, arrays = load_columnar(path)
+    X = pd.DataFrame(arrays["features"], columns=meta["columns"], copy=False)
+    product_ids = meta["product_ids"]
+
+    # 類別編碼與 build_label_encoder 相同：商品 ID 排序，None 放最後
+    label = np.asarray(arrays["label"])
+    present = np.unique(label[label >= 0])
+    labels = sorted(product_ids[i] for i in present)
+    label2id = {l: i for i, l in enumerate(labels)}
+    label2id[None] = len(label2id)
+    id2label = {v: k for k, v in label2id.items()}
+
+    lookup = np.full(len(product_ids) + 1, label2id[None], dtype=np.int64)
+    for i in present:
+        lookup[i] = label2id[product_ids[i]]
+    y = pd.Series(lookup[label])  # label = -1 會取到最後一格（None）
+
+    sample_weight = np.where(label >= 0, 1.0, 0.2)
+    groups = columnar_cart_ids(path)[np.asarray(arrays["cart_row"])]
+    return X, y, sample_weight, label2id, id2label, groups
+
+def _mtime(path):
+    return os.stat(path).st_mtime if os.path.exists(path) else None
+
+def dataset_source(source="auto"):
+    # auto：欄式資料與 X_addon.jsonl 哪個比較新就用哪個（兩種格式可能先後建過）
+    if source != "auto":
+        return source
+    columnar, jsonl = _mtime(os.path.join(COLUMNAR_DIR, "meta.json")), _mtime(X_PATH)
+    if columnar is not None and (jsonl is None or columnar >= jsonl):
+        return "columnar"
+    return "jsonl"
+
+def load_dataset(source="auto"):
+    # 欄式資料直接 mmap，JSONL 則逐行解析 X_addon / Y_addon
+    if dataset_source(source) == "columnar":
+        return load_dataset_columnar()
+    return load_dataset_jsonl()
+
+def run_lengths(keys):
+    # 連續相同 key 的列數（資料依購物車順序寫入，同一台購物車的候選列相鄰）
+    keys = np.asarray(keys)
+    if len(keys) == 0:
+        return np.zeros(0, dtype=np.int64)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    return np.diff(np.r_[starts, len(keys)])
+
+def load_ranking_dataset(source="auto"):
+    # 回傳 (X, y, 每列的 cart_id)；y = 該列的候選商品就是推薦商品（有省錢 / 使用者接受）
+    if dataset_source(source) == "columnar":
+        meta, arrays = load_columnar()
+        X = pd.DataFrame(arrays["features"], columns=meta["columns"], copy=False)
+        y = (np.asarray(arrays["label"]) >= 0).astype(np.int32)
+        return X, y, columnar_cart_ids()[np.asarray(arrays["cart_row"])]
+
+    X_raw = load_jsonl(X_PATH)
+    Y_raw = load_jsonl(Y_PATH)
+    X = pd.DataFrame([extract_features(x) for x in X_raw])
+    y = np.array([1 if row["recommended_addon"] else 0 for row in Y_raw], dtype=np.int32)
+    return X, y, np.array([x["cart_id"] for x in X_raw])
+
+def group_split(groups, test_size=TEST_SIZE, seed=SPLIT_SEED):
+    # 回傳 (訓練列索引, 測試列索引)，依 cart_id 整組分配；兩邊都保持原本的列順序
+    if len(np.unique(groups)) < 2:
+        return np.arange(len(groups)), np.arange(0)
+    splitter = GroupShuffleSplit(n_splits=1, test_size=test_size, random_state=seed)
+    train_idx, test_idx = next(splitter.split(np.zeros(len(groups)), groups=groups))
+    return np.sort(train_idx), np.sort(test_idx)
+
+def hit_rate_at_1(scores, y, groups):
+    # 有正樣本的購物車中，分數最高的候選就是正樣本的比例
+    hits = total = 0
+    start = 0
+    for size in groups:
+        end = start + size
+        if y[start:end].any():
+            total += 1
+            hits += int(y[start + int(np.argmax(scores[start:end]))])
+        start = end
+    return hits / total if total else 0
 
-    split = int(len(X) * 0.8)
-    X_train, X_test = X[:split], X[split:]
-    y_train, y_test = y[:split], y[split:]
-    w_train = sample_weight[:split]
-    w_test = sample_weight[split:]
+def choose_threshold(scores, y, groups):
+    # 每台購物車只看最高分的候選，分數 ≥ 門檻才推薦，否則回傳 None；
+    # 挑讓最多台購物車答對的門檻（最高分候選是正樣本時推薦、不是時回傳 None）
+    tops, good = [], []
+    start = 0
+    for size in groups:
+        end = start + size
+        best = start + int(np.argmax(scores[start:end]))
+        tops.append(scores[best])
+        good.append(bool(y[best]))
+        start = end
+    if not tops:
+        return None
+    tops, good = np.array(tops), np.array(good)
+    order = np.argsort(-tops, kind="stable")
+    # 推薦分數最高的前 k 台：答對數 = 前 k 台中的正樣本 + 其餘的非正樣本
+    correct = np.r_[0, np.cumsum(good[order])] + np.r_[(~good).sum(), (~good).sum() - np.cumsum(~good[order])]
+    k = int(np.argmax(correct))
+    if k == 0:
+        return float(np.nextafter(tops[order[0]], np.inf))
+    return float(tops[order[k - 1]])
+
+def train_ranker(objective="binary", source="auto"):
+    source = dataset_source(source)
+    X, y, cart_ids = load_ranking_dataset(source)
+
+    train_idx, test_idx = group_split(cart_ids)
+    X_train, X_test = X.iloc[train_idx], X.iloc[test_idx]
+    y_train, y_test = y[train_idx], y[test_idx]
+    g_train, g_test = run_lengths(cart_ids[train_idx]), run_lengths(cart_ids[test_idx])
+
+    if objective == "lambdarank":
+        model = lgb.LGBMRanker(objective="lambdarank")
+        model.fit(X_train, y_train, group=g_train)
+    else:
+        model = lgb.LGBMClassifier(objective="binary")
+        model.fit(X_train, y_train)
+    model.booster_.save_model(RANKER_PATH)
+    mark_consumed(RANKER_PATH, dataset_feedback(source), replace=True)
+
+    # 門檻由測試集決定：最高分低於門檻時推薦器回傳 None（沒有測試集時為 None，一律推薦最高分）
+    # 推論端以 SplitState 試算 saved_by_addon / triggered_discounts，與測試集特徵一致
+    scores = model.booster_.predict(X_test)
+    threshold = choose_threshold(scores, y_test, g_test)
+    with open(RANKER_META_PATH, "w", encoding="utf-8") as f:
+        json.dump({"objective": objective, "columns": list(X.columns), "threshold": threshold},
+                  f, ensure_ascii=False, indent=2)
+    print(f"\n✅ {objective} 模型已儲存：{RANKER_PATH}（訓練 {len(g_train)} 台 / 測試 {len(g_test)} 台購物車）")
+    if len(set(y_test)) > 1:
+        print(f"📈 AUC：{roc_auc_score(y_test, scores):.4f}")
+    print(f"🎯 Hit@1：{hit_rate_at_1(scores, y_test, g_test):.3%}")
+    if threshold is not None:
+        print(f"🚦 推薦門檻：{threshold:.4f}（最高分低於門檻時不推薦）")
+
+def main(objective="multiclass", source="auto"):
+    if objective != "multiclass":
+        return train_ranker(objective, source)
+
+    source = dataset_source(source)
+    X, y, sample_weight, label2id, id2label, groups = load_dataset(source)
+
+    train_idx, test_idx = group_split(groups)
+    X_train, X_test = X.iloc[train_idx], X.iloc[test_idx]
+    y_train, y_test = y.iloc[train_idx], y.iloc[test_idx]
+    w_train = sample_weight[train_idx]
+    print(f"\n🔀 依購物車分組切分：訓練 {len(np.unique(groups[train_idx]))} 台 / 測試 {len(np.unique(groups[test_idx]))} 台")
 
     model = lgb.LGBMClassifier(objective="multiclass", num_class=len(label2id))
     model.fit(X_train, y_train, sample_weight=w_train)
-    model.booster_.save_model("data/training/addon_model.txt")
+    model.booster_.save_model(MODEL_PATH)
+    mark_consumed(MODEL_PATH, dataset_feedback(source), replace=True)
+
+    # 🔽 儲存 label2id 對照表供推論使用：模型輸出欄位只涵蓋訓練集中出現的類別，依 model.classes_ 重新編號
+    model_label2id = {id2label[int(c)]: j for j, c in enumerate(model.classes_)}
+    with open(LABEL2ID_PATH, "w", encoding="utf-8") as f:
+        json.dump(model_label2id, f, ensure_ascii=False, indent=2)
+
+    print(f"📘 共 {len(model_label2id)} 類別（含 None）：")
+    for k, v in model_label2id.items():
+        print(f"  {v:>2} → {k or 'None'}")
 
     y_pred = model.predict(X_test)
     acc = accuracy_score(y_test, y_pred)
@@ -108,5 +295,128 @@ def main():
         zero_division=0
     ))
 
+# ===== 使用者回饋增量回訓 =====
+
+def incremental_model_path(objective):
+    # multiclass 接續 addon_model.txt，二元 / 排序模型接續 addon_ranker.txt
+    return MODEL_PATH if objective == "multiclass" else RANKER_PATH
+
+def consumed_path(model_path):
+    # 每個模型檔各自一份已用回饋清單：addon_model.txt → addon_model.consumed.json
+    return os.path.splitext(model_path)[0] + ".consumed.json"
+
+def load_consumed(model_path):
+    path = consumed_path(model_path)
+    if not os.path.exists(path):
+        return {}
+    return load_json(path)
+
+def mark_consumed(model_path, stamps, replace=False):
+    # 記錄已進入模型的回饋檔（檔名 → 讀取當時的 mtime），檔案之後被改寫會再被視為新回饋
+    # replace=True：完整重新訓練，模型只包含這次資料集裡的回饋，舊清單整份換掉
+    consumed = {} if replace else load_consumed(model_path)
+    for path, mtime in stamps.items():
+        consumed[os.path.basename(path)] = mtime
+    path = consumed_path(model_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(consumed, f, ensure_ascii=False, indent=2)
+
+def feedback_files():
+    return sorted(glob(os.path.join(SIM_DIR, "*.json")))
+
+def dataset_feedback(source="auto"):
+    # 完整訓練後：build_addon_dataset 建資料時記下的回饋檔與當時的 mtime 視為已使用
+    # （訓練時才 stat 會把建資料之後才改寫的回饋誤標為已用過）
+    if dataset_source(source) == "columnar":
+        meta_path = os.path.join(COLUMNAR_DIR, "meta.json")
+    else:
+        meta_path = JSONL_META_PATH
+    if not os.path.exists(meta_path):
+        return {}
+    return load_json(meta_path).get("feedback", {})
+
+def new_feedback(model_path):
+    # 回傳 {路徑: mtime}：這個模型尚未使用或使用後被改寫的回饋檔
+    consumed = load_consumed(model_path)
+    stamps = {path: os.stat(path).st_mtime for path in feedback_files()}
+    return {path: mtime for path, mtime in stamps.items() if consumed.get(os.path.basename(path)) != mtime}
+
+def feedback_rows(paths):
+    # 回傳 (X, 推薦商品或 None, 是否接受, cart_id)；每個回饋檔一列
+    from src.ai.build_addon_dataset import sim_records
+    from src.core.ruleset import CompiledRuleSet
+
+    ruleset = CompiledRuleSet(get_discount_rules())
+    product_dict = {p["id"]: p for p in load_json(PRODUCT_PATH)}
+    X_raw, Y_raw, accepted = [], [], []
+    for path in paths:
+        sim = load_json(path)
+        X_data, Y_data = sim_records(path, sim, product_dict, ruleset)
+        X_raw += X_data
+        Y_raw += Y_data
+        accepted += [bool(sim["accepted"])] * len(X_data)
+    X = pd.DataFrame([extract_features(x) for x in X_raw]) if X_raw else None
+    return X, [y["recommended_addon"] for y in Y_raw], accepted, np.array([x["cart_id"] for x in X_raw])
+
+def retrain_incremental(objective="multiclass", rounds=INCREMENTAL_ROUNDS):
+    # 以現有模型為起點（init_model），只用這個模型尚未使用過的回饋檔接續 boosting
+    model_path = incremental_model_path(objective)
+    paths = new_feedback(model_path)
+    if not paths:
+        print("✅ 沒有新的使用者回饋，模型維持不變")
+        return None
+
+    X, labels, accepted, cart_ids = feedback_rows(paths)
+    if X is None:
+        print("⚠️ 新回饋中的推薦商品都不在商品目錄，略過")
+        mark_consumed(model_path, paths)
+        return None
+    print(f"📥 新回饋 {len(paths)} 筆，接受率 {np.mean(accepted):.1%}")
+
+    if objective == "multiclass":
+        label2id = {k if k != "null" else None: v for k, v in load_json(LABEL2ID_PATH).items()}
+        # 既有模型的類別數固定，類別表外的商品無法加入，只能等下次完整訓練
+        keep = [label in label2id for label in labels]
+        if not any(keep):
+            print("⚠️ 新回饋的推薦商品都不在現有類別表，請重新完整訓練")
+            return None
+        X = X[keep]
+        y = np.array([label2id[label] for label, k in zip(labels, keep) if k])
+        weight = np.where(np.array([label is not None for label, k in zip(labels, keep) if k]), 1.0, 0.2)
+        params = {"objective": "multiclass", "num_class": len(label2id)}
+        train_set = lgb.Dataset(X, y, weight=weight)
+    else:
+        # 二元 / 排序模型沿用訓練時的 objective
+        objective = load_json(RANKER_META_PATH)["objective"]
+        y = np.array([1 if label is not None else 0 for label in labels])
+        params = {"objective": objective}
+        if objective == "lambdarank":
+            # 與完整訓練相同，同一台購物車的回饋列為一組（排序後相鄰）
+            order = np.argsort(cart_ids, kind="stable")
+            X, y = X.iloc[order], y[order]
+            train_set = lgb.Dataset(X, y, group=run_lengths(cart_ids[order]))
+        else:
+            train_set = lgb.Dataset(X, y)
+
+    params.update({"min_data_in_leaf": 1, "verbose": -1})
+    booster = lgb.train(params, train_set, num_boost_round=rounds, init_model=model_path)
+    booster.save_model(model_path)
+    mark_consumed(model_path, paths)
+    print(f"✅ 已接續訓練 {rounds} 輪並儲存：{model_path}（共 {booster.num_trees()} 棵樹）")
+    return booster
+
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="訓練加購推薦模型")
+    parser.add_argument("--objective", choices=OBJECTIVES, default="multiclass",
+                        help="multiclass：每個商品一類；binary / lambdarank：每個候選列一個分數")
+    parser.add_argument("--incremental", action="store_true",
+                        help="以現有模型接續訓練，只使用尚未用過的 data/user_simulated 回饋")
+    parser.add_argument("--rounds", type=int, default=INCREMENTAL_ROUNDS, help="增量回訓的 boosting 輪數")
+    parser.add_argument("--source", choices=["auto", "columnar", "jsonl"], default="auto",
+                        help="訓練資料來源；auto 取 addon_columnar/ 與 X_addon.jsonl 中較新的一份")
+    args = parser.parse_args()
+    if args.incremental:
+        retrain_incremental(args.objective, args.rounds)
+    else:
+        main(args.objective, args.source)
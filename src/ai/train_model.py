@@ -1,14 +1,24 @@
+import argparse
 import json
 import os
+import numpy as np
 import lightgbm as lgb
 import pandas as pd
 import matplotlib.pyplot as plt
 from sklearn.metrics import mean_squared_error
 from math import sqrt
 from collections import Counter
+from ai.cart_features import FEATURE_COLUMNS, RaggedCarts, cart_feature_matrix, load_meta
 
 X_PATH = "data/training/X.jsonl"
 Y_PATH = "data/training/Y.jsonl"
+COLUMNAR_DIR = "data/training/price_columnar/"
+# 拆帳代理模型（price_surrogate.py 載入）：折扣金額 + 分位數區間 + 每條規則是否使用
+SURROGATE_DIR = "data/training/price_surrogate/"
+QUANTILES = (0.1, 0.9)
+TRAIN_RATIO = 0.8
+# 與 extract_features 相同的欄位（不含 distance_to_full_discount）
+TRAIN_COLUMNS = [c for c in FEATURE_COLUMNS if c != "distance_to_full_discount"]
 
 CATEGORY_LIST = ['衣服', '食品', '日用品', '3C']
 
@@ -35,6 +45,34 @@ def extract_features(cart_item):
 
     return feature
 
+def _mtime(path):
+    return os.stat(path).st_mtime if os.path.exists(path) else None
+
+def dataset_source(source="auto"):
+    # auto：price_columnar/ 與 X.jsonl 哪個比較新就用哪個（兩種格式可能先後建過）
+    if source != "auto":
+        return source
+    columnar, jsonl = _mtime(os.path.join(COLUMNAR_DIR, "meta.json")), _mtime(X_PATH)
+    if columnar is not None and (jsonl is None or columnar >= jsonl):
+        return "columnar"
+    return "jsonl"
+
+def load_dataset(source="auto"):
+    # 欄式輸出直接 mmap，不解析 JSON；JSONL 則從 X.jsonl 的 items 向量化計算（與欄式輸出同為 float64）
+    if dataset_source(source) == "columnar":
+        columns = load_meta(COLUMNAR_DIR)["columns"]
+        features = np.load(os.path.join(COLUMNAR_DIR, "features.npy"), mmap_mode="r")
+        X = pd.DataFrame(np.asarray(features[:, [columns.index(c) for c in TRAIN_COLUMNS]]), columns=TRAIN_COLUMNS)
+        y = pd.Series(np.load(os.path.join(COLUMNAR_DIR, "final_price.npy")))
+        return X, y
+
+    X_raw = load_jsonl(X_PATH)
+    Y_raw = load_jsonl(Y_PATH)
+    features = cart_feature_matrix(RaggedCarts.from_carts(X_raw), dtype=np.float64)
+    X = pd.DataFrame(features[:, [FEATURE_COLUMNS.index(c) for c in TRAIN_COLUMNS]], columns=TRAIN_COLUMNS)
+    y = pd.Series([y["final_price"] for y in Y_raw])
+    return X, y
+
 def plot_results(y_true, y_pred):
     # 散佈圖：預測 vs 實際
     plt.figure(figsize=(6, 6))
@@ -58,14 +96,69 @@ def plot_results(y_true, y_pred):
     plt.tight_layout()
     plt.show()
 
-def main():
-    X_raw = load_jsonl(X_PATH)
-    Y_raw = load_jsonl(Y_PATH)
-
-    X = pd.DataFrame([extract_features(x) for x in X_raw])
-    y = pd.Series([y["final_price"] for y in Y_raw])
-
-    split = int(len(X) * 0.8)
+def train_surrogate(path=COLUMNAR_DIR, out_dir=SURROGATE_DIR):
+    # 以欄式資料訓練：total_discount 點估計與 QUANTILES 分位數、每條規則一個二元分類器（多標籤）
+    # final_price 由「原價 - 預測折扣」得到，兩者不會互相矛盾
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        raise SystemExit(f"❌ 找不到欄式資料：{path}（先執行 build_dataset.py）")
+    meta = load_meta(path)
+    X = np.asarray(np.load(os.path.join(path, "features.npy"), mmap_mode="r"))
+    discount = np.load(os.path.join(path, "total_discount.npy"))
+    used = np.load(os.path.join(path, "used_discounts.npy"), mmap_mode="r")
+
+    split = int(len(X) * TRAIN_RATIO)
+    X_train, X_test = X[:split], X[split:]
+    os.makedirs(out_dir, exist_ok=True)
+
+    model = lgb.LGBMRegressor(verbose=-1)
+    model.fit(X_train, discount[:split])
+    model.booster_.save_model(os.path.join(out_dir, "discount.txt"))
+    pred = model.predict(X_test)
+    for q in QUANTILES:
+        qmodel = lgb.LGBMRegressor(objective="quantile", alpha=q, verbose=-1)
+        qmodel.fit(X_train, discount[:split])
+        qmodel.booster_.save_model(os.path.join(out_dir, f"discount_q{int(q * 100)}.txt"))
+
+    # 訓練集中恆為 0 / 1 的規則不建模型，直接記錄常數機率
+    constant = {}
+    hits = np.zeros((len(X_test), len(meta["rule_ids"])), dtype=bool)
+    for j, rule_id in enumerate(meta["rule_ids"]):
+        y_rule = np.asarray(used[:split, j])
+        if y_rule.min() == y_rule.max():
+            constant[rule_id] = float(y_rule[0])
+            hits[:, j] = bool(y_rule[0])
+            continue
+        clf = lgb.LGBMClassifier(verbose=-1)
+        clf.fit(X_train, y_rule)
+        clf.booster_.save_model(os.path.join(out_dir, f"used_{rule_id}.txt"))
+        hits[:, j] = clf.predict_proba(X_test)[:, 1] >= 0.5
+
+    y_true = discount[split:]
+    used_test = np.asarray(used[split:]).astype(bool)
+    metrics = {
+        "test_rows": len(X_test),
+        "discount_mae": float(np.abs(pred - y_true).mean()) if len(y_true) else None,
+        "used_exact_match": float((hits == used_test).all(axis=1).mean()) if len(y_true) else None,
+        "used_hamming": float((hits != used_test).mean()) if len(y_true) else None,
+    }
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "columns": meta["columns"],
+            "rule_ids": meta["rule_ids"],
+            "constant": constant,
+            "quantiles": list(QUANTILES),
+            "rules_version": meta["rules_version"],
+            "min_threshold": meta["min_threshold"],
+            "metrics": metrics,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"✅ 代理模型已儲存至 {out_dir}：折扣 MAE {metrics['discount_mae']:.2f}，"
+          f"折扣組合完全命中 {metrics['used_exact_match']:.2%}")
+    return metrics
+
+def main(plot=True, source="auto"):
+    X, y = load_dataset(source)
+
+    split = int(len(X) * TRAIN_RATIO)
     X_train, X_test = X[:split], X[split:]
     y_train, y_test = y[:split], y[split:]
 
@@ -83,7 +176,18 @@ def main():
         diff = abs(real - pred)
         print(f"  - 實際: {real:>6.0f} ｜ 預測: {pred:>6.0f} ｜ 誤差: {diff:>6.0f}")
 
-    plot_results(y_test.values, y_pred)
+    if plot:
+        plot_results(y_test.values, y_pred)
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="拆帳金額回歸模型")
+    parser.add_argument("--surrogate", action="store_true",
+                        help="訓練並儲存拆帳代理模型（折扣金額、信賴區間、使用的折扣組合）")
+    parser.add_argument("--no-plot", action="store_true")
+    parser.add_argument("--source", choices=["auto", "columnar", "jsonl"], default="auto",
+                        help="訓練資料來源；auto 取 price_columnar/ 與 X.jsonl 中較新的一份")
+    args = parser.parse_args()
+    if args.surrogate:
+        train_surrogate()
+    else:
+        main(plot=not args.no_plot, source=args.source)
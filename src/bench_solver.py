@@ -0,0 +1,209 @@
+import argparse
+import json
+import math
+import platform
+import random
+import sys
+import time
+from datetime import datetime
+
+from src.core import profiling
+from src.core.discount import apply_discount
+from src.core.ruleset import CompiledRuleSet
+from src.core.solver import solve_cart, solve_cart_split
+from src.simulate import discount_gen
+from src.simulate.product_gen import PRODUCT_CATEGORIES, generate_products
+
+# 拆帳效能基準測試：掃描購物車大小 × 規則數 × 規則類型組合，輸出可比較的 JSON
+#   python -m src.bench_solver --out bench.json
+#   python -m src.bench_solver --quick --compare bench.json
+#   python -m src.bench_solver --quick --profile profile.prom   # 另跑一輪剖析，輸出各規則評估次數與時間
+
+CART_SIZES = [5, 20, 100, 500]
+RULE_COUNTS = [10, 100, 1000, 10000]
+PRODUCT_COUNT = 2000
+
+# 各類型權重與 exclusive / 不可疊加的機率
+RULE_MIXES = {
+    "balanced": {"weights": {"滿額折扣": 1, "滿件折扣": 1, "組合折扣": 1, "獨立折扣": 1},
+                 "exclusive": 0.1, "non_stackable": 0.05},
+    "threshold": {"weights": {"滿額折扣": 3, "滿件折扣": 3, "組合折扣": 1, "獨立折扣": 0},
+                  "exclusive": 0.0, "non_stackable": 0.0},
+    "bundle": {"weights": {"滿額折扣": 1, "滿件折扣": 0, "組合折扣": 3, "獨立折扣": 2},
+               "exclusive": 0.3, "non_stackable": 0.1},
+    "percent": {"weights": {"滿額折扣": 1, "滿件折扣": 1, "分類折扣": 2, "單品折扣": 2},
+                "exclusive": 0.1, "non_stackable": 0.05},
+}
+
+def generate_rules(products, count, mix, rng):
+    ids = [p["id"] for p in products]
+    types = list(mix["weights"])
+    weights = [mix["weights"][t] for t in types]
+    rules = []
+    for _ in range(count):
+        rule_type = rng.choices(types, weights)[0]
+        rule = {"id": discount_gen.next_id(), "type": rule_type}
+        if rule_type in ("分類折扣", "單品折扣"):
+            rule["percent"] = rng.choice([0.7, 0.8, 0.85, 0.9])
+        else:
+            rule["amount"] = rng.choice([50, 100, 200, 300])
+        if rule_type == "分類折扣":
+            rule["category"] = rng.choice(PRODUCT_CATEGORIES)
+        elif rule_type == "單品折扣":
+            rule["product_id"] = rng.choice(ids)
+        elif rule_type == "滿額折扣":
+            rule["category"] = rng.choice(PRODUCT_CATEGORIES)
+            rule["threshold"] = rng.randint(800, 8000)
+        elif rule_type == "滿件折扣":
+            rule["items"] = rng.sample(ids, rng.randint(2, 6))
+            rule["count"] = rng.randint(2, 4)
+        elif rule_type == "組合折扣":
+            rule["items"] = rng.sample(ids, rng.randint(2, 3))
+        else:
+            rule["items"] = rng.sample(ids, 1)
+        if rng.random() < mix["exclusive"]:
+            rule["exclusive"] = True
+        if rng.random() < mix["non_stackable"]:
+            rule["stackable"] = False
+        rules.append(rule)
+    return rules
+
+def generate_carts(products, size, n, rng, hot_ids):
+    # 一半商品從規則會用到的商品中挑，讓折扣有機會觸發
+    hot = [p for p in products if p["id"] in hot_ids] or products
+    carts = []
+    for _ in range(n):
+        carts.append([dict(rng.choice(hot if rng.random() < 0.5 else products)) for _ in range(size)])
+    return carts
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0
+    # nearest-rank
+    k = min(len(sorted_values) - 1, max(0, math.ceil(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+def time_calls(fn, args_list, min_time, max_samples):
+    # 至少跑 min_time 秒或 max_samples 次（先到者為準，最少 3 次）
+    samples = []
+    started = time.perf_counter()
+    i = 0
+    while len(samples) < max_samples and (len(samples) < 3 or time.perf_counter() - started < min_time):
+        args = args_list[i % len(args_list)]
+        t0 = time.perf_counter_ns()
+        fn(*args)
+        samples.append(time.perf_counter_ns() - t0)
+        i += 1
+    samples.sort()
+    total = sum(samples)
+    return {
+        "samples": len(samples),
+        "throughput_per_sec": round(len(samples) / (total / 1e9), 3) if total else None,
+        "mean_ms": round(total / len(samples) / 1e6, 4),
+        "p50_ms": round(percentile(samples, 50) / 1e6, 4),
+        "p99_ms": round(percentile(samples, 99) / 1e6, 4),
+    }
+
+def run_config(products, cart_size, rule_count, mix_name, rng, min_time, max_samples, prof=None):
+    rules = generate_rules(products, rule_count, RULE_MIXES[mix_name], rng)
+    compiled = CompiledRuleSet(rules)
+    hot_ids = set(pid for r in rules for pid in r.get("items", ()))
+    hot_ids.update(r["product_id"] for r in rules if "product_id" in r)
+    carts = generate_carts(products, cart_size, 16, rng, hot_ids)
+    single = [(cart, rng.choice(rules)) for cart in carts]
+
+    targets = {
+        "apply_discount": (apply_discount, single),
+        "solve_cart": (solve_cart, [(c, rules) for c in carts]),
+        "solve_cart[compiled]": (solve_cart, [(c, compiled) for c in carts]),
+        "solve_cart_split": (solve_cart_split, [(c, rules) for c in carts]),
+        "solve_cart_split[compiled]": (solve_cart_split, [(c, compiled) for c in carts]),
+    }
+    results = []
+    for target, (fn, args_list) in targets.items():
+        stats = time_calls(fn, args_list, min_time, max_samples)
+        results.append({"cart_size": cart_size, "rule_count": rule_count, "mix": mix_name, "target": target, **stats})
+        if prof is not None:
+            # 計時與剖析分開跑，剖析的額外成本不會算進延遲
+            with profiling.profile(prof):
+                for args in args_list:
+                    fn(*args)
+    return results
+
+def result_key(r):
+    return (r["cart_size"], r["rule_count"], r["mix"], r["target"])
+
+def compare(current, baseline_path):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {result_key(r): r for r in json.load(f)["results"]}
+    rows = []
+    for r in current["results"]:
+        old = baseline.get(result_key(r))
+        if old and old["p50_ms"]:
+            rows.append({**dict(zip(("cart_size", "rule_count", "mix", "target"), result_key(r))),
+                         "p50_ratio": round(r["p50_ms"] / old["p50_ms"], 3),
+                         "p99_ratio": round(r["p99_ms"] / old["p99_ms"], 3) if old["p99_ms"] else None})
+    return rows
+
+def parse_ints(text):
+    return [int(x) for x in text.split(",") if x]
+
+def main():
+    parser = argparse.ArgumentParser(description="CartWizard 拆帳效能基準測試")
+    parser.add_argument("--cart-sizes", type=parse_ints, default=CART_SIZES)
+    parser.add_argument("--rule-counts", type=parse_ints, default=RULE_COUNTS)
+    parser.add_argument("--mixes", default=",".join(RULE_MIXES), help="以逗號分隔：" + ", ".join(RULE_MIXES))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--min-time", type=float, default=0.2, help="每個目標至少量測的秒數")
+    parser.add_argument("--max-samples", type=int, default=500)
+    parser.add_argument("--quick", action="store_true", help="縮小掃描範圍，適合快速檢查")
+    parser.add_argument("--out", help="輸出 JSON 路徑（預設印到 stdout）")
+    parser.add_argument("--compare", help="與先前的結果 JSON 比較 p50 / p99 倍率")
+    parser.add_argument("--profile", help="輸出規則層級剖析（.prom 為 Prometheus 文字格式，其餘為 JSON）")
+    args = parser.parse_args()
+
+    if args.quick:
+        args.cart_sizes, args.rule_counts, args.min_time = [5, 100], [10, 1000], 0.05
+
+    # product_gen 使用全域 random，先設定種子確保可重現
+    random.seed(args.seed)
+    rng = random.Random(args.seed)
+    products = generate_products(PRODUCT_COUNT)
+
+    prof = profiling.SolverProfile() if args.profile else None
+    results = []
+    for mix_name in args.mixes.split(","):
+        for rule_count in args.rule_counts:
+            for cart_size in args.cart_sizes:
+                results.extend(run_config(products, cart_size, rule_count, mix_name, rng,
+                                          args.min_time, args.max_samples, prof))
+                print(f"⏱️ {mix_name} rules={rule_count} cart={cart_size} 完成", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "product_count": PRODUCT_COUNT,
+        },
+        "results": results,
+    }
+    if args.compare:
+        report["compare"] = compare(report, args.compare)
+
+    if prof is not None:
+        with open(args.profile, "w", encoding="utf-8") as f:
+            f.write(prof.to_prometheus() if args.profile.endswith(".prom") else prof.to_json(indent=2))
+        print(f"✅ 剖析結果已儲存至 {args.profile}", file=sys.stderr)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+        print(f"✅ 基準測試結果已儲存至 {args.out}", file=sys.stderr)
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
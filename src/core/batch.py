@@ -0,0 +1,103 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from .cart import Cart
+from .ruleset import CompiledRuleSet
+from .solver import orders_to_json, solve_cart_split
+
+# 批次拆帳：規則只編譯一次（exclusive / 一般 / group 分流都在 CompiledRuleSet 內完成），
+# workers > 1 時每個 process 也只編譯一次，購物車分塊送出，結果依輸入順序逐一回傳
+#
+#   for orders in solve_many(carts, rules, workers=8):
+#       ...
+
+CHUNK_SIZE = 256
+
+
+def _chunked(iterable, size):
+    it = iter(iterable)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# ===== worker：每個 process 只編譯一次規則 =====
+
+_ruleset = None
+
+
+def _init_worker(rules):
+    global _ruleset
+    _ruleset = CompiledRuleSet(rules)
+
+
+def _solve_chunk(packed, mode, budget):
+    # Cart 的商品代碼是各 process 自己的字串表，跨 process 一律以一件一個 dict 的格式傳遞；
+    # 主發票的 discounts（非 exclusive 的全部規則）不回傳，回到主程序再接上
+    results = []
+    for as_cart, items in packed:
+        orders = solve_cart_split(Cart.from_items(items) if as_cart else items, _ruleset, mode, **budget)
+        if as_cart:
+            orders = orders_to_json(orders)
+        results.append([{**o, "discounts": None if o["main"] else o["discounts"]} for o in orders])
+    return results
+
+
+class BatchSolver:
+    def __init__(self, discount_rules, workers=1, mode="greedy", chunksize=CHUNK_SIZE, **budget):
+        self.ruleset = discount_rules if isinstance(discount_rules, CompiledRuleSet) else CompiledRuleSet(discount_rules)
+        self.workers = workers
+        self.mode = mode
+        self.chunksize = chunksize
+        self.budget = budget
+        self.pool = None
+        if workers > 1:
+            self.pool = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(self.ruleset.rules,))
+
+    def map(self, carts):
+        # carts：一件一個 dict 的 list 或 Cart；依輸入順序產出 solve_cart_split 的結果
+        if self.pool is None:
+            for cart in carts:
+                yield solve_cart_split(cart, self.ruleset, self.mode, **self.budget)
+            return
+
+        # 同時送出的區塊最多 workers * 2 個，避免結果堆在記憶體
+        pending = deque()
+        for chunk in _chunked(carts, self.chunksize):
+            flags = [isinstance(cart, Cart) for cart in chunk]
+            packed = [(flag, cart.to_items() if flag else cart) for flag, cart in zip(flags, chunk)]
+            pending.append((flags, self.pool.submit(_solve_chunk, packed, self.mode, self.budget)))
+            if len(pending) >= self.workers * 2:
+                yield from self._unpack(*pending.popleft())
+        while pending:
+            yield from self._unpack(*pending.popleft())
+
+    def _unpack(self, flags, future):
+        normal = self.ruleset.normal.rules
+        for as_cart, orders in zip(flags, future.result()):
+            for o in orders:
+                if o["main"]:
+                    o["discounts"] = normal
+                if as_cart:
+                    o["items"] = Cart.from_items(o["items"])
+            yield orders
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def solve_many(carts, discount_rules, workers=1, mode="greedy", chunksize=CHUNK_SIZE, **budget):
+    # 產生器：依輸入順序回傳每台購物車的拆帳結果
+    with BatchSolver(discount_rules, workers, mode, chunksize, **budget) as batch:
+        yield from batch.map(carts)
@@ -0,0 +1,136 @@
+import json
+import math
+import numbers
+import sys
+from array import array
+from collections import defaultdict
+
+# 數量感知的購物車：以平行陣列存放（商品 ID、單價、分類、數量），同商品多件不再複製 dict
+# 商品 ID 與分類用 sys.intern 共用同一個字串物件：不需要全域對照表，也就不會無限成長或需要加鎖；
+# 沒有購物車再引用時由 Python 回收
+
+
+def _price(value):
+    # 單價可為整數或小數（data_editor 編輯後可能是 float / numpy 型別），統一轉成 Python 數字
+    if isinstance(value, bool) or not isinstance(value, numbers.Real):
+        raise TypeError(f"商品價格必須是數字：{value!r}")
+    value = int(value) if isinstance(value, numbers.Integral) else float(value)
+    if not math.isfinite(value) or value < 0:
+        raise ValueError(f"商品價格必須是非負的有限數字：{value!r}")
+    return value
+
+
+def _extra_key(extra):
+    # 其他欄位可能含 list / dict 等不可雜湊的值，序列化後再比較
+    return json.dumps(extra, ensure_ascii=False, sort_keys=True, default=str)
+
+
+class Cart:
+    __slots__ = ("products", "prices", "categories", "quantities", "extras")
+
+    def __init__(self, products=None, prices=None, categories=None, quantities=None, extras=None):
+        self.products = products if products is not None else []
+        self.prices = prices if prices is not None else []
+        self.categories = categories if categories is not None else []
+        self.quantities = quantities if quantities is not None else array("i")
+        # 其他欄位（name、brand…）每個品項保留一份，轉回 JSON 時原樣帶回
+        self.extras = extras if extras is not None else []
+
+    @classmethod
+    def from_items(cls, cart_items):
+        # 相同 (id, price, category, 其他欄位) 的 dict 合併成一個品項，數量累加
+        cart = cls()
+        lines = {}
+        for item in cart_items:
+            extra = {k: v for k, v in item.items() if k not in ("id", "price", "category", "quantity")}
+            key = (item["id"], _price(item["price"]), item.get("category"), _extra_key(extra))
+            qty = item.get("quantity", 1)
+            line = lines.get(key)
+            if line is None:
+                lines[key] = len(cart.products)
+                cart.add(item["id"], item["price"], item.get("category"), qty, extra or None)
+            else:
+                cart.quantities[line] += qty
+        return cart
+
+    def add(self, pid, price, category, quantity=1, extra=None):
+        self.products.append(sys.intern(pid))
+        self.prices.append(_price(price))
+        self.categories.append(sys.intern(category) if category is not None else None)
+        self.quantities.append(quantity)
+        self.extras.append(extra)
+
+    def copy(self):
+        return Cart(list(self.products), list(self.prices), list(self.categories), array("i", self.quantities),
+                    [dict(extra) if extra else extra for extra in self.extras])
+
+    def to_items(self):
+        # 轉回現行格式：每件一個 dict
+        items = []
+        for line in range(len(self.products)):
+            item = self.item(line)
+            items.extend(dict(item) for _ in range(self.quantities[line]))
+        return items
+
+    def item(self, line):
+        item = {"id": self.products[line], "price": self.prices[line]}
+        if self.categories[line] is not None:
+            item["category"] = self.categories[line]
+        if self.extras[line]:
+            item.update(self.extras[line])
+        return item
+
+    def lines(self):
+        # (商品 ID, 單價, 分類, 數量)
+        for line in range(len(self.products)):
+            yield self.products[line], self.prices[line], self.categories[line], self.quantities[line]
+
+    def line_count(self):
+        return len(self.products)
+
+    def __len__(self):
+        return sum(self.quantities)
+
+    def __bool__(self):
+        return any(self.quantities)
+
+    @property
+    def total(self):
+        return sum(p * q for p, q in zip(self.prices, self.quantities))
+
+    def aggregate(self):
+        # 一次掃描品項：總金額、分類小計、商品 ID 件數與小計、品牌小計
+        total = 0
+        category_totals = defaultdict(int)
+        id_counts = defaultdict(int)
+        id_totals = defaultdict(int)
+        brand_totals = defaultdict(int)
+        for pid, price, category, qty, extra in zip(self.products, self.prices, self.categories, self.quantities,
+                                                self.extras):
+            if qty <= 0:
+                continue
+            amount = price * qty
+            total += amount
+            category_totals[category] += amount
+            id_counts[pid] += qty
+            id_totals[pid] += amount
+            brand = extra.get("brand") if extra else None
+            if brand is not None:
+                brand_totals[brand] += amount
+        return total, category_totals, id_counts, id_totals, brand_totals
+
+    def take(self, picks):
+        # picks：{品項索引: 數量}；回傳取出的子購物車與剩下的購物車
+        taken = Cart()
+        rest = Cart()
+        for line in range(len(self.products)):
+            qty = self.quantities[line]
+            n = min(picks.get(line, 0), qty)
+            for cart, q in ((taken, n), (rest, qty - n)):
+                if q > 0:
+                    cart.products.append(self.products[line])
+                    cart.prices.append(self.prices[line])
+                    cart.categories.append(self.categories[line])
+                    cart.quantities.append(q)
+                    cart.extras.append(self.extras[line])
+        return taken, rest
@@ -1,10 +1,26 @@
 # 完整版 apply_discount 支援新版折扣格式
+from . import profiling
+from .cart import Cart
+from .ruleset import PERCENT_ROUNDING, CartStats, CompiledRule, percent_discount, percent_off
 
 def apply_discount(cart_items, discount):
+    prof = profiling.active
+    if prof is None:
+        return _apply_discount(cart_items, discount)
+    started = profiling.now()
+    amount = _apply_discount(cart_items, discount)
+    prof.record_rule(discount, amount, profiling.now() - started)
+    return amount
+
+def _apply_discount(cart_items, discount):
+    if isinstance(cart_items, Cart):
+        # 數量感知購物車：依品項彙總後判斷，不展開成一件一個 dict
+        return CompiledRule(0, discount).amount_for(CartStats.from_items(cart_items))
+
     if discount["type"] == "滿額折扣":
         if "category" not in discount:
             return 0
-        total = sum(item["price"] for item in cart_items if item["category"] == discount["category"])
+        total = sum(item["price"] for item in cart_items if item.get("category") == discount["category"])
         return discount["amount"] if total >= discount["threshold"] else 0
 
     elif discount["type"] == "滿件折扣":
@@ -27,4 +43,31 @@ def apply_discount(cart_items, discount):
                 return discount["amount"]
         return 0
 
+    # 百分比折扣：依基準金額（分類 / 單品 / 品牌 / 整車小計）打折
+    elif discount["type"] == "分類折扣":
+        if "category" not in discount or "percent" not in discount:
+            return 0
+        base = sum(item["price"] for item in cart_items if item.get("category") == discount["category"])
+        return _percent_amount(base, discount)
+
+    elif discount["type"] == "單品折扣":
+        if "product_id" not in discount or "percent" not in discount:
+            return 0
+        base = sum(item["price"] for item in cart_items if item["id"] == discount["product_id"])
+        return _percent_amount(base, discount)
+
+    elif discount["type"] == "品牌折扣":
+        if "brand" not in discount or "percent" not in discount:
+            return 0
+        base = sum(item["price"] for item in cart_items if item.get("brand") == discount["brand"])
+        return _percent_amount(base, discount)
+
+    elif discount["type"] == "限時折扣":
+        if "percent" not in discount:
+            return 0
+        return _percent_amount(sum(item["price"] for item in cart_items), discount)
+
     return 0
+
+def _percent_amount(base, discount):
+    return percent_discount(base, percent_off(discount["percent"]), discount.get("rounding", PERCENT_ROUNDING))
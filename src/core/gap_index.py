@@ -0,0 +1,104 @@
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+
+from .ruleset import CompiledRuleSet
+
+# 「差一件就成立」的規則索引：從規則集預先整理，查出購物車離哪些規則只差一件商品、
+# 差多少（滿額差金額、滿件差件數、組合差哪個商品），以及哪些商品能補上缺口
+
+
+class GapIndex:
+    def __init__(self, discount_rules, products):
+        self.ruleset = discount_rules if isinstance(discount_rules, CompiledRuleSet) else CompiledRuleSet(discount_rules)
+        self.products = list(products)
+        catalog_ids = set(p["id"] for p in self.products)
+
+        # 分類 → 依價格排序的商品，滿額缺口用二分搜尋找出夠貴的商品
+        by_category = defaultdict(list)
+        for p in self.products:
+            by_category[p["category"]].append((p["price"], p["id"]))
+        self._prices = {}
+        self._ids = {}
+        for category, rows in by_category.items():
+            rows.sort()
+            self._prices[category] = [price for price, _ in rows]
+            self._ids[category] = [pid for _, pid in rows]
+
+        # 分類 → 依門檻排序的滿額規則（沿用 ruleset.by_category），只看「門檻 - 小計 <= 該分類最貴商品」的區段
+        self._thresholds = {
+            category: ([t for t, _ in rows], [idx for _, idx in rows])
+            for category, rows in self.ruleset.by_category.items()
+        }
+
+        # 規則 → 目錄中能補缺口的商品；空購物車也只差一件的規則（滿件 1 件、單品組合、獨立）另外記
+        self._rule_ids = {}
+        self._single = []
+        for rule in self.ruleset.compiled:
+            if rule.is_dead() or rule.amount <= 0 or rule.index in self.ruleset.always:
+                continue
+            if rule.type == "滿額折扣":
+                continue
+            self._rule_ids[rule.index] = sorted(pid for pid in rule.items if pid in catalog_ids)
+            if (rule.type == "滿件折扣" and rule.count == 1) or (rule.type == "組合折扣" and len(rule.items) == 1) \
+                    or rule.type == "獨立折扣":
+                self._single.append(rule.index)
+
+    def _near_rules(self, stats):
+        # 可能只差一件的規則索引：滿額看門檻區段，商品類規則從購物車內的商品 ID 反查
+        indexes = set(self._single)
+        for category, (thresholds, rule_indexes) in self._thresholds.items():
+            prices = self._prices.get(category)
+            if not prices:
+                continue
+            total = stats.category_totals.get(category, 0)
+            lo = bisect_right(thresholds, total)
+            hi = bisect_right(thresholds, total + prices[-1])
+            indexes.update(rule_indexes[lo:hi])
+        for pid in stats.id_counts:
+            indexes.update(self.ruleset.by_item.get(pid, ()))
+        return sorted(indexes)
+
+    def gaps(self, cart_items, stats=None):
+        # 回傳加一件商品就能成立的規則與缺口：
+        #   滿額：missing_amount；滿件：missing_count（恆為 1）；組合 / 獨立：missing_ids
+        if stats is None:
+            stats = self.ruleset.cart_stats(cart_items)
+        gaps = []
+        for idx in self._near_rules(stats):
+            rule = self.ruleset.compiled[idx]
+            if rule.triggered(stats):
+                continue
+            gap = {"rule": rule.raw["id"], "index": idx, "type": rule.type}
+            if rule.type == "滿額折扣":
+                gap["category"] = rule.category
+                gap["missing_amount"] = rule.threshold - stats.category_totals.get(rule.category, 0)
+            elif rule.type == "滿件折扣":
+                gap["missing_count"] = rule.count - sum(stats.id_counts.get(pid, 0) for pid in rule.items)
+                if gap["missing_count"] != 1:
+                    continue
+            elif rule.type == "組合折扣":
+                gap["missing_ids"] = sorted(rule.items - stats.id_counts.keys())
+                if len(gap["missing_ids"]) != 1:
+                    continue
+            else:
+                gap["missing_ids"] = self._rule_ids[idx]
+            if self.closers(gap):
+                gaps.append(gap)
+        return gaps
+
+    def closers(self, gap):
+        # 加一件就能讓該規則成立的商品 ID
+        if gap["type"] == "滿額折扣":
+            prices = self._prices.get(gap["category"], [])
+            return self._ids.get(gap["category"], [])[bisect_left(prices, gap["missing_amount"]):]
+        if gap["type"] == "滿件折扣":
+            return self._rule_ids[gap["index"]]
+        return [pid for pid in gap["missing_ids"] if pid in self._rule_ids[gap["index"]]]
+
+    def candidates(self, cart_items, stats=None):
+        # 能補上至少一個缺口的商品 ID → 補上的規則 ID 清單
+        result = defaultdict(list)
+        for gap in self.gaps(cart_items, stats):
+            for pid in self.closers(gap):
+                result[pid].append(gap["rule"])
+        return dict(result)
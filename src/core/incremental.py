@@ -0,0 +1,96 @@
+from .ruleset import CompiledRuleSet
+from .solver import solve_cart_split
+
+# 「加一件會怎樣」的增量計算：基礎購物車只解一次，候選商品只重算受影響的規則
+
+
+def _discount_ids(orders):
+    return set(d["id"] for o in orders for d in o["result"]["used_discounts"])
+
+
+class SplitState:
+    def __init__(self, cart_items, discount_rules):
+        self.ruleset = discount_rules if isinstance(discount_rules, CompiledRuleSet) else CompiledRuleSet(discount_rules)
+        self.items = list(cart_items)
+        self.orders = solve_cart_split(self.items, self.ruleset)
+        self.price = sum(o["result"]["final_price"] for o in self.orders)
+        self.discount_ids = _discount_ids(self.orders)
+
+        normal = self.ruleset.normal
+        exclusive_orders = [o for o in self.orders if not o["main"]]
+        main_order = next((o for o in self.orders if o["main"]), None)
+
+        # exclusive 發票用掉的商品 ID；加入同 ID 商品時貪婪拆帳會整個改變
+        self.used_item_ids = set(i["id"] for o in exclusive_orders for i in o["items"])
+        self.exclusive_ids = _discount_ids(exclusive_orders)
+
+        # 主發票狀態：分類小計、ID 計數、已成立的規則與金額
+        self.main_stats = normal.cart_stats(main_order["items"] if main_order else [])
+        self.main_amounts = normal.evaluate(self.main_stats)
+        self.main_price = main_order["result"]["final_price"] if main_order else 0
+
+        # 會被 exclusive 折扣比對到的商品特徵，命中時退回完整重算
+        self._exclusive_ids = set()
+        self._exclusive_categories = set()
+        self._exclusive_brands = set()
+        self._exclusive_any = False
+        for idx in self.ruleset.exclusive_indexes:
+            rule = self.ruleset.compiled[idx]
+            d = rule.raw
+            if rule.type == "組合折扣":
+                self._exclusive_ids.update(rule.items)
+            elif rule.type == "單品折扣":
+                self._exclusive_ids.add(d["product_id"])
+            elif rule.type == "分類折扣":
+                self._exclusive_categories.add(d["category"])
+            elif rule.type == "品牌折扣":
+                self._exclusive_brands.add(d["brand"])
+            elif rule.type == "限時折扣":
+                self._exclusive_any = True
+
+    @property
+    def active(self):
+        # 主發票目前成立的規則 ID
+        rules = self.ruleset.normal.rules
+        return set(rules[idx]["id"] for idx in self.main_amounts)
+
+    def _needs_full_solve(self, item):
+        return (self._exclusive_any
+                or item["id"] in self.used_item_ids
+                or item["id"] in self._exclusive_ids
+                or item.get("category") in self._exclusive_categories
+                or item.get("brand") in self._exclusive_brands)
+
+    def delta(self, item):
+        # 回傳 (加購後價差, 新觸發的折扣 ID)；價差 < 0 代表更省
+        if self._needs_full_solve(item):
+            after = solve_cart_split(self.items + [item], self.ruleset)
+            after_price = sum(o["result"]["final_price"] for o in after)
+            return after_price - self.price, _discount_ids(after) - self.discount_ids
+
+        normal = self.ruleset.normal
+        stats = self.main_stats
+        amounts = dict(self.main_amounts)
+        stats.add(item)
+        try:
+            for idx in normal.affected_by(item):
+                amt = normal.compiled[idx].amount_for(stats)
+                if amt > 0:
+                    amounts[idx] = amt
+                else:
+                    amounts.pop(idx, None)
+            total = stats.total
+        finally:
+            stats.remove(item)
+
+        picks, single = normal.select(amounts)
+        total_discount = sum(amt for _, amt in picks)
+        main_price = total - total_discount if single else max(total - total_discount, 0)
+
+        after_ids = self.exclusive_ids | set(normal.rules[idx]["id"] for idx, _ in picks)
+        return main_price - self.main_price, after_ids - self.discount_ids
+
+    def saved_by(self, item):
+        # 與 calc_extra_features 相同的輸出：(省下金額, 新觸發折扣數)
+        price_delta, triggered = self.delta(item)
+        return -price_delta, len(triggered)
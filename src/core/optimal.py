@@ -0,0 +1,164 @@
+import time
+
+from .ruleset import CompiledRuleSet
+from .solver import _solve_compiled, solve_cart_split
+
+# 最佳拆帳：以 branch-and-bound 搜尋「商品 → 發票」的分配
+# 發票模型與貪婪版相同：每個 exclusive 折扣最多一張獨立發票，其餘商品併入一張主發票
+
+MAX_NODES = 20000
+TIME_LIMIT = 0.05  # 秒
+
+
+def _orders_price(orders):
+    return sum(o["result"]["final_price"] for o in orders)
+
+
+def _main_upper_bound(normal, stats):
+    # 主發票折扣上界：觸發條件對商品單調，子集合的折扣不會超過全集合的
+    amounts = normal.evaluate(stats)
+    best_single = 0
+    group_best = {}
+    stacked = 0
+    for idx, amt in amounts.items():
+        if not normal.is_stackable[idx]:
+            best_single = max(best_single, amt)
+        elif normal.group_of[idx]:
+            group = normal.group_of[idx]
+            group_best[group] = max(group_best.get(group, 0), amt)
+        else:
+            stacked += amt
+    return max(best_single, stacked + sum(group_best.values()))
+
+
+def _relevant(rule, item):
+    if rule.type in ("滿額折扣", "分類折扣"):
+        return item.get("category") == rule.category
+    if rule.type == "單品折扣":
+        return item["id"] == rule.product_id
+    if rule.type == "品牌折扣":
+        return item.get("brand") == rule.brand
+    if rule.type == "限時折扣":
+        return True
+    return item["id"] in rule.items
+
+
+def solve_split_optimal(cart_items, discount_rules, max_nodes=MAX_NODES, time_limit=TIME_LIMIT):
+    ruleset = discount_rules if isinstance(discount_rules, CompiledRuleSet) else CompiledRuleSet(discount_rules)
+    normal = ruleset.normal
+
+    greedy = solve_cart_split(cart_items, ruleset)
+    info = {"nodes": 0, "proven": True, "greedy_price": _orders_price(greedy), "price": _orders_price(greedy)}
+
+    # 只保留整車能觸發的 exclusive 折扣；加商品不會讓觸發條件失效，所以子集合也只可能更少
+    full_stats = ruleset.cart_stats(cart_items)
+    candidates = [ruleset.compiled[idx] for idx in ruleset.exclusive_indexes
+                  if ruleset.compiled[idx].amount_for(full_stats) > 0]
+    if not candidates:
+        return greedy, info
+
+    # 每件商品可去的 exclusive 發票；沒有選項的商品固定進主發票
+    options = [[k for k, rule in enumerate(candidates) if _relevant(rule, item)] for item in cart_items]
+    branch = [i for i, opts in enumerate(options) if opts]
+    branch.sort(key=lambda i: -cart_items[i]["price"])
+    fixed_main = [i for i, opts in enumerate(options) if not opts]
+
+    cart_total = full_stats.total
+    best = {"price": info["greedy_price"], "assign": None}
+    assign = [[] for _ in candidates]
+    main = list(fixed_main)
+    deadline = time.perf_counter() + time_limit if time_limit else None
+
+    def bound(depth):
+        # 樂觀估計：未決定的商品同時算進每張可能的發票
+        undecided = branch[depth:]
+        discount = 0
+        for k, rule in enumerate(candidates):
+            pool = assign[k] + [i for i in undecided if k in options[i]]
+            if not pool:
+                continue
+            amt = rule.amount_for(ruleset.cart_stats(cart_items[i] for i in pool))
+            if amt <= 0:
+                if assign[k]:
+                    return None
+                continue
+            discount += amt
+        main_stats = normal.cart_stats(cart_items[i] for i in main + undecided)
+        return cart_total - discount - _main_upper_bound(normal, main_stats)
+
+    def leaf():
+        price = 0
+        for k, rule in enumerate(candidates):
+            if not assign[k]:
+                continue
+            stats = ruleset.cart_stats(cart_items[i] for i in assign[k])
+            amt = rule.amount_for(stats)
+            if amt <= 0:
+                return
+            price += stats.total - amt
+        if main:
+            price += _solve_compiled([cart_items[i] for i in main], normal)["final_price"]
+        if price < best["price"]:
+            best["price"] = price
+            best["assign"] = [list(a) for a in assign]
+
+    def search(depth):
+        info["nodes"] += 1
+        if info["nodes"] > max_nodes or (deadline and info["nodes"] % 64 == 0 and time.perf_counter() > deadline):
+            info["proven"] = False
+        if not info["proven"]:
+            return
+
+        lower = bound(depth)
+        if lower is None or lower >= best["price"]:
+            return
+        if depth == len(branch):
+            leaf()
+            return
+
+        i = branch[depth]
+        for k in options[i]:
+            assign[k].append(i)
+            search(depth + 1)
+            assign[k].pop()
+        main.append(i)
+        search(depth + 1)
+        main.pop()
+
+    search(0)
+
+    # 預算用完或找不到更便宜的分配時，沿用貪婪解
+    if best["assign"] is None:
+        return greedy, info
+
+    orders = []
+    used = set()
+    for k, rule in enumerate(candidates):
+        if not best["assign"][k]:
+            continue
+        items = [cart_items[i] for i in sorted(best["assign"][k])]
+        used.update(best["assign"][k])
+        stats = ruleset.cart_stats(items)
+        amt = rule.amount_for(stats)
+        orders.append({
+            "items": items,
+            "discounts": [rule.raw],
+            "main": False,
+            "result": {
+                "original_total": stats.total,
+                "total_discount": amt,
+                "final_price": stats.total - amt,
+                "used_discounts": [{**rule.raw, "amount": amt}]
+            }
+        })
+    remaining_items = [item for i, item in enumerate(cart_items) if i not in used]
+    if remaining_items:
+        orders.append({
+            "items": remaining_items,
+            "discounts": normal.rules,
+            "main": True,
+            "result": _solve_compiled(remaining_items, normal)
+        })
+
+    info["price"] = best["price"]
+    return orders, info
@@ -0,0 +1,133 @@
+import json
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+# 拆帳效能剖析：記錄每條規則 / 每種規則類型的評估次數、累計時間、命中率（金額 > 0），
+# 以及 solve_cart / solve_cart_split 的呼叫次數、時間、結果分流與每台購物車的發票數
+#
+#   with profile() as prof:
+#       solve_cart_split(items, rules)
+#   print(prof.to_prometheus())
+#
+# 未開啟時各函式只多一次 `profiling.active is None` 判斷；開啟範圍為整個 process
+
+active = None
+
+now = time.perf_counter_ns
+
+
+class SolverProfile:
+    def __init__(self):
+        # 規則 ID → [評估次數, 命中次數, 累計奈秒]；類型另外記錄
+        self.rules = defaultdict(lambda: [0, 0, 0])
+        self.rule_types = {}
+        self.calls = Counter()
+        self.nanos = Counter()
+        self.outcomes = Counter()
+        self.invoices = Counter()
+
+    def record_rule(self, rule, amount, ns):
+        stat = self.rules[rule.get("id")]
+        stat[0] += 1
+        if amount > 0:
+            stat[1] += 1
+        stat[2] += ns
+        self.rule_types[rule.get("id")] = rule.get("type")
+
+    def record_call(self, name, ns):
+        self.calls[name] += 1
+        self.nanos[name] += ns
+
+    def record_outcome(self, outcome):
+        # exclusive / non_stackable：單一折扣提前結束；stacked：一般疊加
+        self.outcomes[outcome] += 1
+
+    def record_invoices(self, count):
+        self.invoices[count] += 1
+
+    def by_type(self):
+        result = defaultdict(lambda: [0, 0, 0])
+        for rule_id, (count, hits, ns) in self.rules.items():
+            stat = result[self.rule_types.get(rule_id)]
+            stat[0] += count
+            stat[1] += hits
+            stat[2] += ns
+        return result
+
+    def to_dict(self):
+        def rows(stats):
+            return {
+                key: {
+                    "evaluations": count,
+                    "hits": hits,
+                    "hit_rate": round(hits / count, 4) if count else 0,
+                    "total_ms": round(ns / 1e6, 4),
+                    "avg_us": round(ns / count / 1e3, 3) if count else 0,
+                }
+                for key, (count, hits, ns) in sorted(stats.items(), key=lambda kv: -kv[1][2])
+            }
+
+        carts = sum(self.invoices.values())
+        return {
+            "calls": {
+                name: {"count": n, "total_ms": round(self.nanos[name] / 1e6, 4)}
+                for name, n in self.calls.items()
+            },
+            "outcomes": dict(self.outcomes),
+            "invoices_per_cart": {str(k): v for k, v in sorted(self.invoices.items())},
+            "avg_invoices_per_cart": round(sum(k * v for k, v in self.invoices.items()) / carts, 4) if carts else 0,
+            "rule_types": rows(self.by_type()),
+            "rules": {rule_id: {"type": self.rule_types.get(rule_id), **row}
+                      for rule_id, row in rows(self.rules).items()},
+        }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), ensure_ascii=False, **kwargs)
+
+    def to_prometheus(self, prefix="cartwizard"):
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+                lines.append(f"{prefix}_{name}{{{label_text}}} {value}" if label_text else f"{prefix}_{name} {value}")
+
+        rule_labels = [({"rule_id": rule_id, "rule_type": self.rule_types.get(rule_id)}, stat)
+                       for rule_id, stat in self.rules.items()]
+        type_labels = [({"rule_type": rule_type}, stat) for rule_type, stat in self.by_type().items()]
+
+        metric("rule_evaluations_total", "counter", "Rule evaluations", [(l, s[0]) for l, s in rule_labels])
+        metric("rule_hits_total", "counter", "Rule evaluations with amount > 0", [(l, s[1]) for l, s in rule_labels])
+        metric("rule_seconds_total", "counter", "Time spent evaluating each rule",
+               [(l, s[2] / 1e9) for l, s in rule_labels])
+        metric("rule_type_evaluations_total", "counter", "Rule evaluations by type", [(l, s[0]) for l, s in type_labels])
+        metric("rule_type_hits_total", "counter", "Rule hits by type", [(l, s[1]) for l, s in type_labels])
+        metric("rule_type_seconds_total", "counter", "Rule evaluation time by type",
+               [(l, s[2] / 1e9) for l, s in type_labels])
+        metric("solve_calls_total", "counter", "Solver calls", [({"function": k}, v) for k, v in self.calls.items()])
+        metric("solve_seconds_total", "counter", "Solver time",
+               [({"function": k}, v / 1e9) for k, v in self.nanos.items()])
+        metric("solve_outcomes_total", "counter", "solve_cart outcome (exclusive / non_stackable short-circuit or stacked)",
+               [({"outcome": k}, v) for k, v in self.outcomes.items()])
+        metric("split_carts_total", "counter", "Carts split, by number of invoices produced",
+               [({"invoices": str(k)}, v) for k, v in sorted(self.invoices.items())])
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+@contextmanager
+def profile(prof=None):
+    # 開啟剖析；可傳入既有的 SolverProfile 累加多段結果
+    global active
+    previous = active
+    active = prof if prof is not None else SolverProfile()
+    try:
+        yield active
+    finally:
+        active = previous
@@ -0,0 +1,239 @@
+import argparse
+import json
+import logging
+import os
+
+from .ruleset import ROUNDING_MODES, CompiledRule, CompiledRuleSet
+
+# 折扣規則載入器：檢查每條規則的欄位、統一欄位名稱、找出永遠折 0 的規則
+# 載入只在記憶體中檢查，不寫檔；由 CLI 寫出編譯後的規則檔（discounts.compiled.json），
+# 之後原始檔未變更時直接讀取，不再重新檢查。停用的規則在每個 process 第一次載入時以 logging 列出
+#
+#   python -m src.core.rule_loader data/raw/discounts.json          # 重新編譯、寫出編譯檔並列出問題
+#   python -m src.core.rule_loader data/raw/discounts.json --strict # 有錯誤時失敗
+
+DISCOUNT_PATH = "data/raw/discounts.json"
+# 編譯格式版本：規則判斷邏輯改變時遞增，舊的編譯檔會自動重建
+RULE_FORMAT = 2
+
+NUMBER = (int, float)
+
+log = logging.getLogger(__name__)
+# 已列出過停用規則的 (原始檔, 規則版本)
+_reported = set()
+
+# 舊欄位名稱 → 新欄位名稱
+FIELD_ALIASES = {"discount": "amount"}
+
+# 各類型必要欄位與型別
+SCHEMA = {
+    "滿額折扣": {"threshold": NUMBER, "category": str, "amount": NUMBER},
+    "滿件折扣": {"count": int, "items": list, "amount": NUMBER},
+    "組合折扣": {"items": list, "amount": NUMBER},
+    "獨立折扣": {"items": list, "amount": NUMBER},
+    "分類折扣": {"category": str, "percent": NUMBER},
+    "單品折扣": {"product_id": str, "percent": NUMBER},
+    "品牌折扣": {"brand": str, "percent": NUMBER},
+    "限時折扣": {"percent": NUMBER},
+}
+OPTIONAL = {"exclusive": bool, "stackable": bool, "group": str, "rounding": str}
+
+
+class RuleValidationError(ValueError):
+    def __init__(self, issues):
+        super().__init__("\n".join(f"[{i['id']}] {i['message']}" for i in issues))
+        self.issues = issues
+
+
+def compiled_path(path):
+    root, _ = os.path.splitext(path)
+    return root + ".compiled.json"
+
+
+def _is_type(value, expected):
+    # bool 是 int 的子類別，數值欄位不接受 True / False
+    if isinstance(value, bool) and expected is not bool:
+        return False
+    return isinstance(value, expected)
+
+
+def normalize_rule(raw):
+    # 回傳 (正規化後的規則或 None, 問題清單)；level：error 格式錯誤、dead 永遠折 0、warning 已自動修正
+    issues = []
+    rule_id = raw.get("id") if isinstance(raw, dict) else None
+
+    def issue(level, message):
+        issues.append({"id": rule_id, "level": level, "message": message})
+
+    if not isinstance(raw, dict):
+        issue("error", "規則不是 JSON 物件")
+        return None, issues
+    if not isinstance(rule_id, str) or not rule_id:
+        issue("error", "缺少 id")
+        return None, issues
+
+    rule = dict(raw)
+    for old, new in FIELD_ALIASES.items():
+        if old in rule:
+            if new in rule:
+                issue("warning", f"同時有 {old} 與 {new}，以 {new} 為準")
+                del rule[old]
+            else:
+                rule[new] = rule.pop(old)
+                issue("warning", f"欄位 {old} 已改名為 {new}")
+
+    schema = SCHEMA.get(rule.get("type"))
+    if schema is None:
+        issue("error", f"未知的折扣類型：{rule.get('type')}")
+        return None, issues
+
+    for field, expected in OPTIONAL.items():
+        if field in rule and not _is_type(rule[field], expected):
+            issue("error", f"{field} 型別錯誤：{rule[field]!r}")
+            return None, issues
+    if rule.get("rounding", ROUNDING_MODES[0]) not in ROUNDING_MODES:
+        issue("error", f"rounding 必須是 {' / '.join(ROUNDING_MODES)}：{rule['rounding']!r}")
+        return None, issues
+
+    # 百分比寫成 85 視為 0.85（付 85%）
+    percent = rule.get("percent")
+    if _is_type(percent, NUMBER) and 1 < percent <= 100:
+        rule["percent"] = percent / 100
+        issue("warning", f"percent {percent} 已換算為 {rule['percent']}")
+
+    for field, expected in schema.items():
+        if field not in rule:
+            if rule["type"] == "滿件折扣" and field == "items" and "category" in rule:
+                issue("dead", "滿件折扣缺少 items（不支援以 category 計件）")
+            else:
+                issue("dead", f"缺少欄位 {field}")
+            return None, issues
+        if not _is_type(rule[field], expected):
+            issue("error", f"{field} 型別錯誤：{rule[field]!r}")
+            return None, issues
+
+    if "items" in schema and not all(isinstance(pid, str) for pid in rule["items"]):
+        issue("error", "items 必須是商品 ID 字串陣列")
+        return None, issues
+    if "amount" in schema and rule["amount"] <= 0:
+        issue("dead", f"折扣金額 {rule['amount']} <= 0")
+        return None, issues
+    if "percent" in schema and not 0 < rule["percent"] < 1:
+        issue("dead", f"percent {rule['percent']} 不在 (0, 1) 之間")
+        return None, issues
+
+    # 欄位齊全但目前的計算邏輯不支援（與 apply_discount 相同的判斷）
+    if CompiledRule(0, rule).is_dead():
+        issue("dead", f"{rule['type']} 目前不會產生折扣")
+        return None, issues
+    return rule, issues
+
+
+def normalize_rules(raw_rules):
+    # 回傳 (可用規則, 停用規則 ID, 問題清單)
+    rules, dead, issues = [], [], []
+    seen = set()
+    for raw in raw_rules:
+        rule, rule_issues = normalize_rule(raw)
+        if rule is not None and rule["id"] in seen:
+            rule_issues.append({"id": rule["id"], "level": "error", "message": "id 重複"})
+            rule = None
+        issues.extend(rule_issues)
+        if rule is None:
+            dead.append(rule_issues[-1]["id"])
+            continue
+        seen.add(rule["id"])
+        rules.append(rule)
+    return rules, dead, issues
+
+
+def _source_stamp(path):
+    st = os.stat(path)
+    return {"source_mtime_ns": st.st_mtime_ns, "source_size": st.st_size}
+
+
+def compile_rules(path=DISCOUNT_PATH, strict=False):
+    # 檢查並正規化 path，回傳編譯結果（不寫檔）；strict 時有 error 就丟出 RuleValidationError
+    with open(path, "r", encoding="utf-8") as f:
+        raw_rules = json.load(f)
+    rules, dead, issues = normalize_rules(raw_rules)
+    errors = [i for i in issues if i["level"] == "error"]
+    if strict and errors:
+        raise RuleValidationError(errors)
+
+    artifact = {
+        "format": RULE_FORMAT,
+        "source": path,
+        **_source_stamp(path),
+        "version": CompiledRuleSet(rules).version,
+        "rules": rules,
+        "dead": dead,
+        "issues": issues,
+    }
+    return artifact
+
+
+def write_artifact(artifact, out_path):
+    tmp = out_path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(artifact, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, out_path)
+
+
+def _report_dropped(path, artifact):
+    # 非 strict 載入時，格式錯誤（含 id 重複）的規則也會被停用，可能改變價格，不能默默略過
+    key = (os.path.abspath(path), artifact["version"])
+    if key in _reported:
+        return
+    _reported.add(key)
+    for i in artifact["issues"]:
+        if i["level"] == "error":
+            log.warning("%s：規則 %s 格式錯誤，已停用：%s", path, i["id"], i["message"])
+        elif i["level"] == "dead":
+            log.info("%s：規則 %s 不會產生折扣，已停用：%s", path, i["id"], i["message"])
+
+
+def load_artifact(path=DISCOUNT_PATH):
+    # 編譯檔存在且與原始檔相符時直接讀取，否則在記憶體中重新檢查
+    out_path = compiled_path(path)
+    artifact = None
+    if os.path.exists(out_path):
+        with open(out_path, "r", encoding="utf-8") as f:
+            artifact = json.load(f)
+        stamp = _source_stamp(path)
+        if artifact.get("format") != RULE_FORMAT or any(artifact.get(k) != v for k, v in stamp.items()):
+            artifact = None
+    if artifact is None:
+        artifact = compile_rules(path)
+    _report_dropped(path, artifact)
+    return artifact
+
+
+def load_rules(path=DISCOUNT_PATH):
+    return load_artifact(path)["rules"]
+
+
+def load_ruleset(path=DISCOUNT_PATH):
+    return CompiledRuleSet(load_rules(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="檢查並編譯折扣規則")
+    parser.add_argument("path", nargs="?", default=DISCOUNT_PATH)
+    parser.add_argument("--strict", action="store_true", help="有格式錯誤時以非 0 結束")
+    args = parser.parse_args()
+
+    try:
+        artifact = compile_rules(args.path, strict=args.strict)
+    except RuleValidationError as e:
+        print(f"❌ 規則格式錯誤：\n{e}")
+        raise SystemExit(1)
+    write_artifact(artifact, compiled_path(args.path))
+    for i in artifact["issues"]:
+        print(f"{'⚠️' if i['level'] == 'warning' else '❌'} [{i['level']}] {i['id']}：{i['message']}")
+    print(f"✅ 可用規則 {len(artifact['rules'])} 條，停用 {len(artifact['dead'])} 條，"
+          f"版本 {artifact['version'][:12]} → {compiled_path(args.path)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,407 @@
+import hashlib
+import json
+from collections import defaultdict
+
+from . import profiling
+from .cart import Cart
+
+# 編譯後的折扣規則集：把 discounts.json 預先整理成索引，讓每次結帳只需掃一次購物車
+
+# 計算邏輯版本：支援的規則或金額算法改變時遞增，規則版本（快取 key）會跟著改變
+EVALUATOR_VERSION = 2
+
+# 百分比折扣：percent 為應付比例（0.85 = 85 折），折扣金額 = 基準金額 × (1 - percent) 再取整
+#   floor：折扣無條件捨去（預設，不會多折）、round：四捨五入、ceil：無條件進位
+# 規則可用 "rounding" 欄位個別指定
+PERCENT_TYPES = ("分類折扣", "單品折扣", "品牌折扣", "限時折扣")
+ROUNDING_MODES = ("floor", "round", "ceil")
+PERCENT_ROUNDING = "floor"
+# percent 換成萬分之一的整數再計算，避免 1000 × (1 - 0.85) = 150.00000000000003 這類浮點誤差
+PERCENT_SCALE = 10000
+
+
+def percent_off(percent):
+    # 折扣比例（萬分之一）
+    return PERCENT_SCALE - round(percent * PERCENT_SCALE)
+
+
+def percent_discount(base, off, rounding=PERCENT_ROUNDING):
+    if off <= 0 or base <= 0:
+        return 0
+    scaled = base * off
+    if rounding == "ceil":
+        return -(-scaled // PERCENT_SCALE)
+    if rounding == "round":
+        return (scaled * 2 + PERCENT_SCALE) // (2 * PERCENT_SCALE)
+    return scaled // PERCENT_SCALE
+
+
+class CartStats:
+    __slots__ = ("total", "category_totals", "id_counts", "id_totals", "brand_totals")
+
+    def __init__(self, total, category_totals, id_counts, id_totals, brand_totals):
+        self.total = total
+        self.category_totals = category_totals
+        self.id_counts = id_counts
+        # 百分比折扣的基準：各商品小計、各品牌小計（沒有品牌的商品不計）
+        self.id_totals = id_totals
+        self.brand_totals = brand_totals
+
+    @classmethod
+    def from_items(cls, cart_items):
+        if isinstance(cart_items, Cart):
+            return cls(*cart_items.aggregate())
+        # 一次掃描購物車：總金額、各分類小計、商品 ID 計數與小計、各品牌小計
+        total = 0
+        category_totals = defaultdict(int)
+        id_counts = defaultdict(int)
+        id_totals = defaultdict(int)
+        brand_totals = defaultdict(int)
+        for item in cart_items:
+            price = item["price"]
+            pid = item["id"]
+            total += price
+            category_totals[item.get("category")] += price
+            id_counts[pid] += 1
+            id_totals[pid] += price
+            brand = item.get("brand")
+            if brand is not None:
+                brand_totals[brand] += price
+        return cls(total, category_totals, id_counts, id_totals, brand_totals)
+
+    def copy(self):
+        return CartStats(self.total, defaultdict(int, self.category_totals), defaultdict(int, self.id_counts),
+                         defaultdict(int, self.id_totals), defaultdict(int, self.brand_totals))
+
+    def add(self, item):
+        price = item["price"]
+        self.total += price
+        self.category_totals[item.get("category")] += price
+        self.id_counts[item["id"]] += 1
+        self.id_totals[item["id"]] += price
+        brand = item.get("brand")
+        if brand is not None:
+            self.brand_totals[brand] += price
+
+    def remove(self, item):
+        # add 的反向操作；歸零的 key 要刪掉，組合折扣靠 key 是否存在判斷
+        price = item["price"]
+        category = item.get("category")
+        self.total -= price
+        self.category_totals[category] -= price
+        if not self.category_totals[category]:
+            del self.category_totals[category]
+        self.id_counts[item["id"]] -= 1
+        self.id_totals[item["id"]] -= price
+        if self.id_counts[item["id"]] <= 0:
+            del self.id_counts[item["id"]]
+            del self.id_totals[item["id"]]
+        brand = item.get("brand")
+        if brand is not None:
+            self.brand_totals[brand] -= price
+            if not self.brand_totals[brand]:
+                del self.brand_totals[brand]
+
+
+class CompiledRule:
+    __slots__ = ("index", "raw", "type", "amount", "items", "count", "threshold", "category",
+                 "product_id", "brand", "percent", "off", "rounding")
+
+    def __init__(self, index, raw):
+        self.index = index
+        self.raw = raw
+        self.type = raw.get("type")
+        self.amount = raw.get("amount", 0)
+        self.items = frozenset(raw["items"]) if "items" in raw else None
+        self.count = raw.get("count")
+        self.threshold = raw.get("threshold")
+        self.category = raw.get("category")
+        self.product_id = raw.get("product_id")
+        self.brand = raw.get("brand")
+        # 百分比折扣：amount 固定為 0，金額依基準金額計算
+        self.percent = raw.get("percent") if self.type in PERCENT_TYPES else None
+        self.off = percent_off(self.percent) if self.percent is not None else 0
+        self.rounding = raw.get("rounding", PERCENT_ROUNDING)
+
+    def is_dead(self):
+        # 與 apply_discount 相同：缺欄位或不支援的類型永遠折 0
+        if self.type == "滿額折扣":
+            return self.category is None or self.threshold is None
+        if self.type == "滿件折扣":
+            return self.items is None or self.count is None
+        if self.type in ("組合折扣", "獨立折扣"):
+            return self.items is None
+        if self.type == "分類折扣":
+            return self.category is None or self.percent is None
+        if self.type == "單品折扣":
+            return self.product_id is None or self.percent is None
+        if self.type == "品牌折扣":
+            return self.brand is None or self.percent is None
+        if self.type == "限時折扣":
+            return self.percent is None
+        return True
+
+    def percent_base(self, stats):
+        if self.type == "分類折扣":
+            return stats.category_totals.get(self.category, 0)
+        if self.type == "單品折扣":
+            return stats.id_totals.get(self.product_id, 0)
+        if self.type == "品牌折扣":
+            return stats.brand_totals.get(self.brand, 0)
+        return stats.total
+
+    def percent_amount(self, base):
+        return percent_discount(base, self.off, self.rounding)
+
+    def triggered(self, stats):
+        if self.type == "滿額折扣":
+            return stats.category_totals.get(self.category, 0) >= self.threshold
+        if self.type == "滿件折扣":
+            ids = stats.id_counts
+            return sum(ids.get(pid, 0) for pid in self.items) >= self.count
+        if self.type == "組合折扣":
+            return all(pid in stats.id_counts for pid in self.items)
+        if self.type == "獨立折扣":
+            return any(pid in stats.id_counts for pid in self.items)
+        if self.percent is not None:
+            return self.percent_amount(self.percent_base(stats)) > 0
+        return False
+
+    def amount_for(self, stats):
+        if self.is_dead():
+            return 0
+        if self.percent is not None:
+            return self.percent_amount(self.percent_base(stats))
+        return self.amount if self.triggered(stats) else 0
+
+
+class CompiledRuleSet:
+    def __init__(self, discount_rules):
+        self.rules = list(discount_rules)
+        self.compiled = [CompiledRule(i, d) for i, d in enumerate(self.rules)]
+
+        # 倒排索引：商品 ID → 規則、分類 → (滿額門檻, 規則) 依門檻排序
+        self.by_item = defaultdict(list)
+        self.by_category = defaultdict(list)
+        # 不看購物車內容也會成立的規則（門檻 <= 0、空組合等）
+        self.always = []
+        # 百分比折扣依基準金額的 key 建索引：分類 / 商品 ID / 品牌；限時折扣看整車
+        self.percent_by_category = defaultdict(list)
+        self.percent_by_item = defaultdict(list)
+        self.percent_by_brand = defaultdict(list)
+        self.percent_always = []
+
+        for rule in self.compiled:
+            if rule.is_dead():
+                continue
+            if rule.percent is not None:
+                if rule.off <= 0:
+                    continue
+                if rule.type == "分類折扣":
+                    self.percent_by_category[rule.category].append(rule.index)
+                elif rule.type == "單品折扣":
+                    self.percent_by_item[rule.product_id].append(rule.index)
+                elif rule.type == "品牌折扣":
+                    self.percent_by_brand[rule.brand].append(rule.index)
+                else:
+                    self.percent_always.append(rule.index)
+                continue
+            if rule.amount <= 0:
+                continue
+            if rule.type == "滿額折扣":
+                if rule.threshold <= 0:
+                    self.always.append(rule.index)
+                else:
+                    self.by_category[rule.category].append((rule.threshold, rule.index))
+            elif rule.type == "滿件折扣" and rule.count <= 0:
+                self.always.append(rule.index)
+            elif rule.type == "組合折扣" and not rule.items:
+                self.always.append(rule.index)
+            else:
+                for pid in rule.items:
+                    self.by_item[pid].append(rule.index)
+        for thresholds in self.by_category.values():
+            thresholds.sort()
+
+        # solve_cart 的分流：exclusive / 不可疊加 / group / 其他可疊加
+        self.is_exclusive = [bool(d.get("exclusive", False)) for d in self.rules]
+        self.is_stackable = [bool(d.get("stackable", True)) for d in self.rules]
+        self.group_of = [None] * len(self.rules)
+        self.group_rank = {}
+        for i, d in enumerate(self.rules):
+            if self.is_stackable[i] and not self.is_exclusive[i]:
+                group = d.get("group")
+                if group:
+                    self.group_of[i] = group
+                    self.group_rank.setdefault(group, len(self.group_rank))
+
+        # solve_cart_split 的分流
+        self.exclusive_rules = [d for d in self.rules if d.get("exclusive", False)]
+        self.exclusive_indexes = [i for i, flag in enumerate(self.is_exclusive) if flag]
+        self._normal = None
+        self._version = None
+
+    @classmethod
+    def from_json(cls, path):
+        # 經過 rule_loader 檢查與正規化；原始檔未變更時直接讀編譯後的規則檔
+        from .rule_loader import load_rules
+        return cls(load_rules(path))
+
+    @property
+    def normal(self):
+        # 非 exclusive 的子規則集（剩餘商品主發票使用）
+        if self._normal is None:
+            self._normal = CompiledRuleSet([d for d in self.rules if not d.get("exclusive", False)])
+        return self._normal
+
+    @property
+    def version(self):
+        # 規則內容的雜湊（與順序有關），供快取判斷規則是否換過
+        if self._version is None:
+            text = json.dumps(self.rules, ensure_ascii=False, sort_keys=True)
+            self._version = hashlib.sha1(f"{EVALUATOR_VERSION}:{text}".encode("utf-8")).hexdigest()
+        return self._version
+
+    def __len__(self):
+        return len(self.rules)
+
+    def __iter__(self):
+        return iter(self.rules)
+
+    def cart_stats(self, cart_items):
+        return CartStats.from_items(cart_items)
+
+    def evaluate(self, stats):
+        # 回傳 {規則索引: 折扣金額}，只包含金額 > 0 的規則
+        if profiling.active is not None:
+            return self._evaluate_profiled(stats, profiling.active)
+        amounts = {}
+        compiled = self.compiled
+
+        for category, total in stats.category_totals.items():
+            for threshold, idx in self.by_category.get(category, ()):
+                if total < threshold:
+                    break
+                amounts[idx] = compiled[idx].amount
+            for idx in self.percent_by_category.get(category, ()):
+                amt = compiled[idx].percent_amount(total)
+                if amt > 0:
+                    amounts[idx] = amt
+
+        seen = set()
+        id_totals = stats.id_totals
+        for pid in stats.id_counts:
+            for idx in self.by_item.get(pid, ()):
+                if idx in seen:
+                    continue
+                seen.add(idx)
+                if compiled[idx].triggered(stats):
+                    amounts[idx] = compiled[idx].amount
+            for idx in self.percent_by_item.get(pid, ()):
+                amt = compiled[idx].percent_amount(id_totals[pid])
+                if amt > 0:
+                    amounts[idx] = amt
+
+        if self.percent_by_brand:
+            for brand, total in stats.brand_totals.items():
+                for idx in self.percent_by_brand.get(brand, ()):
+                    amt = compiled[idx].percent_amount(total)
+                    if amt > 0:
+                        amounts[idx] = amt
+        for idx in self.percent_always:
+            amt = compiled[idx].percent_amount(stats.total)
+            if amt > 0:
+                amounts[idx] = amt
+
+        for idx in self.always:
+            amounts[idx] = compiled[idx].amount
+        return amounts
+
+    def _evaluate_profiled(self, stats, prof):
+        # 與 evaluate 相同的走訪順序，逐條計時；滿額規則只記錄實際比較過門檻的
+        amounts = {}
+        compiled = self.compiled
+        now = profiling.now
+
+        for category, total in stats.category_totals.items():
+            for threshold, idx in self.by_category.get(category, ()):
+                started = now()
+                hit = total >= threshold
+                if hit:
+                    amounts[idx] = compiled[idx].amount
+                prof.record_rule(self.rules[idx], amounts[idx] if hit else 0, now() - started)
+                if not hit:
+                    break
+            for idx in self.percent_by_category.get(category, ()):
+                self._percent_profiled(idx, total, amounts, prof)
+
+        seen = set()
+        for pid in stats.id_counts:
+            for idx in self.by_item.get(pid, ()):
+                if idx in seen:
+                    continue
+                seen.add(idx)
+                started = now()
+                hit = compiled[idx].triggered(stats)
+                if hit:
+                    amounts[idx] = compiled[idx].amount
+                prof.record_rule(self.rules[idx], amounts[idx] if hit else 0, now() - started)
+            for idx in self.percent_by_item.get(pid, ()):
+                self._percent_profiled(idx, stats.id_totals[pid], amounts, prof)
+
+        for brand, total in stats.brand_totals.items():
+            for idx in self.percent_by_brand.get(brand, ()):
+                self._percent_profiled(idx, total, amounts, prof)
+        for idx in self.percent_always:
+            self._percent_profiled(idx, stats.total, amounts, prof)
+
+        for idx in self.always:
+            amounts[idx] = compiled[idx].amount
+            prof.record_rule(self.rules[idx], amounts[idx], 0)
+        return amounts
+
+    def _percent_profiled(self, idx, base, amounts, prof):
+        started = profiling.now()
+        amt = self.compiled[idx].percent_amount(base)
+        if amt > 0:
+            amounts[idx] = amt
+        prof.record_rule(self.rules[idx], amt, profiling.now() - started)
+
+    def affected_by(self, item):
+        # 加入 item 後金額可能改變的規則索引
+        indexes = [idx for _, idx in self.by_category.get(item.get("category"), ())]
+        indexes.extend(self.by_item.get(item["id"], ()))
+        indexes.extend(self.percent_by_category.get(item.get("category"), ()))
+        indexes.extend(self.percent_by_item.get(item["id"], ()))
+        if item.get("brand") is not None:
+            indexes.extend(self.percent_by_brand.get(item["brand"], ()))
+        indexes.extend(self.percent_always)
+        return indexes
+
+    def select(self, amounts):
+        # 依 solve_cart 的優先順序挑選折扣，回傳 [(規則索引, 金額)] 與是否為單一獨占折扣
+        hits = sorted(amounts)
+
+        for idx in hits:
+            if self.is_exclusive[idx]:
+                return [(idx, amounts[idx])], True
+
+        best = None
+        for idx in hits:
+            if not self.is_stackable[idx] and (best is None or amounts[idx] > best[1]):
+                best = (idx, amounts[idx])
+        if best:
+            return [best], True
+
+        group_best = {}
+        others = []
+        for idx in hits:
+            group = self.group_of[idx]
+            if group:
+                if group not in group_best or amounts[idx] > group_best[group][1]:
+                    group_best[group] = (idx, amounts[idx])
+            elif self.is_stackable[idx] and not self.is_exclusive[idx]:
+                others.append((idx, amounts[idx]))
+
+        chosen = sorted(group_best.items(), key=lambda kv: self.group_rank[kv[0]])
+        return [pick for _, pick in chosen] + others, False
@@ -0,0 +1,268 @@
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from .batch import BatchSolver, _chunked
+from .cart import Cart
+from .ruleset import CompiledRuleSet
+from .solver import solve_cart_split
+
+# 拆帳結果快取：同一台購物車（不論商品順序）與同一版規則只解一次
+#   記憶體：LRU，超過 maxsize 淘汰最久沒用到的
+#   磁碟（選用）：SQLite，適合批次工作跨程序 / 跨執行共用
+# 快取只存各發票用到「排序後第幾個品項、幾件」，命中時從呼叫端自己的購物車取回商品，
+# 不會拿到先前另一台同內容購物車的 dict（name 等欄位可能不同）；每次回傳一份新的 orders
+# （規則 dict 與直接拆帳一樣沿用規則集的），呼叫端修改結果不會影響快取
+
+DISCOUNT_PATH = "data/raw/discounts.json"
+MAXSIZE = 4096
+# solve_many 每次查快取的購物車數
+BATCH_WINDOW = 4096
+
+
+def _line_keys(cart_items):
+    # 每個品項的 ((id, 價格, 分類, 品牌), 件數)；list 為一件一個品項
+    if isinstance(cart_items, Cart):
+        return [
+            ((pid, price, category, (cart_items.extras[line] or {}).get("brand")), qty)
+            for line, (pid, price, category, qty) in enumerate(cart_items.lines())
+        ]
+    return [((i["id"], i["price"], i.get("category"), i.get("brand")), 1) for i in cart_items]
+
+
+def _canonical(cart_items):
+    # 回傳 (cart_signature, 排序後第 k 個品項在輸入中的索引)
+    keys = [key + (qty,) for key, qty in _line_keys(cart_items)]
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    return tuple(keys[j] for j in order), order
+
+
+def cart_signature(cart_items):
+    # 商品的多重集合：(id, 價格, 分類, 品牌, 件數) 排序後的 tuple；分類與品牌會影響 exclusive 比對
+    return _canonical(cart_items)[0]
+
+
+def _to_positions(orders, signature):
+    # 各發票的商品換成 [(排序後品項編號, 件數)]，同內容的購物車都能套用
+    free = {}
+    for k in reversed(range(len(signature))):
+        free.setdefault(signature[k][:4], []).append([k, signature[k][4]])
+    stored = []
+    for o in orders:
+        picks = []
+        for key, qty in _line_keys(o["items"]):
+            slots = free[key]
+            while qty:
+                slot = slots[-1]
+                n = min(qty, slot[1])
+                picks.append((slot[0], n))
+                slot[1] -= n
+                qty -= n
+                if not slot[1]:
+                    slots.pop()
+        stored.append({**o, "items": picks})
+    return stored
+
+
+def _from_positions(stored, cart_items, order):
+    # 依呼叫端的購物車重建 orders；發票內商品維持輸入順序，與直接拆帳相同
+    orders = []
+    for o in stored:
+        picks = {}
+        for k, n in o["items"]:
+            line = order[k]
+            picks[line] = picks.get(line, 0) + n
+        if isinstance(cart_items, Cart):
+            items = cart_items.take(picks)[0]
+        else:
+            items = [cart_items[line] for line in sorted(picks)]
+        orders.append({
+            **o,
+            "items": items,
+            "discounts": list(o["discounts"]),
+            "result": {**o["result"], "used_discounts": [dict(d) for d in o["result"]["used_discounts"]]},
+        })
+    return orders
+
+
+class SolveCache:
+    def __init__(self, discount_path=DISCOUNT_PATH, rules=None, maxsize=MAXSIZE, disk_path=None):
+        # rules 為 None 時從 discount_path 載入，檔案 mtime 改變就重新載入並清空記憶體快取
+        self.discount_path = None if rules is not None else discount_path
+        self.maxsize = maxsize
+        self._ruleset = None
+        self._mtime = None
+        if rules is not None:
+            self._ruleset = rules if isinstance(rules, CompiledRuleSet) else CompiledRuleSet(rules)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        self._db = None
+        if disk_path:
+            os.makedirs(os.path.dirname(disk_path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(disk_path, timeout=30, isolation_level=None, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            # 存的是品項位置而非商品 dict，與舊版的 solves 表格式不同，另開一張表
+            self._db.execute("CREATE TABLE IF NOT EXISTS split_positions (key TEXT PRIMARY KEY, orders TEXT)")
+
+    @property
+    def ruleset(self):
+        if self.discount_path:
+            mtime = os.stat(self.discount_path).st_mtime
+            if mtime != self._mtime:
+                with self._lock:
+                    if mtime != self._mtime:
+                        self._ruleset = CompiledRuleSet.from_json(self.discount_path)
+                        if self._mtime is not None:
+                            self.invalidations += 1
+                        self._entries.clear()
+                        self._mtime = mtime
+        return self._ruleset
+
+    def _key(self, ruleset, cart_items, signature, mode, budget):
+        as_cart = isinstance(cart_items, Cart)
+        return (ruleset.version, mode, tuple(sorted(budget.items())), as_cart, signature)
+
+    def _lookup(self, key, ruleset):
+        # 記憶體 → 磁碟；都沒有時回傳 None
+        with self._lock:
+            orders = self._entries.get(key)
+            if orders is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return orders
+
+        orders = self._disk_get(key, ruleset)
+        if orders is not None:
+            with self._lock:
+                self.disk_hits += 1
+            self._remember(key, orders)
+        return orders
+
+    def _store(self, key, orders, ruleset):
+        self._disk_put(key, orders, ruleset)
+        with self._lock:
+            self.misses += 1
+        self._remember(key, orders)
+
+    def _remember(self, key, orders):
+        with self._lock:
+            self._entries[key] = orders
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def solve_cart_split(self, cart_items, mode="greedy", **budget):
+        ruleset = self.ruleset
+        signature, order = _canonical(cart_items)
+        key = self._key(ruleset, cart_items, signature, mode, budget)
+        stored = self._lookup(key, ruleset)
+        if stored is None:
+            stored = _to_positions(solve_cart_split(cart_items, ruleset, mode=mode, **budget), signature)
+            self._store(key, stored, ruleset)
+        return _from_positions(stored, cart_items, order)
+
+    def solve_many(self, carts, mode="greedy", workers=1, window=BATCH_WINDOW, **budget):
+        # 產生器：依輸入順序回傳拆帳結果；每 window 台購物車先查快取，沒命中的一起交給 BatchSolver
+        ruleset = self.ruleset
+        with BatchSolver(ruleset, workers, mode, **budget) as batch:
+            for chunk in _chunked(carts, window):
+                canonical = [_canonical(cart) for cart in chunk]
+                keys = [self._key(ruleset, cart, signature, mode, budget)
+                        for cart, (signature, _) in zip(chunk, canonical)]
+                # 同一個 window 內重複的購物車只算一次，其餘視為命中
+                found = {}
+                misses = {}
+                for key, cart in zip(keys, chunk):
+                    if key in found or key in misses:
+                        with self._lock:
+                            self.hits += 1
+                        continue
+                    stored = self._lookup(key, ruleset)
+                    if stored is None:
+                        misses[key] = cart
+                    else:
+                        found[key] = stored
+                for key, orders in zip(misses, batch.map(misses.values())):
+                    stored = _to_positions(orders, key[4])
+                    self._store(key, stored, ruleset)
+                    found[key] = stored
+                for key, cart, (_, order) in zip(keys, chunk, canonical):
+                    yield _from_positions(found[key], cart, order)
+
+    __call__ = solve_cart_split
+
+    # ===== 磁碟層 =====
+
+    def _disk_key(self, key):
+        return json.dumps(key, ensure_ascii=False, separators=(",", ":"))
+
+    def _disk_get(self, key, ruleset):
+        if self._db is None:
+            return None
+        row = self._db.execute("SELECT orders FROM split_positions WHERE key = ?", (self._disk_key(key),)).fetchone()
+        if row is None:
+            return None
+        stored = json.loads(row[0])
+        for o in stored:
+            # 主發票的 discounts 就是目前規則集的非 exclusive 規則，不寫入磁碟，讀回時再接上
+            o["main"] = o["discounts"] is None
+            if o["main"]:
+                o["discounts"] = ruleset.normal.rules
+            o["items"] = [tuple(pick) for pick in o["items"]]
+        return stored
+
+    def _disk_put(self, key, stored, ruleset):
+        if self._db is None:
+            return
+        payload = [{**o, "discounts": None if o["main"] else o["discounts"]} for o in stored]
+        self._db.execute(
+            "INSERT OR REPLACE INTO split_positions (key, orders) VALUES (?, ?)",
+            (self._disk_key(key), json.dumps(payload, ensure_ascii=False)),
+        )
+
+    # ===== 管理 =====
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+# 頁面與服務共用同一個快取（規則來自 discounts.json）
+def get_solve_cache():
+    global _shared
+    if _shared is None:
+        with _shared_lock:
+            if _shared is None:
+                _shared = SolveCache()
+    return _shared
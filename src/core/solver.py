@@ -1,7 +1,48 @@
+from . import profiling
 from .discount import apply_discount
+from .ruleset import CompiledRuleSet
+from .cart import Cart
 from collections import defaultdict
 
+def _solve_compiled(cart_items, ruleset):
+    stats = ruleset.cart_stats(cart_items)
+    picks, single = ruleset.select(ruleset.evaluate(stats))
+    used_discounts = [{**ruleset.rules[idx], "amount": amt} for idx, amt in picks]
+    total_discount = sum(amt for _, amt in picks)
+    # exclusive / 不可疊加折扣與原邏輯相同，不做 0 元下限
+    final_price = stats.total - total_discount if single else max(stats.total - total_discount, 0)
+    return {
+        "original_total": stats.total,
+        "total_discount": total_discount,
+        "final_price": final_price,
+        "used_discounts": used_discounts
+    }
+
+def _outcome(result):
+    # 由結果判斷分流：只用一個 exclusive / 不可疊加折扣代表提前結束
+    used = result["used_discounts"]
+    if len(used) == 1 and used[0].get("exclusive", False):
+        return "exclusive"
+    if len(used) == 1 and not used[0].get("stackable", True):
+        return "non_stackable"
+    return "stacked"
+
 def solve_cart(cart_items, discount_rules):
+    prof = profiling.active
+    if prof is None:
+        return _solve_cart(cart_items, discount_rules)
+    started = profiling.now()
+    result = _solve_cart(cart_items, discount_rules)
+    prof.record_call("solve_cart", profiling.now() - started)
+    prof.record_outcome(_outcome(result))
+    return result
+
+def _solve_cart(cart_items, discount_rules):
+    if isinstance(discount_rules, CompiledRuleSet):
+        return _solve_compiled(cart_items, discount_rules)
+    if isinstance(cart_items, Cart):
+        return _solve_compiled(cart_items, CompiledRuleSet(discount_rules))
+
     original_total = sum(item['price'] for item in cart_items)
     used_discounts = []
     total_discount = 0
@@ -68,7 +109,33 @@ def solve_cart(cart_items, discount_rules):
         "used_discounts": used_discounts
     }
 
-def solve_cart_split(cart_items, discount_rules):
+def solve_cart_split(cart_items, discount_rules, mode="greedy", **budget):
+    prof = profiling.active
+    if prof is None:
+        return _solve_cart_split(cart_items, discount_rules, mode, **budget)
+    started = profiling.now()
+    orders = _solve_cart_split(cart_items, discount_rules, mode, **budget)
+    prof.record_call(f"solve_cart_split[{mode}]", profiling.now() - started)
+    prof.record_invoices(len(orders))
+    return orders
+
+def _solve_cart_split(cart_items, discount_rules, mode="greedy", **budget):
+    # mode="optimal"：branch-and-bound 找最便宜的拆帳，budget 可帶 max_nodes / time_limit
+    if mode == "optimal":
+        from .optimal import solve_split_optimal
+        if isinstance(cart_items, Cart):
+            orders = solve_split_optimal(cart_items.to_items(), discount_rules, **budget)[0]
+            return [{**o, "items": Cart.from_items(o["items"])} for o in orders]
+        return solve_split_optimal(cart_items, discount_rules, **budget)[0]
+    if mode != "greedy":
+        raise ValueError(f"未知的拆帳模式：{mode}")
+
+    if isinstance(cart_items, Cart):
+        ruleset = discount_rules if isinstance(discount_rules, CompiledRuleSet) else CompiledRuleSet(discount_rules)
+        return _solve_split_cart(cart_items, ruleset)
+    if isinstance(discount_rules, CompiledRuleSet):
+        return _solve_split_compiled(cart_items, discount_rules)
+
     used_item_ids = set()
     orders = []
 
@@ -103,6 +170,7 @@ def solve_cart_split(cart_items, discount_rules):
             orders.append({
                 "items": matched,
                 "discounts": [d],
+                "main": False,
                 "result": result
             })
             used_item_ids.update(i['id'] for i in matched)
@@ -114,7 +182,142 @@ def solve_cart_split(cart_items, discount_rules):
         orders.append({
             "items": remaining_items,
             "discounts": normal_discounts,
+            "main": True,
             "result": result
         })
 
-    return orders
\ No newline at end of file
+    return orders
+
+def _match_exclusive(rule, usable_items):
+    # 與 solve_cart_split 相同的 exclusive 商品比對，組合折扣改用 frozenset
+    d = rule.raw
+    if rule.type == '組合折扣':
+        return [i for i in usable_items if i['id'] in rule.items]
+    elif rule.type == '單品折扣':
+        return [i for i in usable_items if i['id'] == d['product_id']]
+    elif rule.type == '分類折扣':
+        return [i for i in usable_items if i['category'] == d['category']]
+    elif rule.type == '品牌折扣':
+        return [i for i in usable_items if i.get('brand') == d['brand']]
+    elif rule.type == '限時折扣':
+        return usable_items
+    return []
+
+def _exclusive_amount(rule, stats):
+    # exclusive 發票直接以 amount_for 計價；剖析時比照 apply_discount + solve_cart 記錄規則評估、呼叫與 exclusive 分流
+    prof = profiling.active
+    if prof is None:
+        return rule.amount_for(stats)
+    started = profiling.now()
+    amt = rule.amount_for(stats)
+    ns = profiling.now() - started
+    prof.record_rule(rule.raw, amt, ns)
+    if amt > 0:
+        prof.record_call("solve_cart", ns)
+        prof.record_outcome("exclusive")
+    return amt
+
+def _solve_split_compiled(cart_items, ruleset):
+    used_item_ids = set()
+    orders = []
+
+    for idx in ruleset.exclusive_indexes:
+        rule = ruleset.compiled[idx]
+        usable_items = [i for i in cart_items if i['id'] not in used_item_ids]
+        matched = _match_exclusive(rule, usable_items)
+        if not matched:
+            continue
+
+        stats = ruleset.cart_stats(matched)
+        amt = _exclusive_amount(rule, stats)
+        if amt > 0:
+            orders.append({
+                "items": matched,
+                "discounts": [rule.raw],
+                "main": False,
+                "result": {
+                    "original_total": stats.total,
+                    "total_discount": amt,
+                    "final_price": stats.total - amt,
+                    "used_discounts": [{**rule.raw, "amount": amt}]
+                }
+            })
+            used_item_ids.update(i['id'] for i in matched)
+
+    remaining_items = [i for i in cart_items if i['id'] not in used_item_ids]
+    if remaining_items:
+        normal = ruleset.normal
+        orders.append({
+            "items": remaining_items,
+            "discounts": normal.rules,
+            "main": True,
+            "result": solve_cart(remaining_items, normal)
+        })
+
+    return orders
+
+def _match_exclusive_cart(rule, cart):
+    # 回傳 {品項索引: 數量}；組合折扣每個指定商品只取一件，其餘件數留在主發票
+    d = rule.raw
+    picks = {}
+    for line, (pid, _, category, qty) in enumerate(cart.lines()):
+        if rule.type == '組合折扣':
+            if pid in rule.items and pid not in picks.values():
+                picks[line] = pid
+        elif rule.type == '單品折扣':
+            if pid == d['product_id']:
+                picks[line] = qty
+        elif rule.type == '分類折扣':
+            if category == d['category']:
+                picks[line] = qty
+        elif rule.type == '品牌折扣':
+            if (cart.extras[line] or {}).get('brand') == d['brand']:
+                picks[line] = qty
+        elif rule.type == '限時折扣':
+            picks[line] = qty
+    if rule.type == '組合折扣':
+        picks = {line: 1 for line in picks}
+    return picks
+
+def _solve_split_cart(cart, ruleset):
+    # 與 solve_cart_split 相同的流程，但以件數拆分同商品，不再依商品 ID 整批排除
+    orders = []
+    remaining = cart
+
+    for idx in ruleset.exclusive_indexes:
+        rule = ruleset.compiled[idx]
+        picks = _match_exclusive_cart(rule, remaining)
+        if not picks:
+            continue
+
+        matched, rest = remaining.take(picks)
+        stats = ruleset.cart_stats(matched)
+        amt = _exclusive_amount(rule, stats)
+        if amt > 0:
+            orders.append({
+                "items": matched,
+                "discounts": [rule.raw],
+                "main": False,
+                "result": {
+                    "original_total": stats.total,
+                    "total_discount": amt,
+                    "final_price": stats.total - amt,
+                    "used_discounts": [{**rule.raw, "amount": amt}]
+                }
+            })
+            remaining = rest
+
+    if remaining:
+        normal = ruleset.normal
+        orders.append({
+            "items": remaining,
+            "discounts": normal.rules,
+            "main": True,
+            "result": solve_cart(remaining, normal)
+        })
+
+    return orders
+
+def orders_to_json(orders):
+    # 將 Cart 拆帳結果轉回現行格式（items 為一件一個 dict）
+    return [{**o, "items": o["items"].to_items() if isinstance(o["items"], Cart) else o["items"]} for o in orders]
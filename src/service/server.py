@@ -0,0 +1,358 @@
+import argparse
+import asyncio
+import json
+import logging
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+
+from src.core.solve_cache import SolveCache
+
+# CartWizard 推薦 / 拆帳 HTTP 服務（asyncio，無額外相依套件）
+#   POST /split      {"items": [...], "mode": "greedy" | "optimal"}
+#   POST /recommend  {"items": [...]}
+#   GET  /health     存活檢查
+#   GET  /metrics    請求數、批次大小、延遲統計
+
+DISCOUNT_PATH = "data/raw/discounts.json"
+HOST = "127.0.0.1"
+PORT = 8000
+WORKERS = 2
+BATCH_WINDOW_MS = 5
+MAX_BATCH = 64
+MAX_BODY = 1 << 20
+
+log = logging.getLogger(__name__)
+
+# 購物車商品必要欄位與型別
+ITEM_FIELDS = {"id": str, "price": (int, float), "category": str}
+
+# ===== 拆帳：CPU 密集，丟給 worker process =====
+
+_cache = None
+
+def _init_worker(discount_path):
+    # 每個 worker 各自一份拆帳快取，discounts.json 更新時自動重新載入
+    global _cache
+    _cache = SolveCache(discount_path)
+    _cache.ruleset  # 先載入規則，第一個請求不用等
+
+def _ready():
+    return _cache is not None
+
+def _cache_stats():
+    return _cache.stats()
+
+def _split(items, mode):
+    orders = _cache(items, mode=mode)
+    return {
+        "orders": [
+            {
+                "items": o["items"],
+                "used_discounts": o["result"]["used_discounts"],
+                "final_price": o["result"]["final_price"],
+            }
+            for o in orders
+        ],
+        "final_price": sum(o["result"]["final_price"] for o in orders),
+        "total_discount": sum(o["result"]["total_discount"] for o in orders),
+    }
+
+# ===== 推薦：短時間內的請求合併成一次 predict =====
+
+class MicroBatcher:
+    def __init__(self, recommender, window_ms=BATCH_WINDOW_MS, max_batch=MAX_BATCH, metrics=None):
+        self.recommender = recommender
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.metrics = metrics
+        self.queue = asyncio.Queue()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # 停止合併迴圈；已排隊與計算中的請求一律以錯誤結束，不留下永遠等不到結果的 future
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while not self.queue.empty():
+            _, future = self.queue.get_nowait()
+            _fail(future, ServiceClosed())
+
+    async def submit(self, cart):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((cart, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        batch = []
+        try:
+            while True:
+                batch = [await self.queue.get()]
+                deadline = loop.time() + self.window
+                while len(batch) < self.max_batch:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+                await self._predict(loop, batch)
+                batch = []
+        except asyncio.CancelledError:
+            # 收集中或計算中的批次
+            for _, future in batch:
+                _fail(future, ServiceClosed())
+            raise
+
+    async def _predict(self, loop, batch):
+        carts = [cart for cart, _ in batch]
+        try:
+            # predict 會佔住 CPU，放到執行緒避免卡住 event loop
+            results = await loop.run_in_executor(None, self.recommender.recommend_many, carts)
+        except Exception as e:
+            if len(batch) == 1:
+                _fail(batch[0][1], e)
+                return
+            # 合併的批次失敗時逐台重試，只有出問題的購物車回報錯誤
+            results = []
+            for cart, future in batch:
+                try:
+                    results.append((await loop.run_in_executor(None, self.recommender.recommend_many, [cart]))[0])
+                except Exception as cart_error:
+                    _fail(future, cart_error)
+                    results.append(None)
+        if self.metrics:
+            self.metrics.observe_batch(len(batch))
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+class ServiceClosed(Exception):
+    pass
+
+def _fail(future, exc):
+    if not future.done():
+        future.set_exception(exc)
+
+# ===== 指標 =====
+
+class Metrics:
+    def __init__(self):
+        self.started = time.time()
+        self.requests = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.latency = defaultdict(float)
+        self.batches = 0
+        self.batched_requests = 0
+
+    def observe(self, route, seconds, ok=True):
+        self.requests[route] += 1
+        self.latency[route] += seconds
+        if not ok:
+            self.errors[route] += 1
+
+    def observe_batch(self, size):
+        self.batches += 1
+        self.batched_requests += size
+
+    def snapshot(self):
+        return {
+            "uptime_sec": round(time.time() - self.started, 3),
+            "requests": dict(self.requests),
+            "errors": dict(self.errors),
+            "avg_latency_ms": {
+                route: round(self.latency[route] / n * 1000, 3) for route, n in self.requests.items() if n
+            },
+            "recommend_batches": self.batches,
+            "avg_batch_size": round(self.batched_requests / self.batches, 3) if self.batches else 0,
+        }
+
+# ===== HTTP =====
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def _parse_cart(body):
+    try:
+        data = json.loads(body or b"{}")
+    except json.JSONDecodeError:
+        raise HttpError(HTTPStatus.BAD_REQUEST, "請求內容不是合法 JSON")
+    if not isinstance(data, dict) or not isinstance(data.get("items"), list):
+        raise HttpError(HTTPStatus.BAD_REQUEST, "缺少 items 陣列")
+    # 逐件檢查欄位：推薦請求會合併成一批預測，一台壞購物車不該拖垮同批的其他請求
+    for i, item in enumerate(data["items"]):
+        if not isinstance(item, dict):
+            raise HttpError(HTTPStatus.BAD_REQUEST, f"items[{i}] 不是物件")
+        for field, expected in ITEM_FIELDS.items():
+            value = item.get(field)
+            if isinstance(value, bool) or not isinstance(value, expected):
+                raise HttpError(HTTPStatus.BAD_REQUEST, f"items[{i}] 的 {field} 缺少或型別錯誤")
+    return data
+
+class CartWizardServer:
+    def __init__(self, discount_path=DISCOUNT_PATH, workers=WORKERS,
+                 batch_window_ms=BATCH_WINDOW_MS, max_batch=MAX_BATCH, recommender=None):
+        self.discount_path = discount_path
+        self.workers = workers
+        self.metrics = Metrics()
+        self.recommender = recommender
+        self.batch_window_ms = batch_window_ms
+        self.max_batch = max_batch
+        self.pool = None
+        self.batcher = None
+
+    async def start(self, host=HOST, port=PORT):
+        if self.workers > 0:
+            self.pool = ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(self.discount_path,))
+            # 開 socket 前先把 worker fork 出來，避免子程序繼承連線 fd 導致連線關不掉
+            self.pool.submit(_ready).result()
+        else:
+            _init_worker(self.discount_path)
+        if self.recommender is None:
+            from src.ai.predict_addon import get_recommender
+            self.recommender = get_recommender()
+        self.batcher = MicroBatcher(self.recommender, self.batch_window_ms, self.max_batch, self.metrics)
+        self.batcher.start()
+        return await asyncio.start_server(self._handle, host, port)
+
+    async def close(self):
+        if self.batcher:
+            await self.batcher.stop()
+        if self.pool:
+            self.pool.shutdown(cancel_futures=True)
+
+    async def route(self, method, path, body):
+        if path == "/health" and method == "GET":
+            return {"status": "ok"}
+        if path == "/metrics" and method == "GET":
+            snapshot = self.metrics.snapshot()
+            if not self.pool:
+                snapshot["solve_cache"] = _cache_stats()
+            return snapshot
+        if path == "/split" and method == "POST":
+            cart = _parse_cart(body)
+            mode = cart.get("mode", "greedy")
+            if mode not in ("greedy", "optimal"):
+                raise HttpError(HTTPStatus.BAD_REQUEST, f"未知的拆帳模式：{mode}")
+            if self.pool:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self.pool, _split, cart["items"], mode)
+            return _split(cart["items"], mode)
+        if path == "/recommend" and method == "POST":
+            cart = _parse_cart(body)
+            return {"cart_id": cart.get("cart_id"), "recommended": await self.batcher.submit(cart)}
+        if path in ("/health", "/metrics", "/split", "/recommend"):
+            raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED, f"不支援 {method}")
+        raise HttpError(HTTPStatus.NOT_FOUND, f"找不到路徑 {path}")
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    length = int(headers.get("content-length", 0) or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    # 無法判斷 body 長度，回應後關閉連線
+                    await self._respond(writer, HTTPStatus.BAD_REQUEST, {"error": "Content-Length 不合法"}, False)
+                    break
+                if length > MAX_BODY:
+                    await self._respond(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {"error": "請求內容過大"}, False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                path = target.split("?", 1)[0]
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                started = time.perf_counter()
+                try:
+                    status, payload = HTTPStatus.OK, await self.route(method, path, body)
+                except HttpError as e:
+                    status, payload = e.status, {"error": str(e)}
+                except ServiceClosed:
+                    status, payload = HTTPStatus.SERVICE_UNAVAILABLE, {"error": "服務關閉中"}
+                except Exception:
+                    # 細節只寫進 log，不回傳給客戶端
+                    log.exception("處理 %s %s 失敗", method, path)
+                    status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "伺服器內部錯誤"}
+                self.metrics.observe(path, time.perf_counter() - started, status == HTTPStatus.OK)
+
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        head = (
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+async def serve(host, port, **options):
+    app = CartWizardServer(**options)
+    server = await app.start(host, port)
+    print(f"🚀 CartWizard 服務啟動：http://{host}:{port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await app.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="CartWizard 推薦 / 拆帳服務")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=WORKERS, help="拆帳用的 worker process 數，0 表示在主程序計算")
+    parser.add_argument("--batch-window-ms", type=float, default=BATCH_WINDOW_MS, help="推薦請求合併等待時間")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    parser.add_argument("--discounts", default=DISCOUNT_PATH)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(
+            args.host, args.port,
+            discount_path=args.discounts,
+            workers=args.workers,
+            batch_window_ms=args.batch_window_ms,
+            max_batch=args.max_batch,
+        ))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
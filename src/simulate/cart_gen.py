@@ -2,10 +2,14 @@ import json
 import os
 import random
 
+from src.utils.cart_corpus import CartCorpusWriter
+
 PRODUCTS_PATH = 'data/raw/products.json'
 OUTPUT_DIR = 'data/carts/'
 NUM_CARTS = 100
 CART_SIZE = (3, 6)  # 每筆購物車商品數（最小, 最大）
+OUTPUT_FORMAT = 'json'  # 'json'：一車一檔；'corpus'：分片 JSONL 語料庫
+CORPUS_DIR = 'data/carts/corpus/'
 
 def load_products(path=PRODUCTS_PATH):
     with open(path, 'r', encoding='utf-8') as f:
@@ -26,7 +30,18 @@ def save_cart(cart, path):
 
 if __name__ == '__main__':
     products = load_products()
-    for i in range(1, NUM_CARTS + 1):
-        cart = generate_cart(products, i)
-        save_cart(cart, f"{OUTPUT_DIR}/cart_{i:03d}.json")
-    print(f"✅ 已產生 {NUM_CARTS} 筆購物車資料，儲存於 {OUTPUT_DIR}")
\ No newline at end of file
+    if OUTPUT_FORMAT == 'corpus':
+        # 語料庫只能追加，已存在的 cart_id 略過（重新產生請先刪除語料庫）
+        written = 0
+        with CartCorpusWriter(CORPUS_DIR) as writer:
+            for i in range(1, NUM_CARTS + 1):
+                cart = generate_cart(products, i)
+                if cart['cart_id'] not in writer:
+                    writer.write(cart)
+                    written += 1
+        print(f"✅ 已產生 {written} 筆購物車資料，寫入語料庫 {CORPUS_DIR}（略過已存在 {NUM_CARTS - written} 筆）")
+    else:
+        for i in range(1, NUM_CARTS + 1):
+            cart = generate_cart(products, i)
+            save_cart(cart, f"{OUTPUT_DIR}/cart_{i:03d}.json")
+        print(f"✅ 已產生 {NUM_CARTS} 筆購物車資料，儲存於 {OUTPUT_DIR}")
\ No newline at end of file
@@ -0,0 +1,243 @@
+import argparse
+import json
+import os
+import random
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+
+from tqdm import tqdm
+
+from src.core.rule_loader import load_rules
+from src.utils.cart_corpus import CartCorpus, CartCorpusWriter, is_corpus
+
+# 大量購物車產生器：auto（容易觸發折扣）與 targeted（差一件觸發折扣）
+#   python -m src.simulate.cart_gen_bulk --kind auto --count 1000000 --seed 7 --workers 8 --format corpus
+# 每 CHUNK_SIZE 台購物車使用一個由 (seed, 種類, 起始編號) 決定的 RNG，
+# 所以輸出與 worker 數無關，同樣的參數永遠產生同樣的購物車
+
+PRODUCT_PATH = "data/raw/products.json"
+DISCOUNT_PATH = "data/raw/discounts.json"
+CHUNK_SIZE = 10_000
+
+KINDS = {
+    # 種類 → (cart_id 前綴, 一車一檔的輸出資料夾, 語料庫資料夾)
+    "auto": ("auto_", "data/carts/", "data/carts/corpus/"),
+    "targeted": ("targeted_", "data/carts/targeted/", "data/carts/targeted/corpus/"),
+}
+
+AUTO_BOOST_RANGE = (3, 6)
+AUTO_SIZE_RANGE = (15, 25)
+TARGETED_SIZE_RANGE = (10, 20)
+TARGETED_MAX_GAP = 300
+
+
+def load_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def cart_item(p):
+    return {"id": p["id"], "price": p["price"], "category": p["category"]}
+
+
+class CartPools:
+    # 商品池只在建立時整理一次：全部商品、容易觸發折扣的商品、各滿額規則的分類商品、滿件規則的商品
+    def __init__(self, products, discounts):
+        self.products = list(products)
+        self.product_dict = {p["id"]: p for p in self.products}
+
+        boost = set()
+        for d in discounts:
+            if d["type"] in ["滿件折扣", "組合折扣", "獨立折扣"] and "items" in d:
+                boost.update(d["items"])
+        self.boost = [self.product_dict[pid] for pid in sorted(boost) if pid in self.product_dict]
+
+        by_category = {}
+        for p in self.products:
+            by_category.setdefault(p["category"], []).append(p)
+
+        # targeted：依規則順序嘗試，與原本的 pick_items_near_threshold 相同
+        self.targets = []
+        for d in discounts:
+            if d["type"] == "滿額折扣":
+                self.targets.append(("amount", d["threshold"], by_category.get(d["category"], [])))
+            elif d["type"] == "滿件折扣" and "items" in d and d["count"] > 1 and len(d["items"]) >= d["count"]:
+                self.targets.append(("count", d["count"] - 1, list(d["items"])))
+
+
+def _lazy_shuffle(pool, rng):
+    # 逐個產生隨機排列（Fisher–Yates），只花實際取用的步數，不複製整個商品池
+    swapped = {}
+    n = len(pool)
+    for i in range(n):
+        j = rng.randrange(i, n)
+        pick = swapped.get(j, j)
+        swapped[j] = swapped.get(i, i)
+        yield pool[pick]
+
+
+def _fill_random(items, used_ids, pools, rng, size_range):
+    # 每次檢查都重新抽目標件數（沿用原本腳本的件數分布）
+    products = pools.products
+    while len(items) < rng.randint(*size_range):
+        p = products[rng.randrange(len(products))]
+        if p["id"] not in used_ids:
+            items.append(cart_item(p))
+            used_ids.add(p["id"])
+
+
+def auto_cart(pools, rng, cart_id):
+    items = []
+    used_ids = set()
+    k = rng.randint(*AUTO_BOOST_RANGE)
+    for p in rng.sample(pools.boost, min(k, len(pools.boost))):
+        items.append(cart_item(p))
+        used_ids.add(p["id"])
+    _fill_random(items, used_ids, pools, rng, AUTO_SIZE_RANGE)
+    return {"cart_id": cart_id, "items": items}
+
+
+def _near_threshold(pools, rng):
+    for kind, target, pool in pools.targets:
+        if kind == "amount":
+            total = 0
+            picked = []
+            for p in _lazy_shuffle(pool, rng):
+                if total + p["price"] >= target:
+                    continue
+                picked.append(p)
+                total += p["price"]
+                if target - total < TARGETED_MAX_GAP:
+                    return picked
+        else:
+            return [pools.product_dict[pid] for pid in rng.sample(pool, target) if pid in pools.product_dict]
+    return []
+
+
+def targeted_cart(pools, rng, cart_id):
+    # 找不到接近門檻的組合時回傳 None（該編號略過）
+    base = _near_threshold(pools, rng)
+    if not base:
+        return None
+    items = []
+    used_ids = set()
+    for p in base:
+        items.append(cart_item(p))
+        used_ids.add(p["id"])
+    _fill_random(items, used_ids, pools, rng, TARGETED_SIZE_RANGE)
+    return {"cart_id": cart_id, "items": items}
+
+
+BUILDERS = {"auto": auto_cart, "targeted": targeted_cart}
+
+# ===== worker：每個 process 只整理一次商品池 =====
+
+_pools = None
+
+
+def _init_worker(product_path, discount_path):
+    global _pools
+    _pools = CartPools(load_json(product_path), load_rules(discount_path))
+
+
+def _chunk_rng(seed, kind, start):
+    return random.Random(f"{seed}:{kind}:{start}")
+
+
+def generate_chunk(kind, seed, start, stop, fmt, output_dir):
+    # 產生編號 [start, stop) 的購物車；json 格式直接寫檔，corpus 格式回傳 (cart_id, JSON 行) 交給主程序依序寫入
+    prefix = KINDS[kind][0]
+    build = BUILDERS[kind]
+    rng = _chunk_rng(seed, kind, start)
+    lines = []
+    count = 0
+    for i in range(start, stop):
+        cart = build(_pools, rng, f"{prefix}{i:04}")
+        if cart is None:
+            continue
+        count += 1
+        if fmt == "corpus":
+            lines.append((cart["cart_id"], (json.dumps(cart, ensure_ascii=False) + "\n").encode("utf-8")))
+        else:
+            with open(os.path.join(output_dir, f"{cart['cart_id']}.json"), "w", encoding="utf-8") as f:
+                json.dump(cart, f, ensure_ascii=False, indent=2)
+    return count, lines
+
+
+def next_index(kind, fmt, output_dir, corpus_dir):
+    # 接續目前已存在的最大編號
+    prefix = KINDS[kind][0]
+    if fmt == "corpus":
+        ids = CartCorpus(corpus_dir).ids() if is_corpus(corpus_dir) else []
+        existing = [int(cid.split(prefix)[1]) for cid in ids if cid.startswith(prefix)]
+    else:
+        existing = [int(f.split(prefix)[1].split(".json")[0]) for f in os.listdir(output_dir) if f.startswith(prefix)]
+    return max(existing) + 1 if existing else 1
+
+
+def generate(kind="auto", count=1000, seed=None, workers=1, fmt="json", output_dir=None, corpus_dir=None,
+             product_path=PRODUCT_PATH, discount_path=DISCOUNT_PATH, start=None):
+    # 回傳 (實際產生的購物車數, 起始編號)；seed=None 時隨機選一個
+    _, default_dir, default_corpus = KINDS[kind]
+    output_dir = output_dir or default_dir
+    corpus_dir = corpus_dir or default_corpus
+    os.makedirs(output_dir, exist_ok=True)
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    if start is None:
+        start = next_index(kind, fmt, output_dir, corpus_dir)
+    chunks = [(s, min(s + CHUNK_SIZE, start + count)) for s in range(start, start + count, CHUNK_SIZE)]
+
+    total = 0
+    # 出錯時 with 也會關閉語料庫，已寫入的購物車與索引保留在 meta 中
+    with CartCorpusWriter(corpus_dir) if fmt == "corpus" else nullcontext() as writer, \
+            tqdm(total=count, desc=f"📦 產生 {kind} 購物車") as progress:
+        for (a, b), (n, lines) in zip(chunks, _run_chunks(chunks, kind, seed, fmt, output_dir, workers,
+                                                          product_path, discount_path)):
+            if writer:
+                for cart_id, line in lines:
+                    writer.write_line(cart_id, line)
+            total += n
+            progress.update(b - a)
+    return total, start
+
+
+def _run_chunks(chunks, kind, seed, fmt, output_dir, workers, product_path, discount_path):
+    # 依區段順序產出結果；同時在跑的區段最多 workers * 2 個，避免結果堆在記憶體
+    if workers <= 1:
+        _init_worker(product_path, discount_path)
+        for a, b in chunks:
+            yield generate_chunk(kind, seed, a, b, fmt, output_dir)
+        return
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(product_path, discount_path)) as pool:
+        pending = deque()
+        for a, b in chunks:
+            pending.append(pool.submit(generate_chunk, kind, seed, a, b, fmt, output_dir))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="大量產生模擬購物車（可重現、多 process）")
+    parser.add_argument("--kind", choices=list(KINDS), default="auto")
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=None, help="相同 seed 與起始編號產生相同購物車")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--format", choices=["json", "corpus"], default="corpus",
+                        help="json：一車一檔；corpus：分片 JSONL 語料庫")
+    parser.add_argument("--output-dir", help="json 格式的輸出資料夾")
+    parser.add_argument("--corpus-dir", help="corpus 格式的語料庫資料夾")
+    args = parser.parse_args()
+
+    total, start = generate(args.kind, args.count, args.seed, args.workers, args.format,
+                            args.output_dir, args.corpus_dir)
+    prefix = KINDS[args.kind][0]
+    print(f"✅ 已產生 {total} 筆 {args.kind} 購物車資料，從 {prefix}{start:04} 開始")
+
+
+if __name__ == "__main__":
+    main()
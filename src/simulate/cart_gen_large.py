@@ -2,10 +2,14 @@ import json
 import os
 import random
 
+from src.utils.cart_corpus import CartCorpusWriter
+
 PRODUCTS_PATH = 'data/raw/products.json'
 OUTPUT_DIR = 'data/carts/'
 NUM_CARTS = 5
 ITEM_COUNT_RANGE = (15, 25)
+OUTPUT_FORMAT = 'json'  # 'json'：一車一檔；'corpus'：分片 JSONL 語料庫
+CORPUS_DIR = 'data/carts/corpus/'
 
 # 你的三個極端折扣要匹配的商品組合
 EXTREME_DISCOUNTS = {
@@ -56,8 +60,18 @@ def save_cart(cart, path):
 
 if __name__ == '__main__':
     products = load_products()
-    for i in range(1, NUM_CARTS + 1):
-        cart = build_cart(f"CEXT{i:03d}", products)
-        path = f"{OUTPUT_DIR}/cart_extreme_{i:03d}.json"
-        save_cart(cart, path)
-        print(f"✅ 已產生：{path}")
+    if OUTPUT_FORMAT == 'corpus':
+        # 語料庫只能追加，已存在的 cart_id 略過（重新產生請先刪除語料庫）
+        written = 0
+        with CartCorpusWriter(CORPUS_DIR) as writer:
+            for i in range(1, NUM_CARTS + 1):
+                if f"CEXT{i:03d}" not in writer:
+                    writer.write(build_cart(f"CEXT{i:03d}", products))
+                    written += 1
+        print(f"✅ 已產生 {written} 筆，寫入語料庫 {CORPUS_DIR}（略過已存在 {NUM_CARTS - written} 筆）")
+    else:
+        for i in range(1, NUM_CARTS + 1):
+            cart = build_cart(f"CEXT{i:03d}", products)
+            path = f"{OUTPUT_DIR}/cart_extreme_{i:03d}.json"
+            save_cart(cart, path)
+            print(f"✅ 已產生：{path}")
@@ -0,0 +1,234 @@
+import argparse
+import heapq
+import json
+import os
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+
+from tqdm import tqdm
+
+from src.core.rule_loader import load_rules
+from src.core.ruleset import CartStats, CompiledRuleSet
+from src.core.solve_cache import SolveCache
+from src.utils.cart_corpus import iter_carts
+
+# 規則變更影響模擬：上線新的 discounts.json 前，用既有購物車估算營收與發票張數的變化
+#   python -m src.simulate.rule_impact data/raw/discounts.json new_discounts.json --workers 8 --out impact.json
+#
+# 只有「有變更的規則」（新增 / 刪除 / 內容改變，以 id 比對）可能改變拆帳結果；
+# 以這些規則建立倒排索引（商品 ID / 分類 / 品牌 → 規則），整車都觸發不了任何變更規則的購物車
+# 新舊結果必定相同（觸發條件對商品單調，拆出的每張發票都是整車的子集合），直接沿用舊規則的結果。
+# 舊規則算全部購物車、新規則只算受影響的購物車，兩邊同時進行，結果都經過拆帳快取（含磁碟層），
+# 同一份舊規則反覆比較不同草稿時不用重算。
+
+DISCOUNT_PATH = "data/raw/discounts.json"
+PRODUCT_PATH = "data/raw/products.json"
+SOLVE_CACHE_PATH = "data/training/solve_cache.sqlite"
+SIM_DIR = "data/user_simulated/"
+SOURCES = {
+    # 來源 → (一車一檔的資料夾, 語料庫資料夾)；user_simulated 另外處理
+    "carts": ("data/carts/", "data/carts/corpus/"),
+    "targeted": ("data/carts/targeted/", "data/carts/targeted/corpus/"),
+}
+TOP_CARTS = 10
+
+
+def load_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def iter_simulated(sim_dir=SIM_DIR, product_path=PRODUCT_PATH):
+    # 使用者模擬回饋：接受推薦時把加購商品一起結帳
+    product_dict = None
+    for path in sorted(glob(os.path.join(sim_dir, "*.json"))):
+        sim = load_json(path)
+        items = list(sim["base_items"])
+        if sim.get("accepted"):
+            if product_dict is None:
+                product_dict = {p["id"]: p for p in load_json(product_path)}
+            if sim.get("recommended") in product_dict:
+                items.append(product_dict[sim["recommended"]])
+        yield {"cart_id": sim.get("cart_id", os.path.basename(path)[:-len(".json")]), "items": items}
+
+
+def iter_sources(sources):
+    for name in sources:
+        if name == "user_simulated":
+            yield from iter_simulated()
+        else:
+            json_dir, corpus_dir = SOURCES[name]
+            yield from iter_carts(json_dir, "*.json", corpus_dir)
+
+
+def diff_rules(old_rules, new_rules):
+    # 回傳 {id: added / removed / modified / unchanged} 與是否調整了未變更規則的先後順序
+    old_by_id = {d["id"]: d for d in old_rules}
+    new_by_id = {d["id"]: d for d in new_rules}
+    status = {}
+    for rid in old_by_id.keys() | new_by_id.keys():
+        if rid not in new_by_id:
+            status[rid] = "removed"
+        elif rid not in old_by_id:
+            status[rid] = "added"
+        else:
+            status[rid] = "unchanged" if old_by_id[rid] == new_by_id[rid] else "modified"
+    # exclusive 的處理順序與 select 的優先順序都看規則位置，順序變了只能全部重算
+    kept = lambda rules: [d["id"] for d in rules if status[d["id"]] == "unchanged"]
+    return status, kept(old_rules) != kept(new_rules)
+
+
+class ChangeIndex:
+    # 變更規則（新舊兩個版本）的倒排索引；evaluate 沿用 CompiledRuleSet 的商品 / 分類 / 品牌索引
+    def __init__(self, old_rules, new_rules, status, reordered=False):
+        self.full = reordered
+        changed = [d for d in old_rules + new_rules if status[d["id"]] != "unchanged"]
+        self.ruleset = CompiledRuleSet(changed)
+
+    def touches(self, cart_items):
+        # 整車可讓任一變更規則折出金額（或規則順序變了）時需要以新規則重算
+        return self.full or bool(self.ruleset.evaluate(CartStats.from_items(cart_items)))
+
+
+class Tally:
+    def __init__(self):
+        self.carts = 0
+        self.revenue = 0
+        self.discount = 0
+        self.invoices = 0
+        self.rule_amount = defaultdict(int)
+        self.rule_uses = defaultdict(int)
+
+    def add(self, orders):
+        self.carts += 1
+        self.invoices += len(orders)
+        for o in orders:
+            result = o["result"]
+            self.revenue += result["final_price"]
+            self.discount += result["total_discount"]
+            for d in result["used_discounts"]:
+                self.rule_amount[d["id"]] += d["amount"]
+                self.rule_uses[d["id"]] += 1
+
+
+def _price(orders):
+    return sum(o["result"]["final_price"] for o in orders)
+
+
+def _reprice(carts, solve_cache, index, workers, mode, only_touched):
+    # 回傳 (所有送去計算的購物車統計, 受影響購物車統計, 受影響購物車的 [(cart_id, 應付金額)])
+    queued = deque()
+
+    def feed():
+        for cart in carts:
+            hit = index.touches(cart["items"])
+            if hit or not only_touched:
+                queued.append(cart["cart_id"] if hit else None)
+                yield cart["items"]
+
+    total, touched, prices = Tally(), Tally(), []
+    for orders in solve_cache.solve_many(feed(), mode=mode, workers=workers):
+        cart_id = queued.popleft()
+        total.add(orders)
+        if cart_id is not None:
+            touched.add(orders)
+            prices.append((cart_id, _price(orders)))
+    return total, touched, prices
+
+
+def _delta(old, new):
+    return {"old": old, "new": new, "delta": new - old}
+
+
+def simulate(old_path, new_path, sources=("carts", "targeted", "user_simulated"), workers=1, mode="greedy",
+             cache_path=SOLVE_CACHE_PATH, top=TOP_CARTS):
+    old_rules, new_rules = load_rules(old_path), load_rules(new_path)
+    status, reordered = diff_rules(old_rules, new_rules)
+    index = ChangeIndex(old_rules, new_rules, status, reordered)
+    old_cache = SolveCache(rules=old_rules, disk_path=cache_path or None)
+    new_cache = SolveCache(rules=new_rules, disk_path=cache_path or None)
+
+    # 舊規則：全部購物車；新規則：只算受影響的購物車，兩邊各自平行計算、同時進行
+    with ThreadPoolExecutor(2) as pool:
+        old_job = pool.submit(_reprice, tqdm(iter_sources(sources), desc="🔄 重新拆帳中"),
+                              old_cache, index, workers, mode, False)
+        new_job = pool.submit(_reprice, iter_sources(sources), new_cache, index, workers, mode, True)
+        old_all, old_hit, old_prices = old_job.result()
+        _, new_hit, new_prices = new_job.result()
+    old_cache.close()
+    new_cache.close()
+
+    # 沒受影響的購物車新舊結果相同：新規則的總計 = 舊總計 - 受影響購物車的舊結果 + 新結果
+    shift = lambda attr: getattr(old_all, attr) - getattr(old_hit, attr) + getattr(new_hit, attr)
+    rules = []
+    for rid in sorted(set(old_all.rule_amount) | set(new_hit.rule_amount) | set(status)):
+        old_amount, old_uses = old_all.rule_amount.get(rid, 0), old_all.rule_uses.get(rid, 0)
+        new_amount = old_amount - old_hit.rule_amount.get(rid, 0) + new_hit.rule_amount.get(rid, 0)
+        new_uses = old_uses - old_hit.rule_uses.get(rid, 0) + new_hit.rule_uses.get(rid, 0)
+        rule_status = status.get(rid, "unchanged")
+        if rule_status != "unchanged" or new_amount != old_amount or new_uses != old_uses:
+            rules.append({"id": rid, "status": rule_status,
+                          "discount": _delta(old_amount, new_amount), "uses": _delta(old_uses, new_uses)})
+    rules.sort(key=lambda r: -abs(r["discount"]["delta"]))
+
+    carts = [{"cart_id": cid, **_delta(old, new)}
+             for (cid, old), (_, new) in zip(old_prices, new_prices) if old != new]
+    return {
+        "old": old_path,
+        "new": new_path,
+        "sources": list(sources),
+        "mode": mode,
+        "changes": {kind: sorted(rid for rid, s in status.items() if s == kind)
+                    for kind in ("added", "removed", "modified")},
+        "reordered": reordered,
+        "carts": old_all.carts,
+        "repriced_carts": new_hit.carts,
+        "reused_rate": round(1 - new_hit.carts / old_all.carts, 4) if old_all.carts else 0,
+        "aggregate": {
+            "revenue": _delta(old_all.revenue, shift("revenue")),
+            "total_discount": _delta(old_all.discount, shift("discount")),
+            "invoices": _delta(old_all.invoices, shift("invoices")),
+            "carts_price_changed": len(carts),
+        },
+        "rules": rules,
+        "top_carts": heapq.nlargest(top, carts, key=lambda c: abs(c["delta"])),
+        "solve_cache": {"old": old_cache.stats(), "new": new_cache.stats()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="規則變更影響模擬：以既有購物車比較新舊折扣規則")
+    parser.add_argument("old", nargs="?", default=DISCOUNT_PATH, help="目前的規則（預設 data/raw/discounts.json）")
+    parser.add_argument("new", help="準備上線的規則")
+    parser.add_argument("--sources", nargs="+", choices=list(SOURCES) + ["user_simulated"],
+                        default=list(SOURCES) + ["user_simulated"])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="每個規則版本的拆帳 process 數（1 = 單一程序）")
+    parser.add_argument("--mode", choices=["greedy", "optimal"], default="greedy")
+    parser.add_argument("--cache", default=SOLVE_CACHE_PATH, help="拆帳結果的磁碟快取（空字串停用）")
+    parser.add_argument("--top", type=int, default=TOP_CARTS, help="列出金額變化最大的購物車數")
+    parser.add_argument("--out", help="輸出完整報告 JSON")
+    args = parser.parse_args()
+
+    report = simulate(args.old, args.new, args.sources, args.workers, args.mode, args.cache, args.top)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    agg = report["aggregate"]
+    print(f"📋 新增 {len(report['changes']['added'])}、刪除 {len(report['changes']['removed'])}、"
+          f"修改 {len(report['changes']['modified'])} 條規則" + ("（規則順序有變，全部重算）" if report["reordered"] else ""))
+    print(f"🛒 購物車 {report['carts']} 台，重算 {report['repriced_carts']} 台，"
+          f"金額改變 {agg['carts_price_changed']} 台")
+    for name, label in (("revenue", "營收"), ("total_discount", "折扣"), ("invoices", "發票張數")):
+        d = agg[name]
+        print(f"   {label}：{d['old']} → {d['new']}（{d['delta']:+}）")
+    for r in report["rules"]:
+        print(f"   [{r['status']}] {r['id']}：折扣 {r['discount']['delta']:+}，使用次數 {r['uses']['delta']:+}")
+    if args.out:
+        print(f"✅ 報告已儲存至 {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@ from copy import deepcopy
 
 from core.solver import solve_cart_split, solve_cart
 from core.discount import apply_discount
+from core.rule_loader import load_rules
 
 CART_PATH = "data/carts/cart_extreme_005.json"
 DISCOUNT_PATH = "data/raw/discounts.json"
@@ -143,7 +144,7 @@ if __name__ == "__main__":
         exit(1)
 
     cart = load_json(CART_PATH)
-    discount_rules = load_json(DISCOUNT_PATH)
+    discount_rules = load_rules(DISCOUNT_PATH)
 
     split_orders = solve_cart_split(cart["items"], discount_rules)
     print_split_result(split_orders)
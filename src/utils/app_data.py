@@ -0,0 +1,115 @@
+import json
+import os
+
+import streamlit as st
+
+from src.ai.predict_addon import RANKER_META_PATH, RANKER_PATH, get_recommender, reset_recommender
+from src.core.rule_loader import load_rules
+
+# Streamlit 頁面共用的資料層：每次互動都會重跑整個頁面，
+# 商品、折扣規則、樣式與推薦器改由 st.cache_resource 在每個 process 只載入一次；
+# 快取 key 帶檔案的 mtime，檔案更新後下一次重跑自動重新載入。回傳的物件為共用，頁面請勿修改
+
+PRODUCT_PATH = "data/raw/products.json"
+DISCOUNT_PATH = "data/raw/discounts.json"
+STYLE_PATH = "assets/style.css"
+
+# 上次取得推薦器時的 (商品 mtime, 規則 mtime, 是否有排序模型)
+_recommender_stamp = None
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+class Catalog:
+    def __init__(self, products):
+        self.products = products
+        self.by_id = {p["id"]: p for p in products}
+        self.name_map = {p["id"]: p["name"] for p in products}
+        self.categories = sorted(set(p["category"] for p in products))
+
+
+def discount_types_by_product(products, discount_rules):
+    # 商品 ID → 適用的折扣類型（排序後的 tuple）：指定商品的規則（items）與百分比折扣
+    # （單品看 product_id、分類看 category、品牌看 brand、限時折扣適用全部商品）
+    by_item, by_category, by_brand, every = {}, {}, {}, set()
+    for d in discount_rules:
+        rule_type = d.get("type")
+        if "items" in d:
+            for pid in d["items"]:
+                by_item.setdefault(pid, set()).add(rule_type)
+        elif rule_type == "單品折扣":
+            by_item.setdefault(d["product_id"], set()).add(rule_type)
+        elif rule_type == "分類折扣":
+            by_category.setdefault(d["category"], set()).add(rule_type)
+        elif rule_type == "品牌折扣":
+            by_brand.setdefault(d["brand"], set()).add(rule_type)
+        elif rule_type == "限時折扣":
+            every.add(rule_type)
+
+    index = {}
+    for p in products:
+        types = every | by_item.get(p["id"], set()) | by_category.get(p["category"], set())
+        if p.get("brand") is not None:
+            types |= by_brand.get(p["brand"], set())
+        index[p["id"]] = tuple(sorted(types))
+    return index
+
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _catalog(path, mtime):
+    with open(path, encoding="utf-8") as f:
+        return Catalog(json.load(f))
+
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _discounts(path, mtime):
+    # 已檢查過的規則（停用規則不列出）
+    return load_rules(path)
+
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _discount_index(product_path, product_mtime, discount_path, discount_mtime):
+    return discount_types_by_product(_catalog(product_path, product_mtime).products,
+                                     _discounts(discount_path, discount_mtime))
+
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _style(path, mtime):
+    with open(path, encoding="utf-8") as f:
+        return f"<style>{f.read()}</style>"
+
+
+def catalog(path=PRODUCT_PATH):
+    return _catalog(path, _mtime(path))
+
+
+def discounts(path=DISCOUNT_PATH):
+    return _discounts(path, _mtime(path))
+
+
+def discount_index(product_path=PRODUCT_PATH, discount_path=DISCOUNT_PATH):
+    return _discount_index(product_path, _mtime(product_path), discount_path, _mtime(discount_path))
+
+
+def inject_style(path=STYLE_PATH):
+    st.markdown(_style(path, _mtime(path)), unsafe_allow_html=True)
+
+
+def recommender():
+    # 與服務共用 predict_addon 的 Recommender；商品或規則更新時重建（候選目錄與門檻跟著換），
+    # 模型檔本身的更新由 reload_if_changed 重載
+    global _recommender_stamp
+    ranker = os.path.exists(RANKER_PATH) and os.path.exists(RANKER_META_PATH)
+    stamp = (_mtime(PRODUCT_PATH), _mtime(DISCOUNT_PATH), ranker)
+    if _recommender_stamp is not None and stamp != _recommender_stamp:
+        rec = reset_recommender()
+    else:
+        rec = get_recommender()
+        rec.reload_if_changed()
+    _recommender_stamp = stamp
+    return rec
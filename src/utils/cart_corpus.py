@@ -0,0 +1,186 @@
+import gzip
+import json
+import os
+from glob import glob
+
+# 購物車語料庫：分片 JSONL（可選 gzip）+ 索引，取代「一車一個 JSON 檔」
+#
+#   <root>/carts-00000.jsonl[.gz]   每行一台購物車
+#   <root>/index.tsv                cart_id \t 分片編號 \t 位移（未壓縮串流中的 byte offset）
+#   <root>/meta.json                分片清單與是否壓縮
+
+SHARD_SIZE = 100_000
+INDEX_NAME = "index.tsv"
+META_NAME = "meta.json"
+
+
+def is_corpus(path):
+    return os.path.exists(os.path.join(path, META_NAME))
+
+
+def _open_shard(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+class CartCorpusWriter:
+    # 追加寫入：既有語料庫會從下一個分片開始寫，不動舊分片；cart_id 不可與已寫入的重複
+    def __init__(self, root, shard_size=SHARD_SIZE, compress=False):
+        self.root = root
+        self.shard_size = shard_size
+        os.makedirs(root, exist_ok=True)
+
+        meta_path = os.path.join(root, META_NAME)
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                self.meta = json.load(f)
+        else:
+            self.meta = {"compress": compress, "shards": []}
+        self.compress = self.meta["compress"]
+
+        index_path = os.path.join(root, INDEX_NAME)
+        self.ids = set()
+        if os.path.exists(index_path):
+            with open(index_path, "r", encoding="utf-8") as f:
+                self.ids.update(line.split("\t", 1)[0] for line in f)
+        self._index = open(index_path, "a", encoding="utf-8")
+        self._shard = None
+        self._count = 0
+
+    def _next_shard(self):
+        self._close_shard()
+        name = f"carts-{len(self.meta['shards']):05d}.jsonl" + (".gz" if self.compress else "")
+        self.meta["shards"].append(name)
+        self._shard = _open_shard(os.path.join(self.root, name), "wb")
+        self._offset = 0
+        self._count = 0
+        # 開新分片就更新 meta：中途當掉時，下次寫入會接在這個分片之後，不會覆寫它
+        self._index.flush()
+        self._write_meta()
+
+    def _write_meta(self):
+        path = os.path.join(self.root, META_NAME)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, ensure_ascii=False, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def _close_shard(self):
+        if self._shard:
+            self._shard.close()
+            self._shard = None
+
+    def write(self, cart):
+        self.write_line(cart["cart_id"], (json.dumps(cart, ensure_ascii=False) + "\n").encode("utf-8"))
+
+    def write_line(self, cart_id, line):
+        # line：已序列化的一行（UTF-8 bytes，含換行），供多 process 產生器直接寫入
+        if cart_id in self.ids:
+            raise ValueError(f"語料庫中已有購物車 {cart_id}：{self.root}")
+        self.ids.add(cart_id)
+        if self._shard is None or self._count >= self.shard_size:
+            self._next_shard()
+        self._shard.write(line)
+        self._index.write(f"{cart_id}\t{len(self.meta['shards']) - 1}\t{self._offset}\n")
+        self._offset += len(line)
+        self._count += 1
+
+    def __contains__(self, cart_id):
+        return cart_id in self.ids
+
+    def close(self):
+        self._close_shard()
+        self._index.close()
+        self._write_meta()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CartCorpus:
+    def __init__(self, root):
+        self.root = root
+        with open(os.path.join(root, META_NAME), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self._index = None
+        self._handles = {}
+
+    @property
+    def index(self):
+        # cart_id → (分片編號, 位移)，第一次隨機存取時才載入
+        if self._index is None:
+            self._index = {}
+            with open(os.path.join(self.root, INDEX_NAME), "r", encoding="utf-8") as f:
+                for line in f:
+                    cart_id, shard, offset = line.rstrip("\n").split("\t")
+                    self._index[cart_id] = (int(shard), int(offset))
+        return self._index
+
+    def ids(self):
+        # 依寫入順序列出 cart_id（不載入整份索引）
+        with open(os.path.join(self.root, INDEX_NAME), "r", encoding="utf-8") as f:
+            for line in f:
+                yield line.split("\t", 1)[0]
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, cart_id):
+        return cart_id in self.index
+
+    def __iter__(self):
+        # 依序串流讀取，不需索引
+        for name in self.meta["shards"]:
+            with _open_shard(os.path.join(self.root, name), "rb") as f:
+                for line in f:
+                    yield json.loads(line)
+
+    def get(self, cart_id):
+        shard, offset = self.index[cart_id]
+        f = self._handles.get(shard)
+        if f is None:
+            f = self._handles[shard] = _open_shard(os.path.join(self.root, self.meta["shards"][shard]), "rb")
+        # gzip 分片往後 seek 只需解壓中間的區段，依序存取時成本很低
+        f.seek(offset)
+        return json.loads(f.readline())
+
+    def close(self):
+        for f in self._handles.values():
+            f.close()
+        self._handles = {}
+
+
+def iter_carts(json_dir, pattern="*.json", corpus_dir=None):
+    # 先讀一車一檔的舊格式，再讀語料庫
+    for path in sorted(glob(os.path.join(json_dir, pattern))):
+        with open(path, "r", encoding="utf-8") as f:
+            yield json.load(f)
+    if corpus_dir and is_corpus(corpus_dir):
+        yield from CartCorpus(corpus_dir)
+
+
+def migrate_json_dir(json_dir, root, pattern="*.json", shard_size=SHARD_SIZE, compress=True):
+    # 把一車一檔的資料夾轉成語料庫
+    count = 0
+    with CartCorpusWriter(root, shard_size=shard_size, compress=compress) as writer:
+        for cart in iter_carts(json_dir, pattern):
+            writer.write(cart)
+            count += 1
+    return count
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="將一車一檔的 JSON 資料夾轉成分片語料庫")
+    parser.add_argument("json_dir")
+    parser.add_argument("root")
+    parser.add_argument("--pattern", default="*.json")
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE)
+    parser.add_argument("--no-compress", action="store_true")
+    args = parser.parse_args()
+    n = migrate_json_dir(args.json_dir, args.root, args.pattern, args.shard_size, not args.no_compress)
+    print(f"✅ 已轉換 {n} 筆購物車 → {args.root}")